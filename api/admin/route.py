@@ -0,0 +1,50 @@
+"""管理 API 路由（需設定 ADMIN_TOKEN）。"""
+from fastapi import APIRouter, Header
+from starlette.concurrency import run_in_threadpool
+import hmac
+import logging
+import config
+from lib.dependencies import get_snapshot, reload_delegated, reload_resources, touch_reload_trigger
+from lib.exceptions import AuthenticationError, ResourceNotFoundError, ValidationError
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def require_admin(authorization: str) -> None:
+    """驗證管理權杖；未設定 ADMIN_TOKEN 時視同端點不存在。"""
+    if not config.ADMIN_TOKEN:
+        raise ResourceNotFoundError()
+    if not authorization:
+        raise ValidationError("缺少 Authorization header")
+
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise ValidationError("無效的 Authorization header 格式")
+
+    if not hmac.compare_digest(parts[1].encode("utf-8"), config.ADMIN_TOKEN.encode("utf-8")):
+        raise AuthenticationError("無效的管理權杖")
+
+
+@router.get("/resources")
+async def get_resources(authorization: str = Header(None)) -> dict:
+    """目前使用中的資源快照（Authorization: Bearer <ADMIN_TOKEN>）。"""
+    require_admin(authorization)
+    return get_snapshot().describe()
+
+
+@router.post("/reload")
+async def reload(authorization: str = Header(None)) -> dict:
+    """重新載入歌曲資料與向量集合（Authorization: Bearer <ADMIN_TOKEN>）。"""
+    require_admin(authorization)
+    if reload_delegated():
+        # pre-fork：主程序偵測到觸發檔變更後重新載入並替換所有 worker。
+        await run_in_threadpool(touch_reload_trigger)
+        logger.info("管理端點觸發重新載入，由主程序替換 worker")
+        return {"status": "scheduled", **get_snapshot().describe()}
+    # 先更新觸發檔，同一主機上的其他 worker 會由監看器重新載入；
+    # 本 worker 的新快照記錄的是更新後的時間戳記，不會再重複載入。
+    touch_reload_trigger()
+    snapshot = await run_in_threadpool(reload_resources, "管理端點")
+    logger.info(f"管理端點觸發重新載入，目前為第 {snapshot.version} 版")
+    return {"status": "reloaded", **snapshot.describe()}
@@ -2,30 +2,56 @@
 from fastapi import APIRouter, Depends, Header, Request
 from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel, Field
-from typing import Optional
-import json
+from starlette.concurrency import run_in_threadpool
+from typing import TYPE_CHECKING, Any, Callable, Optional
+import asyncio
 import logging
 from uuid import uuid4
-import chromadb
-from google import genai
 import config
 from lib.auth import validate_token
 from lib.auth.token_manager import logout_user
-from lib.auth.validators import sanitize_input
-from lib.services.user_service import load_users, get_user_profile
+from lib.auth.validators import SESSION_ID_PATTERN, sanitize_input
+from lib.services.user_service import (
+    load_users,
+    get_user_profile,
+    get_conversation,
+    append_conversation_turns,
+)
 from lib.services.chat_service import (
     get_candidate_songs,
+    build_songs_context,
     build_profile_context,
     build_history_context,
     build_chat_prompt,
 )
-from lib.dependencies import get_client, get_collection, get_all_songs
-from lib.exceptions import AuthenticationError, ValidationError
+from lib.services.answer_cache import answer_cache, build_cache_key, replay_answer
+from lib.services.quota_service import quota_headers, quota_service
+from lib.dependencies import ResourceSnapshot, get_client, get_snapshot
+from lib.embeddings import query_encoder
+from lib.exceptions import AuthenticationError, ResourceNotFoundError, ValidationError
 from lib.rate_limiter import limiter
+from lib.admission import admission_controller
+from lib.streaming import ReleasingStreamingResponse, stream_upstream_text
+from lib.llm_gateway import LLMUnavailableError, llm_gateway
+from lib.metrics import PROMPT_BUILD_SECONDS, PROMPT_SIZE_BYTES, PROMPT_SIZE_TOKENS
+from lib.utils import estimate_tokens
+from lib.tracing import bind_user, trace_stage
+
+if TYPE_CHECKING:
+    from google import genai
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _log_quota_failure(future: "asyncio.Future") -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"更新用量配額失敗: {future.exception()}", exc_info=future.exception())
+
+
+def _run_quota_update(func: Callable[..., None], *args: Any) -> None:
+    future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+    future.add_done_callback(_log_quota_failure)
+
 
 class MessageItem(BaseModel):
     role: str
@@ -34,6 +60,8 @@ class MessageItem(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # 提供 session_id 時由伺服器端保存的對話接續；history 僅供舊版客戶端使用。
+    session_id: Optional[str] = None
     history: list[MessageItem] = Field(default_factory=list)
 
 
@@ -43,9 +71,8 @@ async def chat(
     request: Request,
     req: ChatRequest,
     authorization: str = Header(None),
-    client: Optional[genai.Client] = Depends(get_client),
-    collection: Optional[chromadb.Collection] = Depends(get_collection),
-    all_songs: list = Depends(get_all_songs),
+    client: Optional["genai.Client"] = Depends(get_client),
+    snapshot: ResourceSnapshot = Depends(get_snapshot),
 ) -> Response:
     """聊天端點（速率限制：10 次/分鐘）。"""
     message = sanitize_input(req.message, max_length=config.CHAT_MESSAGE_MAX_LENGTH)
@@ -71,46 +98,121 @@ async def chat(
         logger.error("找不到 Gemini API Key")
         return JSONResponse(status_code=500, content={"error": "找不到 Gemini API Key"})
     
-    logger.info(f"接收到聊天請求 (code: {code[:8]}..., message_length: {len(message)})")
+    logger.info(f"接收到聊天請求 (message_length: {len(message)})")
     
     # 構建上下文。
-    profile = get_user_profile(code)
+    with trace_stage("profile"):
+        profile = get_user_profile(code)
     profile_context = build_profile_context(profile)
-    sanitized_history: list[MessageItem] = []
-    for history_item in req.history:
-        role = sanitize_input(history_item.role, max_length=20)
-        if role not in config.ALLOWED_MESSAGE_ROLES:
-            raise ValidationError("歷史對話包含無效角色")
-        content = sanitize_input(
-            history_item.content, max_length=config.CHAT_MESSAGE_MAX_LENGTH
-        )
-        if not content:
-            raise ValidationError("歷史對話內容不能為空")
-        sanitized_history.append(MessageItem(role=role, content=content))
+    new_turns: list[dict] = []
+    if req.session_id is not None:
+        session_id = sanitize_input(req.session_id, max_length=64)
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValidationError("無效的對話 ID")
+        # 伺服器端保存的訊息在寫入時已清理過，不需逐則重新驗證。
+        with trace_stage("conversation"):
+            stored = get_conversation(code, session_id)
+        if stored is None:
+            raise ResourceNotFoundError("找不到對話，請重新開始新對話")
+        sanitized_history = [
+            MessageItem(**m) for m in stored[-config.CHAT_HISTORY_MAX_MESSAGES:]
+        ]
+    else:
+        session_id = str(uuid4())
+        sanitized_history = []
+        for history_item in req.history:
+            role = sanitize_input(history_item.role, max_length=20)
+            if role not in config.ALLOWED_MESSAGE_ROLES:
+                raise ValidationError("歷史對話包含無效角色")
+            content = sanitize_input(
+                history_item.content, max_length=config.CHAT_MESSAGE_MAX_LENGTH
+            )
+            if not content:
+                raise ValidationError("歷史對話內容不能為空")
+            sanitized_history.append(MessageItem(role=role, content=content))
+        # 舊版客戶端送來的歷史作為新對話的起點。
+        new_turns = [item.model_dump() for item in sanitized_history]
+        sanitized_history = sanitized_history[-config.CHAT_HISTORY_MAX_MESSAGES:]
+
+    async def remember_turns(answer: str) -> None:
+        turns = new_turns + [
+            {"role": "user", "content": message},
+            {"role": "model", "content": answer[: config.CONVERSATION_REPLY_MAX_LENGTH]},
+        ]
+        await run_in_threadpool(append_conversation_turns, code, session_id, turns)
 
     history_context = build_history_context(sanitized_history)
     
-    # 取得候選歌曲。
-    candidate_songs = get_candidate_songs(message, collection, all_songs)
-    songs_context = json.dumps(candidate_songs, ensure_ascii=False)
+    # 取得候選歌曲（整個請求使用同一個資源快照，重新載入不影響進行中的請求）。
+    collection = snapshot.collection
+    # 查詢編碼與 Chroma 檢索都是同步的 CPU/IO 工作，在執行緒池中執行。
+    with trace_stage("retrieval"):
+        candidate_songs = await run_in_threadpool(
+            get_candidate_songs, message, collection, snapshot.songs, snapshot.songs_by_id
+        )
+    songs_context = build_songs_context(candidate_songs)
     
+    # 無對話歷史的提問先查詢答案快取，命中時直接回放。
+    cache_key = None
+    if config.ANSWER_CACHE_ENABLED and not sanitized_history:
+        cache_key = build_cache_key(message, profile, candidate_songs, snapshot.version)
+        if answer_cache.similarity_enabled:
+            cache_key = await run_in_threadpool(answer_cache.with_embedding, cache_key, query_encoder.encode)
+        cached_answer = answer_cache.get(cache_key)
+        if cached_answer is not None:
+            logger.info("以快取回覆串流回傳")
+
+            async def replay_and_remember():
+                async for chunk in replay_answer(cached_answer):
+                    yield chunk
+                await remember_turns(cached_answer)
+
+            return StreamingResponse(
+                replay_and_remember(),
+                media_type="text/plain",
+                headers={"X-Session-Id": session_id},
+            )
+
     # 構建 prompt。
-    prompt = build_chat_prompt(message, profile_context, history_context, songs_context)
-    
+    with PROMPT_BUILD_SECONDS.time(), trace_stage("prompt"):
+        prompt = build_chat_prompt(message, profile_context, history_context, songs_context)
+    prompt_tokens = estimate_tokens(prompt)
+    PROMPT_SIZE_BYTES.observe(len(prompt.encode("utf-8")))
+    PROMPT_SIZE_TOKENS.observe(prompt_tokens)
+
+    # 依估計的輸入 token 預扣用量配額，不足時回傳 429。
+    response_headers = {"X-Session-Id": session_id}
+    if config.QUOTA_ENABLED:
+        with trace_stage("quota"):
+            remaining = await run_in_threadpool(quota_service.reserve, code, prompt_tokens)
+        response_headers.update(quota_headers(remaining))
+
+    # 退回與結算可能在例外處理或串流關閉時執行，改在執行緒池中背景完成，不等待結果。
+    def refund_quota() -> None:
+        if config.QUOTA_ENABLED:
+            _run_quota_update(quota_service.refund, code, prompt_tokens)
+
+    def settle_quota(reported_prompt_tokens: Optional[int], output_tokens: int) -> None:
+        if config.QUOTA_ENABLED:
+            _run_quota_update(quota_service.settle, code, prompt_tokens, reported_prompt_tokens, output_tokens)
+
+    # 取得生成名額（同一存取代碼的新訊息會取代先前的串流）。
+    with trace_stage("admission"):
+        try:
+            ticket = await admission_controller.admit(code)
+        except BaseException:
+            refund_quota()
+            raise
+
+    # 透過 LLM 閘道開啟串流；在第一個位元組送出前的失敗會改用備援模型或快速回傳 503。
     try:
-        def stream_generator():
-            responseStream = client.models.generate_content_stream(
-                model=config.GEMINI_MODEL,
-                contents=prompt,
-            )
-            for chunk in responseStream:
-                if chunk.text:
-                    yield chunk.text
-        
-        logger.info(f"開始串流回傳 (code: {code[:8]}...)")
-        return StreamingResponse(stream_generator(), media_type="text/plain")
-    
-    except Exception as e:
+        with trace_stage("llm_ttft"):
+            upstream = await llm_gateway.open_stream(client, prompt)
+    except BaseException as e:
+        ticket.release()
+        refund_quota()
+        if not isinstance(e, Exception) or isinstance(e, LLMUnavailableError):
+            raise
         error_id = str(uuid4())[:8].upper()
         logger.error(f"[{error_id}] LLM 發生錯誤: {e}", exc_info=True)
         return JSONResponse(
@@ -118,6 +220,25 @@ async def chat(
             content={"error": "LLM 服務暫時無法使用", "error_id": error_id},
         )
 
+    async def on_complete(answer: str, elapsed: float) -> None:
+        if cache_key is not None:
+            answer_cache.put(cache_key, answer, elapsed)
+        await remember_turns(answer)
+
+    logger.info(f"開始串流回傳 (model: {upstream.model})")
+    return ReleasingStreamingResponse(
+        stream_upstream_text(
+            upstream,
+            request.receive,
+            on_complete=on_complete,
+            cancel_event=ticket.cancelled,
+            on_usage=settle_quota,
+        ),
+        on_close=ticket.release,
+        media_type="text/plain",
+        headers={"X-Queue-Wait": f"{ticket.wait_seconds:.3f}", **response_headers},
+    )
+
 
 @router.post("/logout")
 async def logout(authorization: str = Header(None)) -> dict:
@@ -131,13 +252,14 @@ async def logout(authorization: str = Header(None)) -> dict:
 
     code = sanitize_input(parts[1], max_length=config.ACCESS_CODE_MAX_LENGTH)
     
+    bind_user(code)
     # 登出允許過期 token，僅檢查用戶是否存在。
     users = load_users()
     if code not in users:
-        logger.warning(f"嘗試登出不存在的用戶 (code: {code[:8]}...)")
+        logger.warning("嘗試登出不存在的用戶")
         raise AuthenticationError("用戶不存在")
     
     logout_user(code)
-    logger.info(f"用戶登出成功 (code: {code[:8]}...)")
+    logger.info("用戶登出成功")
     
     return {"success": True, "message": "已成功登出"}
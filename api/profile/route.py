@@ -62,7 +62,7 @@ async def save_profile(req: ProfileRequest, authorization: str = Header(None)) -
     }
     
     if update_user_profile(code, profile_data):
-        logger.info(f"用戶資料已更新 (code: {code[:8]}...)")
+        logger.info("用戶資料已更新")
         return {"success": True, "message": "個人資料已儲存！"}
     else:
         raise AuthenticationError("無效的存取代碼。")
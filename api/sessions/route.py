@@ -1,17 +1,19 @@
 """對話歷史 API 路由。"""
 from fastapi import APIRouter, Header
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional
 import uuid
 import logging
 import config
 from lib.auth import validate_token
-from lib.auth.validators import sanitize_input
+from lib.auth.validators import SESSION_ID_PATTERN, sanitize_input
 from lib.services.user_service import (
     get_user_sessions,
+    get_conversation,
     add_session,
     delete_session,
 )
-from lib.exceptions import AuthenticationError, ValidationError
+from lib.exceptions import AuthenticationError, ResourceNotFoundError, ValidationError
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -24,7 +26,9 @@ class MessageItem(BaseModel):
 
 class SaveSessionRequest(BaseModel):
     title: str
-    messages: list[MessageItem]
+    # 提供 session_id 時直接儲存伺服器端的對話內容；messages 僅供舊版客戶端使用。
+    session_id: Optional[str] = None
+    messages: list[MessageItem] = Field(default_factory=list)
 
 
 @router.get("")
@@ -66,35 +70,45 @@ async def save_session(req: SaveSessionRequest, authorization: str = Header(None
     if not title:
         raise ValidationError("標題不能為空")
     
-    if len(req.messages) == 0:
+    session_id = str(uuid.uuid4())
+    if req.session_id is not None:
+        session_id = sanitize_input(req.session_id, max_length=64)
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValidationError("無效的對話 ID")
+        # 伺服器端對話在寫入時已清理過，不需重新驗證。
+        sanitized_messages = get_conversation(code, session_id)
+        if sanitized_messages is None:
+            raise ResourceNotFoundError("找不到對話")
+    else:
+        # 清理並限制每則訊息長度。
+        sanitized_messages = []
+        # 僅允許預期的 role 值。
+        for m in req.messages:
+            sanitized_role = sanitize_input(m.role, max_length=20)
+            if sanitized_role not in config.ALLOWED_MESSAGE_ROLES:
+                raise ValidationError("無效的對話角色")
+            sanitized_content = sanitize_input(m.content, max_length=config.CHAT_MESSAGE_MAX_LENGTH)
+            sanitized_messages.append({"role": sanitized_role, "content": sanitized_content})
+
+    if len(sanitized_messages) == 0:
         raise ValidationError("對話內容不能為空")
     
-    # 清理並限制每則訊息長度。
-    sanitized_messages = []
-    # 僅允許預期的 role 值。
-    for m in req.messages:
-        sanitized_role = sanitize_input(m.role, max_length=20)
-        if sanitized_role not in config.ALLOWED_MESSAGE_ROLES:
-            raise ValidationError("無效的對話角色")
-        sanitized_content = sanitize_input(m.content, max_length=config.CHAT_MESSAGE_MAX_LENGTH)
-        sanitized_messages.append({"role": sanitized_role, "content": sanitized_content})
-    
-    # 檢查是否超過上限。
+    # 檢查是否超過上限（重新儲存同一個對話不佔用新的名額）。
     sessions = get_user_sessions(code)
-    if len(sessions) >= config.MAX_SESSIONS_PER_USER:
+    already_saved = any(session.get("id") == session_id for session in sessions)
+    if not already_saved and len(sessions) >= config.MAX_SESSIONS_PER_USER:
         raise ValidationError(
             f"已達到儲存對話數量上限 ({config.MAX_SESSIONS_PER_USER}個)，請先刪除舊的對話。"
         )
     
-    # 建立新對話。
     new_session = {
-        "id": str(uuid.uuid4()),
+        "id": session_id,
         "title": title,
         "messages": sanitized_messages,
     }
     
     if add_session(code, new_session):
-        logger.info(f"對話已儲存 (code: {code[:8]}..., session_id: {new_session['id']})")
+        logger.info(f"對話已儲存 (session_id: {new_session['id']})")
         return {"success": True, "session_id": new_session["id"]}
     else:
         raise ValidationError("無法保存對話")
@@ -114,9 +128,12 @@ async def delete_session_endpoint(session_id: str, authorization: str = Header(N
     
     if not validate_token(code):
         raise AuthenticationError("無效或已過期的存取代碼")
+
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValidationError("無效的對話 ID")
     
     if delete_session(code, session_id):
-        logger.info(f"對話已刪除 (code: {code[:8]}..., session_id: {session_id})")
+        logger.info(f"對話已刪除 (session_id: {session_id})")
         return {"success": True}
     else:
         raise ValidationError("無法刪除對話")
@@ -0,0 +1,114 @@
+"""
+中間件堆疊效能量測
+
+直接以 ASGI 介面呼叫 server.app（不經過網路），量測：
+- 小型 JSON 端點的每秒請求數
+- StreamingResponse 每個區塊從產生到送出的延遲
+
+用法：
+    python benchmarks/middleware_bench.py [--requests 3000] [--chunks 200]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("VALIDATE_CONFIG", "false")
+
+from fastapi.responses import StreamingResponse  # noqa: E402
+from server import app  # noqa: E402
+from lib.rate_limiter import limiter  # noqa: E402
+
+produced_at = []
+
+
+async def bench_ping():
+    return {"ok": True}
+
+
+async def bench_stream(chunks: int = 200):
+    async def generate():
+        for i in range(chunks):
+            produced_at.append(time.perf_counter())
+            yield f"chunk{i} "
+            await asyncio.sleep(0)
+
+    return StreamingResponse(generate(), media_type="text/plain")
+
+
+# 仍經過速率限制中間件，但不計入預設額度，避免量到 429 回應。
+limiter.exempt(bench_ping)
+limiter.exempt(bench_stream)
+app.add_api_route("/__bench/ping", bench_ping, methods=["GET"])
+app.add_api_route("/__bench/stream", bench_stream, methods=["GET"])
+
+
+def make_scope(path: str, query: bytes = b"") -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query,
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+        "app": app,
+    }
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def run_requests(count: int) -> float:
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message["status"]
+
+    scope = make_scope("/__bench/ping")
+    for _ in range(50):
+        await app(dict(scope), receive, send)
+    started = time.perf_counter()
+    for _ in range(count):
+        await app(dict(scope), receive, send)
+    return count / (time.perf_counter() - started)
+
+
+async def run_stream(chunks: int) -> list:
+    sent_at = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            sent_at.append(time.perf_counter())
+
+    produced_at.clear()
+    await app(make_scope("/__bench/stream", f"chunks={chunks}".encode()), receive, send)
+    return [(sent - produced) * 1e6 for produced, sent in zip(produced_at, sent_at)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--chunks", type=int, default=200)
+    args = parser.parse_args()
+
+    rps = asyncio.run(run_requests(args.requests))
+    latencies = asyncio.run(run_stream(args.chunks))
+    latencies.sort()
+    print(f"requests/sec: {rps:.0f}")
+    print(
+        f"stream chunk latency: median {statistics.median(latencies):.1f}µs, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f}µs"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+pre-fork 啟動器的 worker 記憶體量測
+
+分別以 1 與 8 個 worker 啟動 launcher.py，讀取 /proc 中每個 worker 的：
+- RSS：常駐記憶體（含與主程序共用的分頁）
+- PSS：共用分頁依共用程序數均分後的記憶體
+- USS：worker 私有的記憶體（Private_Clean + Private_Dirty），即每多一個 worker 實際增加的量
+
+--reload 時另外在 songs.json 變更、主程序重新載入並替換 worker 後再量測一次。
+僅支援 Linux。未指定 --songs 時會產生一份模擬的 songs.json。
+
+查詢編碼模型的權重是 copy-on-write 共用的主要對象，因此主程序未成功載入模型時
+（未安裝 sentence-transformers 或找不到 EMBEDDING_MODEL）直接結束，不輸出數據；
+確實要量測無模型的情況時加上 --allow-no-encoder。
+
+用法：
+    python benchmarks/prefork_rss.py [--workers 1 8] [--songs data/songs.json] [--reload] [--allow-no-encoder]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_fake_songs(path: str, count: int = 3000) -> None:
+    songs = [
+        {
+            "id": str(i),
+            "title": f"模擬歌曲 {i}",
+            "subtitle": "作曲者",
+            "genre": "流行音樂",
+            "bpm": 120 + i % 100,
+            "difficulty": {"oni": 1 + i % 10},
+            "features": ["連打", "高速", "複合"],
+            "description": "譜面攻略心得。" * 150,
+        }
+        for i in range(count)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(songs, f, ensure_ascii=False)
+
+
+def read_memory_kb(pid: int) -> dict:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def worker_pids(master_pid: int) -> list:
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def wait_until_ready(port: int, master_pid: int, workers: int, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/livez", timeout=2):
+                if len(worker_pids(master_pid)) == workers:
+                    # 讓每個 worker 都完成 lifespan 初始化。
+                    time.sleep(3)
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("伺服器未在期限內就緒")
+
+
+def encoder_loaded(log_dir: str) -> bool:
+    """由主程序的日誌確認 fork 前已載入查詢編碼模型。"""
+    try:
+        with open(os.path.join(log_dir, "taiko_advisor.log"), encoding="utf-8") as f:
+            return "嵌入模型載入成功" in f.read()
+    except OSError:
+        return False
+
+
+def print_sample(label: str, master_pid: int) -> None:
+    master = read_memory_kb(master_pid)
+    samples = [read_memory_kb(pid) for pid in worker_pids(master_pid)]
+
+    def avg(key: str) -> float:
+        return sum(s[key] for s in samples) / len(samples) / 1024
+
+    total_pss = (master["pss"] + sum(s["pss"] for s in samples)) / 1024
+    print(
+        f"{label}: 每個 worker RSS {avg('rss'):6.1f} MB  PSS {avg('pss'):6.1f} MB  "
+        f"USS {avg('uss'):6.1f} MB  | 主程序 RSS {master['rss'] / 1024:6.1f} MB  | 合計 PSS {total_pss:7.1f} MB"
+    )
+
+
+def wait_for_new_workers(master_pid: int, old: set, workers: int, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        current = set(worker_pids(master_pid))
+        if len(current) == workers and not current & old:
+            time.sleep(3)
+            return
+        time.sleep(0.5)
+    raise RuntimeError("worker 未在期限內替換")
+
+
+def measure(workers: int, port: int, env: dict, reload: bool = False, allow_no_encoder: bool = False) -> None:
+    process = subprocess.Popen(
+        [sys.executable, "launcher.py", "--workers", str(workers), "--port", str(port), "--max-requests", "0"],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port, process.pid, workers)
+        if not encoder_loaded(env["LOG_DIR"]):
+            if not allow_no_encoder:
+                raise SystemExit("主程序未載入查詢編碼模型，量測結果不具代表性（見 --allow-no-encoder）")
+            print("注意：未載入查詢編碼模型")
+        print_sample(f"{workers} workers", process.pid)
+        if reload:
+            old = set(worker_pids(process.pid))
+            os.utime(env["SONGS_DB_PATH"], None)
+            wait_for_new_workers(process.pid, old, workers)
+            print_sample(f"{workers} workers（重新載入後）", process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--songs")
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--reload", action="store_true", help="songs.json 變更、替換 worker 後再量測一次")
+    parser.add_argument("--allow-no-encoder", action="store_true", help="主程序未載入查詢編碼模型時仍量測")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        songs_path = args.songs
+        if songs_path is None:
+            songs_path = os.path.join(tmpdir, "songs.json")
+            write_fake_songs(songs_path)
+        env = dict(
+            os.environ,
+            VALIDATE_CONFIG="false",
+            SONGS_DB_PATH=os.path.abspath(songs_path),
+            LOG_DIR=os.path.join(tmpdir, "logs"),
+            USERS_DB_PATH=os.path.join(tmpdir, "users.json"),
+            RATE_LIMIT_STORAGE_URI="memory://",
+            RESOURCE_WATCH_INTERVAL_SECONDS="1",
+        )
+        for workers in args.workers:
+            measure(workers, args.port, env, reload=args.reload, allow_no_encoder=args.allow_no_encoder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+速率限制檢查的單次耗時量測
+
+量測 limiter 在每個請求上做的工作：計算鍵（rate_limit_key）並以
+sliding-window-counter 策略對儲存後端 hit 一次。目標為 SQLite 後端每次 < 100µs。
+
+用法：
+    python benchmarks/rate_limit_bench.py [--requests 20000] [--users 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("VALIDATE_CONFIG", "false")
+
+from limits import parse  # noqa: E402
+from limits.storage import storage_from_string  # noqa: E402
+from limits.strategies import SlidingWindowCounterRateLimiter  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from lib.rate_limiter import rate_limit_key  # noqa: E402
+
+
+def make_request(code: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/chat",
+        "headers": [(b"authorization", f"Bearer {code}".encode())],
+        "client": ("203.0.113.7", 50000),
+    })
+
+
+def bench(storage_uri: str, requests: int, users: int) -> list:
+    strategy = SlidingWindowCounterRateLimiter(storage_from_string(storage_uri))
+    limit = parse(f"{requests * 10}/minute")
+    codes = [f"bench-user-{i}" for i in range(users)]
+    prepared = [make_request(codes[i % users]) for i in range(requests)]
+
+    samples = []
+    for request in prepared:
+        started = time.perf_counter()
+        strategy.hit(limit, rate_limit_key(request), "/api/chat")
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def report(name: str, samples: list) -> None:
+    micro = sorted(s * 1e6 for s in samples)
+    p99 = micro[int(len(micro) * 0.99) - 1]
+    print(f"{name:<8} 平均 {statistics.mean(micro):7.1f}µs  中位數 {statistics.median(micro):7.1f}µs  p99 {p99:7.1f}µs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report("memory", bench("memory://", args.requests, args.users))
+        report("sqlite", bench(f"sqlite://{tmpdir}/rate_limits.db", args.requests, args.users))
+
+
+if __name__ == "__main__":
+    main()
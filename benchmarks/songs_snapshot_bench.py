@@ -0,0 +1,103 @@
+"""
+歌曲資料載入量測：songs.json 與二進位快照
+
+在獨立的子程序中分別以兩種方式載入歌曲，量測：
+- 載入時間（中位數）
+- 載入前後的 RSS 增量（/proc/self/status 的 VmRSS，僅支援 Linux）
+
+未指定 --songs 時會產生一份含攻略內文的模擬 songs.json。
+
+用法：
+    python benchmarks/songs_snapshot_bench.py [--songs data/songs.json] [--count 3000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from lib.song_snapshot import build_snapshot  # noqa: E402
+
+MEASURE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+import config
+config.SONGS_SNAPSHOT_ENABLED = {snapshot!r}
+from lib.song_snapshot import load_songs
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+before = rss_kb()
+started = time.perf_counter()
+songs = load_songs({path!r})
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({{"ms": elapsed, "rss_kb": rss_kb() - before, "count": len(songs)}}))
+"""
+
+
+def write_fake_songs(path: str, count: int) -> None:
+    genres = ["ポップス", "アニメ", "ボーカロイド", "東方Project", "ゲームミュージック", "バラエティ", "クラシック"]
+    songs = [
+        {
+            "id": 100000 + i,
+            "title": f"模擬歌曲 {i}",
+            "subtitle": f"作曲者 {i % 200}",
+            "genre": genres[i % len(genres)],
+            "difficulty": {"oni": 1 + i % 10},
+            "bpm": f"{100 + i % 100}-{200 + i % 100}",
+            "detail_url": f"https://example.com/{i}",
+            "features": ["連打", "高BPM", "複合"],
+            "description": "這是由系統自動爬取自 wikiwiki.jp 的資料。",
+            "max_combo": 300 + i % 1200,
+            "strategy_text": f"第 {i} 首的譜面攻略心得。" * 120,
+        }
+        for i in range(count)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(songs, f, indent=2, ensure_ascii=False)
+
+
+def measure(path: str, snapshot: bool) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(root=PROJECT_ROOT, snapshot=snapshot, path=path)],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs")
+    parser.add_argument("--count", type=int, default=3000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.json")
+        if args.songs:
+            # 在暫存目錄中建立快照，不覆蓋正式資料目錄中的檔案
+            shutil.copy2(args.songs, path)
+        else:
+            write_fake_songs(path, args.count)
+        build_snapshot(path)
+        print(f"songs.json {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        for label, use_snapshot in (("songs.json", False), ("快照", True)):
+            results = [measure(path, use_snapshot) for _ in range(args.runs)]
+            print(
+                f"{label:10} {results[0]['count']} 首  載入 中位數 {statistics.median(r['ms'] for r in results):7.1f} ms"
+                f"  RSS 增量 中位數 {statistics.median(r['rss_kb'] for r in results) / 1024:6.1f} MB"
+            )
+
+if __name__ == "__main__":
+    main()
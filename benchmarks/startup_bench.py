@@ -0,0 +1,64 @@
+"""
+冷啟動量測
+
+- `import server` 的累計匯入時間（python -X importtime）
+- 從啟動 uvicorn 子程序到第一個 /livez 回應 200 的時間
+
+用法：
+    python benchmarks/startup_bench.py [--runs 5]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = dict(os.environ, VALIDATE_CONFIG="false", RATE_LIMIT_STORAGE_URI="memory://")
+
+
+def import_time_ms() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=PROJECT_ROOT, env=ENV, capture_output=True, text=True, check=True,
+    )
+    match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| server$", result.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1000
+
+
+def first_request_ms(port: int) -> float:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_ROOT, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/livez", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18777)
+    args = parser.parse_args()
+
+    imports = [import_time_ms() for _ in range(args.runs)]
+    first = [first_request_ms(args.port) for _ in range(args.runs)]
+    print(f"import server   中位數 {statistics.median(imports):7.0f} ms")
+    print(f"首個 /livez 回應 中位數 {statistics.median(first):7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
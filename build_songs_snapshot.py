@@ -0,0 +1,24 @@
+import sys
+import config
+from lib.logging_setup import setup_logging
+from lib.song_snapshot import SongSnapshot, build_snapshot
+
+
+def main():
+    print(f"編譯歌曲快照 ({config.SONGS_DB_PATH})...")
+    path = build_snapshot(config.SONGS_DB_PATH)
+    snapshot = SongSnapshot(path)
+    sections = snapshot.directory["sections"]
+    print(
+        f"✅ 已寫入 {path}：{snapshot.directory['count']} 首，"
+        f"字串表 {sections['strings'][1] / 1024:.0f} KB，攻略內文 {sections['texts'][1] / 1024:.0f} KB"
+    )
+
+
+if __name__ == "__main__":
+    setup_logging()
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"❌ 歌曲快照編譯失敗: {e}")
+        sys.exit(1)
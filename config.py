@@ -1,20 +1,20 @@
-"""Taiko AI Advisor 配置檔案"""
+"""
+Taiko AI Advisor 配置檔案
+
+固定常數直接定義於模組；由環境變數決定的設定集中在 Settings，於第一次存取 config.<名稱>
+時由 get_settings() 建立：先讀入 .env（不覆寫已設定的環境變數）再讀取環境變數，之後不再重新計算。
+因此匯入本模組沒有副作用，而以任何方式啟動（launcher.py、uvicorn server:app、工具腳本）都會讀入 .env。
+"""
 
 import os
 import logging
-from dotenv import load_dotenv
+import threading
+from typing import Any, Optional
 
-load_dotenv()
+ENV_FILE = ".env"
 
-# 路徑配置（使用絕對路徑）
-SONGS_DB_PATH = os.path.abspath(os.getenv("SONGS_DB_PATH", "data/songs.json"))
-USERS_DB_PATH = os.path.abspath(os.getenv("USERS_DB_PATH", "data/users.json"))
-CHROMA_DB_PATH = os.path.abspath(os.getenv("CHROMA_DB_PATH", "data/chroma_db"))
 CHROMA_COLLECTION_NAME = "taiko_songs"
 
-# API 金鑰
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
 HTTP_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
@@ -31,23 +31,6 @@ CORS_ORIGINS = [
     "http://127.0.0.1:8000",
 ]
 
-# TRUSTED_HOSTS 可透過環境變數 TRUSTED_HOSTS 覆寫（逗號分隔）
-TRUSTED_HOSTS_ENV = os.getenv("TRUSTED_HOSTS")
-if TRUSTED_HOSTS_ENV:
-    TRUSTED_HOSTS = [
-        host.strip() for host in TRUSTED_HOSTS_ENV.split(",") if host.strip()
-    ]
-else:
-    # 預設信任常見本機與容器環境的 Host 標頭
-    TRUSTED_HOSTS = [
-        "localhost",
-        "127.0.0.1",
-        "host.docker.internal",
-    ]
-
-TOKEN_EXPIRY_DAYS = int(os.getenv("TOKEN_EXPIRY_DAYS", "7"))
-MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", "3"))
-
 CHAT_MESSAGE_MAX_LENGTH = 500
 USER_NAME_MAX_LENGTH = 50
 ACCESS_CODE_MAX_LENGTH = 100
@@ -112,46 +95,244 @@ TAG_GENERATION_PROMPT_TEMPLATE = """請閱讀以下「太鼓之達人」的歌
 {strategy_text}
 """
 
-# 日誌配置
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
-LOG_DIR = "logs"
-
-# 確保日誌目錄存在
-os.makedirs(LOG_DIR, exist_ok=True)
 
-# 配置日誌
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(
-            os.path.join(LOG_DIR, "taiko_advisor.log"), encoding="utf-8"
-        ),
-        logging.StreamHandler(),
-    ],
-)
+class Settings:
+    """由環境變數決定的設定值；由 get_settings() 在第一次存取時建立（先讀入 .env）。"""
+
+    def __init__(self) -> None:
+        # 路徑配置（使用絕對路徑）
+        self.SONGS_DB_PATH = os.path.abspath(os.getenv("SONGS_DB_PATH", "data/songs.json"))
+        # 優先載入 build_songs_snapshot.py 產生的二進位快照（與 songs.json 同目錄的 songs.snapshot）
+        self.SONGS_SNAPSHOT_ENABLED = os.getenv("SONGS_SNAPSHOT_ENABLED", "true").lower() == "true"
+        self.USERS_DB_PATH = os.path.abspath(os.getenv("USERS_DB_PATH", "data/users.json"))
+        self.CHROMA_DB_PATH = os.path.abspath(os.getenv("CHROMA_DB_PATH", "data/chroma_db"))
+
+        # API 金鑰
+        self.GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+        # 正式環境啟動器（launcher.py）：監聽位址、worker 數、worker 處理多少請求後重新啟動（0 表示不限）
+        self.SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+        self.SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+        self.WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+        self.WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "10000"))
+        self.WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "1000"))
+        self.WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+
+        # TRUSTED_HOSTS 可透過環境變數 TRUSTED_HOSTS 覆寫（逗號分隔）
+        trusted_hosts_env = os.getenv("TRUSTED_HOSTS")
+        if trusted_hosts_env:
+            self.TRUSTED_HOSTS = [
+                host.strip() for host in trusted_hosts_env.split(",") if host.strip()
+            ]
+        else:
+            # 預設信任常見本機與容器環境的 Host 標頭
+            self.TRUSTED_HOSTS = [
+                "localhost",
+                "127.0.0.1",
+                "host.docker.internal",
+            ]
+
+        self.TOKEN_EXPIRY_DAYS = int(os.getenv("TOKEN_EXPIRY_DAYS", "7"))
+        self.MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", "3"))
+
+        # 伺服器端對話狀態：保存目錄（每段對話一個只附加的 JSON Lines 檔案）、每位用戶保留的進行中對話數、
+        # 每段對話保存的訊息上限、送入 prompt 的最近訊息數，以及模型回覆的保存長度上限
+        self.CONVERSATIONS_DIR = os.path.abspath(os.getenv("CONVERSATIONS_DIR", "data/conversations"))
+        self.MAX_CONVERSATIONS_PER_USER = int(os.getenv("MAX_CONVERSATIONS_PER_USER", "5"))
+        self.CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "100"))
+        self.CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+        self.CONVERSATION_REPLY_MAX_LENGTH = int(os.getenv("CONVERSATION_REPLY_MAX_LENGTH", "4000"))
+
+        # 答案快取設定（僅快取無對話歷史的提問）
+        self.ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+        self.ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+        self.ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "21600"))
+        # 嵌入相似度門檻（0 表示僅做精確比對）
+        self.ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0"))
+        # 快取回放的每段字數與間隔秒數
+        self.ANSWER_CACHE_REPLAY_CHUNK_CHARS = int(os.getenv("ANSWER_CACHE_REPLAY_CHUNK_CHARS", "24"))
+        self.ANSWER_CACHE_REPLAY_INTERVAL = float(os.getenv("ANSWER_CACHE_REPLAY_INTERVAL", "0.02"))
+
+        # 速率限制：計數儲存位置與策略。sqlite://<路徑> 讓同主機的所有 worker 共用計數；
+        # 多台主機可改用 redis://（需安裝 redis 套件）；memory:// 僅限單一程序
+        self.RATE_LIMIT_STORAGE_URI = os.getenv(
+            "RATE_LIMIT_STORAGE_URI", "sqlite://" + os.path.abspath("data/rate_limits.db")
+        )
+        self.RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+        self.RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "30/minute")
+        # 每個遠端 IP 的總量上限（不論帶哪個存取代碼），避免輪換偽造的代碼繞過限制
+        self.RATE_LIMIT_PER_IP = os.getenv("RATE_LIMIT_PER_IP", "120/minute")
+
+        # token 用量配額：每個存取代碼每分鐘/每日可用的 Gemini token（輸入 + 輸出）、
+        # 同主機 worker 共用的餘額檔案，以及用量統計寫回用戶資料的間隔秒數
+        self.QUOTA_ENABLED = os.getenv("QUOTA_ENABLED", "true").lower() == "true"
+        self.QUOTA_TOKENS_PER_MINUTE = int(os.getenv("QUOTA_TOKENS_PER_MINUTE", "30000"))
+        self.QUOTA_TOKENS_PER_DAY = int(os.getenv("QUOTA_TOKENS_PER_DAY", "300000"))
+        self.QUOTA_STORAGE_PATH = os.path.abspath(os.getenv("QUOTA_STORAGE_PATH", "data/quota.db"))
+        self.QUOTA_FLUSH_INTERVAL_SECONDS = float(os.getenv("QUOTA_FLUSH_INTERVAL_SECONDS", "30"))
+
+        # 就緒探測：背景探測間隔、單項逾時、各項延遲 SLO 與 Chroma 金絲雀查詢
+        self.READINESS_PROBE_INTERVAL_SECONDS = float(os.getenv("READINESS_PROBE_INTERVAL_SECONDS", "15"))
+        self.READINESS_PROBE_TIMEOUT_SECONDS = float(os.getenv("READINESS_PROBE_TIMEOUT_SECONDS", "5"))
+        self.READINESS_CHROMA_SLO_SECONDS = float(os.getenv("READINESS_CHROMA_SLO_SECONDS", "0.5"))
+        self.READINESS_USER_STORE_SLO_SECONDS = float(os.getenv("READINESS_USER_STORE_SLO_SECONDS", "0.1"))
+        self.READINESS_CANARY_QUERY = os.getenv("READINESS_CANARY_QUERY", "推薦 鬼 8星 的歌曲")
+
+        # 資源熱重新載入：監看 songs.json 與觸發檔的間隔（0 停用），觸發檔由管理端點與 init_chroma.py 更新；
+        # ADMIN_TOKEN 未設定時停用 /api/admin 端點
+        self.RESOURCE_WATCH_INTERVAL_SECONDS = float(os.getenv("RESOURCE_WATCH_INTERVAL_SECONDS", "5"))
+        self.RESOURCE_RELOAD_TRIGGER_PATH = os.path.abspath(os.getenv("RESOURCE_RELOAD_TRIGGER_PATH", "data/.reload"))
+        self.ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+        # 啟動預熱：以金絲雀查詢（以 | 分隔）走過檢索與 prompt 構建、預先讀入索引檔；
+        # 背景執行時 /livez 立即可用，/readyz 在預熱完成前維持 503
+        self.WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+        self.WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "true").lower() == "true"
+        self.WARMUP_CANARY_QUERIES = [
+            query.strip()
+            for query in os.getenv(
+                "WARMUP_CANARY_QUERIES", "推薦 鬼 8星 的歌曲|適合新手的簡單歌曲|BPM 200 以上的高速曲"
+            ).split("|")
+            if query.strip()
+        ]
+
+        # 回應壓縮：非串流回應超過門檻（bytes）才壓縮；串流回應逐塊壓縮並 flush
+        self.COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+        self.COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+        self.COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+        self.COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+        # 爬蟲的禮貌排程（每個主機）：同時請求數上限、相鄰兩次請求開始的最小間隔與額外的隨機抖動（秒）；
+        # 連線錯誤、逾時與 429/5xx 以指數退避重試；HTML 以程序池解析（0 表示在執行緒中解析）
+        self.SCRAPER_MAX_IN_FLIGHT_PER_HOST = int(os.getenv("SCRAPER_MAX_IN_FLIGHT_PER_HOST", "2"))
+        self.SCRAPER_MIN_DELAY_SECONDS = float(os.getenv("SCRAPER_MIN_DELAY_SECONDS", str(HTTP_DELAY_MIN)))
+        self.SCRAPER_JITTER_SECONDS = float(os.getenv("SCRAPER_JITTER_SECONDS", str(HTTP_DELAY_MAX - HTTP_DELAY_MIN)))
+        self.SCRAPER_MAX_RETRIES = int(os.getenv("SCRAPER_MAX_RETRIES", "3"))
+        self.SCRAPER_RETRY_BACKOFF_SECONDS = float(os.getenv("SCRAPER_RETRY_BACKOFF_SECONDS", "2"))
+        self.SCRAPER_PARSE_WORKERS = int(os.getenv("SCRAPER_PARSE_WORKERS", "2"))
+
+        # 查詢時以 EMBEDDING_MODEL 編碼（與建立索引時相同）；停用時改用 ChromaDB 預設嵌入函式
+        self.QUERY_ENCODER_ENABLED = os.getenv("QUERY_ENCODER_ENABLED", "true").lower() == "true"
+
+        # 嵌入向量快取：以 hash(模型名稱 + 文字) 為鍵；init_chroma.py 的歌曲向量與查詢向量分開存放，
+        # 檔案超過上限時由背景執行緒依最近使用順序淘汰
+        self.EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self.EMBEDDING_CACHE_DIR = os.path.abspath(os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache"))
+        self.EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+        self.EMBEDDING_QUERY_CACHE_DIR = os.path.abspath(
+            os.getenv("EMBEDDING_QUERY_CACHE_DIR", os.path.join(self.EMBEDDING_CACHE_DIR, "queries"))
+        )
+        self.EMBEDDING_QUERY_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+        # 建立索引的編碼管線：模型每次推論的文件數、編碼程序數（大於 1 時以 sentence-transformers 的
+        # 多程序池分散到多個 CPU 核心），以及編碼與寫入之間最多暫存幾個批次
+        self.CHROMA_ENCODE_BATCH_SIZE = int(os.getenv("CHROMA_ENCODE_BATCH_SIZE", "64"))
+        self.CHROMA_ENCODE_PROCESSES = int(os.getenv("CHROMA_ENCODE_PROCESSES", "1"))
+        self.CHROMA_PIPELINE_DEPTH = int(os.getenv("CHROMA_PIPELINE_DEPTH", "2"))
+
+        # 版本化集合：init_chroma.py 建立 <CHROMA_COLLECTION_NAME>_v<內容雜湊>，驗證後切換指標檔；
+        # 保留最近幾個版本（含使用中的版本），驗證時以抽樣歌曲的向量自我查詢計算召回率
+        self.CHROMA_POINTER_PATH = os.path.abspath(
+            os.getenv("CHROMA_POINTER_PATH", os.path.join(self.CHROMA_DB_PATH, "active_collection.json"))
+        )
+        self.CHROMA_KEEP_VERSIONS = int(os.getenv("CHROMA_KEEP_VERSIONS", "2"))
+        self.CHROMA_VALIDATION_SAMPLE = int(os.getenv("CHROMA_VALIDATION_SAMPLE", "50"))
+        self.CHROMA_VALIDATION_TOP_K = int(os.getenv("CHROMA_VALIDATION_TOP_K", "5"))
+        self.CHROMA_MIN_RECALL = float(os.getenv("CHROMA_MIN_RECALL", "0.9"))
+
+        # 主要模型延遲過高或故障時依序改用的備援模型（逗號分隔）
+        self.GEMINI_FALLBACK_MODELS = [
+            model.strip()
+            for model in os.getenv("GEMINI_FALLBACK_MODELS", "gemini-2.5-flash-lite").split(",")
+            if model.strip()
+        ]
+        # 自訂 Gemini API 端點（測試時可指向本機模擬伺服器）
+        self.GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+        # LLM 閘道：TTFT 延遲 SLO、首個區塊逾時、對沖延遲（0 表示停用）與斷路器設定
+        self.LLM_TTFT_SLO_SECONDS = float(os.getenv("LLM_TTFT_SLO_SECONDS", "4"))
+        self.LLM_FIRST_BYTE_TIMEOUT_SECONDS = float(os.getenv("LLM_FIRST_BYTE_TIMEOUT_SECONDS", "20"))
+        self.LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "3"))
+        self.LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "3"))
+        self.LLM_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30"))
+        self.LLM_STATS_WINDOW_SECONDS = float(os.getenv("LLM_STATS_WINDOW_SECONDS", "300"))
+        self.LLM_STATS_MIN_SAMPLES = int(os.getenv("LLM_STATS_MIN_SAMPLES", "5"))
+        # 尚無統計資料時，預估一次回覆的輸出 token 數（用於估算取消串流節省量）
+        self.LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "600"))
+        # LLM 准入控制：每個 worker 的同時串流上限、等待佇列長度與排隊逾時秒數
+        self.LLM_MAX_CONCURRENT_STREAMS = int(os.getenv("LLM_MAX_CONCURRENT_STREAMS", "8"))
+        self.LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+        self.LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+
+        # 日誌配置
+        self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+        # 日誌格式：json（結構化，含 request id 等請求上下文）或 text
+        self.LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+        # 設定後以 OTLP/JSON 格式將請求 span 逐行寫入此檔案
+        self.TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+        self.LOG_DIR = os.getenv("LOG_DIR", "logs")
+        # 日誌輪替：size（依檔案大小）或 time（依時間，LOG_ROTATE_WHEN 同 TimedRotatingFileHandler 的 when）
+        self.LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()
+        self.LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+        self.LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+        self.LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+        # 非同步日誌佇列上限，塞滿時丟棄紀錄而不阻塞
+        self.LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+        # 日誌設定由 lib.logging_setup.setup_logging() 在程式進入點明確初始化
+
+        # 伺服器啟動時是否執行 validate_config()
+        self.VALIDATE_CONFIG = os.getenv("VALIDATE_CONFIG", "true").lower() == "true"
+
+
+_settings: Optional[Settings] = None
+_settings_lock = threading.Lock()
+
+
+def load_env_file(path: str = ENV_FILE) -> bool:
+    """將 .env 讀入環境變數（不覆寫已設定的值）；沒有 .env 時回傳 False。"""
+    from dotenv import load_dotenv
+
+    return os.path.exists(path) and load_dotenv(path)
+
+
+def get_settings() -> Settings:
+    """回傳設定；第一次呼叫時讀入 .env 並建立，之後回傳同一個物件。"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                load_env_file()
+                _settings = Settings()
+    return _settings
+
+
+def __getattr__(name: str) -> Any:
+    # config.<名稱> 轉給 get_settings()；底線開頭的名稱（__path__ 等）不觸發載入。
+    if not name.startswith("_"):
+        settings = get_settings()
+        if hasattr(settings, name):
+            return getattr(settings, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # 配置驗證
 def validate_config():
     """驗證必要的配置項"""
+    settings = get_settings()
     errors = []
     warnings = []
 
     # 檢查 API Key
-    if not GEMINI_API_KEY:
+    if not settings.GEMINI_API_KEY:
         errors.append("⚠️ GEMINI_API_KEY 未設置，聊天功能將無法使用")
 
     # 檢查歌曲資料庫
-    if not os.path.exists(SONGS_DB_PATH):
-        warnings.append(f"⚠️ 找不到歌曲資料庫: {SONGS_DB_PATH}")
+    if not os.path.exists(settings.SONGS_DB_PATH):
+        warnings.append(f"⚠️ 找不到歌曲資料庫: {settings.SONGS_DB_PATH}")
 
     # 檢查 ChromaDB
-    if not os.path.exists(CHROMA_DB_PATH):
-        warnings.append(f"⚠️ 找不到 ChromaDB: {CHROMA_DB_PATH}")
+    if not os.path.exists(settings.CHROMA_DB_PATH):
+        warnings.append(f"⚠️ 找不到 ChromaDB: {settings.CHROMA_DB_PATH}")
 
     # 輸出錯誤和警告
-    # 在導入時就拋出異常，但先警告
     logger = logging.getLogger(__name__)
     for warning in warnings:
         logger.warning(warning)
@@ -159,12 +340,3 @@ def validate_config():
     if errors:
         error_msg = "配置錯誤：\n" + "\n".join(f"  - {e}" for e in errors)
         raise ValueError(error_msg)
-
-
-# 在開發模式下驗證配置
-if os.getenv("VALIDATE_CONFIG", "true").lower() == "true":
-    try:
-        validate_config()
-    except ValueError as e:
-        # 記錄配置錯誤但允許應用繼續啟動
-        logging.getLogger(__name__).error(str(e))
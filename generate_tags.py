@@ -1,40 +1,47 @@
-import json
 import os
 import re
 import requests
 from bs4 import BeautifulSoup
 import time
 import random
+import sys
 import logging
 from google import genai
 from google.genai import types
 import config
+from lib.logging_setup import setup_logging
+from lib.songs import read_songs, write_songs
 
-# 配置日誌
 logger = logging.getLogger(__name__)
 
-if not config.GEMINI_API_KEY:
-    logger.error("❌ GEMINI_API_KEY 未設置，程式終止")
-    exit(1)
+# Gemini 客戶端由 init_client() 在執行時建立，匯入本模組不做任何初始化。
+client = None
 
-try:
-    client = genai.Client(api_key=config.GEMINI_API_KEY)
-    logger.info("✅ Gemini 客戶端初始化成功")
-except Exception as e:
-    logger.error(f"❌ Gemini 客戶端初始化失敗: {e}")
-    exit(1)
+
+def init_client() -> bool:
+    """建立 Gemini 客戶端；未設定 API 金鑰或建立失敗時回傳 False。"""
+    global client
+
+    if not config.GEMINI_API_KEY:
+        logger.error("❌ GEMINI_API_KEY 未設置，程式終止")
+        return False
+    try:
+        client = genai.Client(api_key=config.GEMINI_API_KEY)
+        logger.info("✅ Gemini 客戶端初始化成功")
+    except Exception as e:
+        logger.error(f"❌ Gemini 客戶端初始化失敗: {e}")
+        return False
+    return True
 
 
 def load_songs():
     if os.path.exists(config.SONGS_DB_PATH):
-        with open(config.SONGS_DB_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return read_songs(config.SONGS_DB_PATH)
     return []
 
 
 def save_songs(songs):
-    with open(config.SONGS_DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(songs, f, indent=2, ensure_ascii=False)
+    write_songs(songs, config.SONGS_DB_PATH)
 
 
 def fetch_details(url):
@@ -106,9 +113,9 @@ def generate_ai_tags(strategy_text):
         return ["API錯誤"]
 
 
-def get_bpm_tag(bpm_val):
+def get_bpm_tag(max_b):
     """
-    根據 BPM 值返回對應的速度標籤
+    根據最高 BPM（Song.bpm_max）返回對應的速度標籤
     
     返回值:
     - 低BPM: 低於 160
@@ -117,25 +124,17 @@ def get_bpm_tag(bpm_val):
     - 超高BPM: 260 及以上
     - None: 無法解析
     """
-    try:
-        nums = re.findall(r"\d+(?:\.\d+)?", str(bpm_val))
-        if not nums:
-            logger.debug(f"BPM 無法解析: {bpm_val}")
-            return None
-        
-        max_b = max(float(n) for n in nums)
-
-        if max_b < 160:
-            return "低BPM"
-        elif 160 <= max_b <= 220:
-            return "一般速度"
-        elif 220 < max_b < 260:
-            return "高BPM"
-        elif max_b >= 260:
-            return "超高BPM"
-    except (ValueError, TypeError) as e:
-        logger.debug(f"BPM 解析例外 (值: {bpm_val}): {e}")
+    if max_b is None:
         return None
+
+    if max_b < 160:
+        return "低BPM"
+    elif 160 <= max_b <= 220:
+        return "一般速度"
+    elif 220 < max_b < 260:
+        return "高BPM"
+    elif max_b >= 260:
+        return "超高BPM"
     return None
 
 
@@ -154,25 +153,25 @@ def main():
         # err_tags = ["API錯誤", "運算錯誤", "API額度耗盡"]
 
         # 為了強制套用新的嚴格 AI 規則與 BPM 標籤，我們在此次執行中無視舊的 AI 標籤
-        curr_features = song.get("features", [])
+        curr_features = song.features
         # has_error = any(tag in curr_features for tag in err_tags)
 
         # 只保留 Inner Oni 與 人工處理，其他 AI 標籤全部洗掉重算
         curr_features = [f for f in curr_features if f in ["Inner Oni", "人工處理"]]
-        song["features"] = curr_features
+        song.features = tuple(curr_features)
 
-        needs_fetch = "strategy_text" not in song or (song.get("max_combo", 0) == 0)
+        needs_fetch = song.strategy_text is None or not song.max_combo
 
 
-        if song.get("detail_url") and needs_fetch:
-            logger.info("[%d/%d] 正在重新抓取詳細頁: %s", i + 1, len(songs), song["title"])
-            logger.debug("詳細頁網址: %s", song.get("detail_url", "N/A"))
-            combo, strategy = fetch_details(song["detail_url"])
+        if song.detail_url and needs_fetch:
+            logger.info("[%d/%d] 正在重新抓取詳細頁: %s", i + 1, len(songs), song.title)
+            logger.debug("詳細頁網址: %s", song.detail_url)
+            combo, strategy = fetch_details(song.detail_url)
             if combo > 0:
-                song["max_combo"] = combo
+                song.max_combo = combo
                 logger.debug(f"  ✓ 抓取 max_combo: {combo}")
             if strategy:
-                song["strategy_text"] = strategy
+                song.strategy_text = strategy
                 logger.debug(f"  ✓ 抓取攻略內文: {len(strategy)} 字元")
             changed = True
             time.sleep(random.uniform(0.5, 1.5))  # 禮貌性爬蟲延遲
@@ -180,26 +179,26 @@ def main():
         # needs_tagging = "strategy_text" in song and len(song["strategy_text"]) >= 50
 
         # 準備打標籤
-        if "strategy_text" in song:
-            strategy_text = song["strategy_text"]
+        strategy_text = song.strategy_text
+        if strategy_text is not None:
 
             # [USER RULE] 若文本過短，不呼叫 API，直接標註人工處理
             if len(strategy_text) < 50:
                 logger.info(
-                    f"[{i+1}/{len(songs)}] 文本過短 ({len(strategy_text)} 字)，標註 [人工處理]: {song['title']}"
+                    f"[{i+1}/{len(songs)}] 文本過短 ({len(strategy_text)} 字)，標註 [人工處理]: {song.title}"
                 )
                 if "人工處理" not in curr_features:
                     curr_features.append("人工處理")
-                song["features"] = curr_features
+                song.features = tuple(curr_features)
                 changed = True
             else:
-                logger.info(f"[{i+1}/{len(songs)}] 送出予 Gemini 萃取標籤: {song['title']}")
+                logger.info(f"[{i+1}/{len(songs)}] 送出予 Gemini 萃取標籤: {song.title}")
                 tags = generate_ai_tags(strategy_text)
 
                 new_features = list(curr_features)
 
                 # 自動判讀 BPM 標籤
-                bpm_tag = get_bpm_tag(song.get("bpm", 0))
+                bpm_tag = get_bpm_tag(song.bpm_max)
 
                 for t in tags:
                     if t not in new_features and t != bpm_tag:
@@ -208,7 +207,7 @@ def main():
                 if bpm_tag and bpm_tag not in new_features:
                     new_features.append(bpm_tag)
 
-                song["features"] = new_features
+                song.features = tuple(new_features)
                 logger.debug(f"  ✓ 新增標籤: {new_features}")
                 changed = True
 
@@ -228,4 +227,7 @@ def main():
 
 
 if __name__ == "__main__":
+    setup_logging()
+    if not init_client():
+        sys.exit(1)
     main()
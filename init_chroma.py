@@ -1,42 +1,45 @@
 import json
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import config
+from lib.chroma_versions import (
+    content_hash,
+    document_hash,
+    garbage_collect,
+    read_pointer,
+    versioned_name,
+    write_pointer,
+)
+from lib.embedding_cache import EmbeddingCache
+from lib.logging_setup import setup_logging
+from lib.songs import Song, read_songs
 
 
-def init_chromadb():
-    print("載入嵌入模型 (這可能需要一點時間)...")
-    # 使用輕量的多國語言模型，對中文和日文支援較好
-    encoder = SentenceTransformer(config.EMBEDDING_MODEL)
-
-    print(f"連接或建立 ChromaDB (路徑: {config.CHROMA_DB_PATH})...")
-    client = chromadb.PersistentClient(path=config.CHROMA_DB_PATH)
-
-    print(f"取得或建立集合 '{config.CHROMA_COLLECTION_NAME}'...")
-    collection = client.get_or_create_collection(name=config.CHROMA_COLLECTION_NAME)
-
-    print("讀取現有的 songs.json...")
-    with open(config.SONGS_DB_PATH, "r", encoding="utf-8") as f:
-        songs = json.load(f)
-
+def build_documents(songs: List[Song]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """將歌曲轉換為集合的 ids、文件與 metadata。"""
     ids = []
     documents = []
     metadatas = []
 
-    print(f"準備寫入 {len(songs)} 首歌的資料...")
     for song in songs:
         # 轉換為字串 ID
-        ids.append(str(song["id"]))
+        ids.append(song.key)
 
         # 建立這首歌的文字描述，這個將用來轉換成向量並比對
-        genre = song.get("genre", "")
-        title = song.get("title", "")
-        subtitle = song.get("subtitle", "")
-        features = ", ".join(song.get("features", []))
-        desc = song.get("description", "")
-        bpm = song.get("bpm", 0)
-        oni_star = song.get("difficulty", {}).get("oni", 0)
-        max_combo = song.get("max_combo", 0)
+        genre = song.genre
+        title = song.title
+        subtitle = song.subtitle
+        features = ", ".join(song.features)
+        desc = song.description
+        bpm = song.bpm
+        oni_star = song.oni
+        max_combo = song.max_combo
 
         doc_text = f"曲名: {title}\n副標題/作者: {subtitle}\n類別: {genre}\n難度: 鬼級 {oni_star} 星\nBPM: {bpm}\n特色: {features}\n描述: {desc}"
         if max_combo:
@@ -45,29 +48,309 @@ def init_chromadb():
         documents.append(doc_text)
 
         # 儲存 metadata，方便後續直接取用原始 JSON 物件
-        song_json = json.dumps(song, ensure_ascii=False)
+        song_json = json.dumps(song.to_dict(), ensure_ascii=False)
         metadatas.append(
-            {"json": song_json, "title": title, "subtitle": subtitle, "genre": genre}
+            {
+                "json": song_json,
+                "title": title,
+                "subtitle": subtitle,
+                "genre": genre,
+                "doc_hash": document_hash(doc_text, config.EMBEDDING_MODEL),
+            }
         )
 
-    # 批次把資料丟進 Embedding 模型產生向量
-    print("開始計算向量 (Embedding)...")
-    embeddings = encoder.encode(documents).tolist()
-
-    # 以批次方式存入 ChromaDB
-    batch_size = config.CHROMA_BATCH_SIZE
-    for i in range(0, len(ids), batch_size):
-        end_idx = min(i + batch_size, len(ids))
-        print(f"正在存入索引 {i} 到 {end_idx - 1}...")
-        collection.upsert(
-            ids=ids[i:end_idx],
-            embeddings=embeddings[i:end_idx],
-            documents=documents[i:end_idx],
-            metadatas=metadatas[i:end_idx],
+    return ids, documents, metadatas
+
+
+def load_previous_hashes(client, base: str) -> Tuple[Optional[Any], Dict[str, str]]:
+    """分頁讀取使用中集合每首歌的 doc_hash；沒有可沿用的集合時回傳 (None, {})。"""
+    pointer = read_pointer()
+    try:
+        collection = client.get_collection(pointer["collection"] if pointer else base)
+    except Exception:
+        return None, {}
+
+    previous = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=config.CHROMA_BATCH_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        for song_id, metadata in zip(page["ids"], page["metadatas"]):
+            if metadata and metadata.get("doc_hash"):
+                previous[song_id] = metadata["doc_hash"]
+        offset += len(page["ids"])
+    return collection, previous
+
+
+def diff_songs(ids: List[str], metadatas: List[Dict[str, Any]], previous: Dict[str, str]) -> Dict[str, List[str]]:
+    """依 doc_hash 將歌曲分為新增、變更、刪除與未變更（沿用向量）。"""
+    summary: Dict[str, List[str]] = {"added": [], "changed": [], "removed": [], "skipped": []}
+    for song_id, metadata in zip(ids, metadatas):
+        if song_id not in previous:
+            summary["added"].append(song_id)
+        elif previous[song_id] != metadata["doc_hash"]:
+            summary["changed"].append(song_id)
+        else:
+            summary["skipped"].append(song_id)
+    current = set(ids)
+    summary["removed"] = [song_id for song_id in previous if song_id not in current]
+    return summary
+
+
+class IndexProgress:
+    """統計編碼與寫入的進度與吞吐量。"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.encoded = 0
+        self.written = 0
+        self.encode_seconds = 0.0
+        self.upsert_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        print(f"已寫入 {self.written}/{self.total} 首（其中重新編碼 {self.encoded} 首，{self.rate():.1f} 首/秒）")
+
+    def summary(self) -> None:
+        print(
+            f"編碼耗時 {self.encode_seconds:.1f} 秒、寫入耗時 {self.upsert_seconds:.1f} 秒，"
+            f"總計 {time.perf_counter() - self.started:.1f} 秒（{self.rate():.1f} 首/秒）"
         )
 
+
+def encode_batches(
+    ids: List[str],
+    documents: List[str],
+    reusable: Set[str],
+    previous_collection,
+    encode: Callable[[List[str]], Any],
+    progress: IndexProgress,
+    batch_size: int,
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    逐批產生 (起點, 終點, float32 向量)：未變更的歌曲向量取自舊集合，其餘交給 encode。
+
+    一次只有一批向量在記憶體中，峰值記憶體不隨歌曲數成長。
+    """
+    for start in range(0, len(ids), batch_size):
+        end = min(start + batch_size, len(ids))
+        chunk = ids[start:end]
+        reused: Dict[str, Any] = {}
+        wanted = [song_id for song_id in chunk if song_id in reusable]
+        if wanted and previous_collection is not None:
+            page = previous_collection.get(ids=wanted, include=["embeddings"])
+            reused = dict(zip(page["ids"], page["embeddings"]))
+
+        pending = [i for i, song_id in enumerate(chunk) if song_id not in reused]
+        computed = None
+        if pending:
+            encode_started = time.perf_counter()
+            computed = np.asarray(encode([documents[start + i] for i in pending]), dtype=np.float32)
+            progress.encode_seconds += time.perf_counter() - encode_started
+            progress.encoded += len(pending)
+
+        dim = computed.shape[1] if computed is not None else len(next(iter(reused.values())))
+        embeddings = np.empty((len(chunk), dim), dtype=np.float32)
+        for i, song_id in enumerate(chunk):
+            if song_id in reused:
+                embeddings[i] = reused[song_id]
+        if computed is not None:
+            embeddings[pending] = computed
+        yield start, end, embeddings
+
+
+def write_batches(
+    collection,
+    batches: Iterable[Tuple[int, int, np.ndarray]],
+    ids: List[str],
+    documents: List[str],
+    metadatas: List[Dict[str, Any]],
+    progress: IndexProgress,
+    depth: int,
+) -> None:
+    """由背景執行緒寫入 ChromaDB，與下一批的編碼重疊；佇列長度限制暫存的批次數。"""
+    queued: "queue.Queue[Optional[Tuple[int, int, np.ndarray]]]" = queue.Queue(maxsize=max(1, depth))
+    errors: List[BaseException] = []
+
+    def consume() -> None:
+        while True:
+            item = queued.get()
+            if item is None:
+                return
+            if errors:
+                # 寫入已失敗：繼續取出佇列內容，避免編碼端卡在 put。
+                continue
+            start, end, embeddings = item
+            try:
+                upsert_started = time.perf_counter()
+                collection.upsert(
+                    ids=ids[start:end],
+                    embeddings=embeddings,
+                    documents=documents[start:end],
+                    metadatas=metadatas[start:end],
+                )
+                progress.upsert_seconds += time.perf_counter() - upsert_started
+                progress.written += end - start
+                progress.report()
+            except BaseException as e:
+                errors.append(e)
+
+    writer = threading.Thread(target=consume, name="chroma-upsert", daemon=True)
+    writer.start()
+    try:
+        for item in batches:
+            if errors:
+                break
+            queued.put(item)
+    finally:
+        queued.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+
+
+def validate_collection(collection, ids: List[str]) -> float:
+    """檢查筆數，並以抽樣歌曲存入的向量自我查詢，回傳前 K 筆結果包含該歌曲的比例（召回率）。"""
+    expected = len(set(ids))
+    count = collection.count()
+    if count != expected:
+        raise ValueError(f"集合筆數 {count} 與歌曲數 {expected} 不符")
+
+    sample = random.Random(0).sample(ids, min(config.CHROMA_VALIDATION_SAMPLE, len(ids)))
+    stored = collection.get(ids=sample, include=["embeddings"])
+    results = collection.query(
+        query_embeddings=stored["embeddings"],
+        n_results=min(config.CHROMA_VALIDATION_TOP_K, count),
+        include=[],
+    )
+    hits = sum(1 for song_id, found in zip(stored["ids"], results["ids"]) if song_id in found)
+    return hits / len(sample)
+
+
+def build_versioned_collection(
+    client,
+    songs: List[Song],
+    encode: Callable[[List[str]], Any],
+    base: str = config.CHROMA_COLLECTION_NAME,
+) -> str:
+    """
+    建立新版本的集合，驗證通過後切換指標檔並刪除舊版本，回傳使用中的集合名稱。
+
+    驗證失敗時刪除新集合並拋出 ValueError，指標檔維持指向舊集合。
+    """
+    if not songs:
+        raise ValueError("songs.json 沒有任何歌曲")
+    ids, documents, metadatas = build_documents(songs)
+    version = content_hash(ids, documents, metadatas, config.EMBEDDING_MODEL)
+    name = versioned_name(base, version)
+
+    existing = {getattr(collection, "name", collection) for collection in client.list_collections()}
+    pointer = read_pointer()
+    if pointer and pointer["collection"] == name and name in existing:
+        print(f"集合 '{name}' 已是最新版本，不需重建")
+        return name
+    if name in existing:
+        # 先前中斷的建立留下的集合，重新建立。
+        client.delete_collection(name)
+
+    # 比對使用中集合的 doc_hash，只重新計算新增與變更歌曲的向量。
+    previous_collection, previous = load_previous_hashes(client, base)
+    summary = diff_songs(ids, metadatas, previous)
+    print(
+        f"新增 {len(summary['added'])} 首、變更 {len(summary['changed'])} 首、"
+        f"刪除 {len(summary['removed'])} 首、未變更 {len(summary['skipped'])} 首"
+    )
+
+    print(f"建立新版本集合 '{name}'...")
+    collection = client.create_collection(
+        name=name, metadata={"songs_hash": version, "embedding_model": config.EMBEDDING_MODEL}
+    )
+
+    # 編碼與寫入以佇列串接：寫入目前批次的同時計算下一批的向量。
+    progress = IndexProgress(len(ids))
+    batches = encode_batches(
+        ids, documents, set(summary["skipped"]), previous_collection, encode, progress, config.CHROMA_BATCH_SIZE
+    )
+    try:
+        write_batches(collection, batches, ids, documents, metadatas, progress, config.CHROMA_PIPELINE_DEPTH)
+    except Exception:
+        client.delete_collection(name)
+        raise
+    progress.summary()
+
+    print("驗證新集合...")
+    try:
+        recall = validate_collection(collection, ids)
+        print(f"抽樣召回率: {recall:.1%}")
+        if recall < config.CHROMA_MIN_RECALL:
+            raise ValueError(f"抽樣召回率 {recall:.1%} 低於門檻 {config.CHROMA_MIN_RECALL:.1%}")
+    except ValueError:
+        client.delete_collection(name)
+        raise
+
+    write_pointer(name, version, collection.count())
+    print(f"已切換到集合 '{name}'")
+    garbage_collect(client, base, config.CHROMA_KEEP_VERSIONS)
+    return name
+
+
+def init_chromadb():
+    encoder = None
+    pool = None
+
+    def encode_with_model(documents: List[str]) -> np.ndarray:
+        # 只有需要計算向量時才載入模型，沒有變更的重建不必等待模型載入。
+        nonlocal encoder, pool
+        if encoder is None:
+            from sentence_transformers import SentenceTransformer
+
+            print("載入嵌入模型 (這可能需要一點時間)...")
+            # 使用輕量的多國語言模型，對中文和日文支援較好
+            encoder = SentenceTransformer(config.EMBEDDING_MODEL)
+            if config.CHROMA_ENCODE_PROCESSES > 1:
+                print(f"啟動 {config.CHROMA_ENCODE_PROCESSES} 個編碼程序...")
+                pool = encoder.start_multi_process_pool(["cpu"] * config.CHROMA_ENCODE_PROCESSES)
+        if pool is not None:
+            return encoder.encode_multi_process(documents, pool, batch_size=config.CHROMA_ENCODE_BATCH_SIZE)
+        return encoder.encode(documents, batch_size=config.CHROMA_ENCODE_BATCH_SIZE, convert_to_numpy=True)
+
+    cache = (
+        EmbeddingCache(config.EMBEDDING_CACHE_DIR, config.EMBEDDING_MODEL, config.EMBEDDING_CACHE_MAX_BYTES)
+        if config.EMBEDDING_CACHE_ENABLED
+        else None
+    )
+
+    def encode(documents: List[str]) -> np.ndarray:
+        # 相同文字（其他環境或先前的重建已計算過）直接取自嵌入向量快取。
+        if cache is None:
+            return np.asarray(encode_with_model(documents), dtype=np.float32)
+        return cache.encode(documents, encode_with_model)
+
+    print(f"連接或建立 ChromaDB (路徑: {config.CHROMA_DB_PATH})...")
+    client = chromadb.PersistentClient(path=config.CHROMA_DB_PATH)
+
+    print("讀取現有的 songs.json...")
+    songs = read_songs(config.SONGS_DB_PATH)
+
+    try:
+        build_versioned_collection(client, songs, encode)
+    finally:
+        if pool is not None:
+            encoder.stop_multi_process_pool(pool)
+        if cache is not None:
+            cache.close()
     print("ChromaDB 初始化完成！")
 
 
 if __name__ == "__main__":
-    init_chromadb()
+    setup_logging()
+    try:
+        init_chromadb()
+    except ValueError as e:
+        print(f"❌ ChromaDB 初始化失敗: {e}")
+        sys.exit(1)
@@ -0,0 +1,75 @@
+"""
+正式環境啟動器
+
+在主程序預載歌曲、ID 索引與查詢編碼模型後 fork 出多個 worker，共用唯讀資料的記憶體。
+
+用法：
+    python launcher.py [--workers 4] [--port 8000]
+
+訊號：
+    SIGHUP           重新載入 songs.json 等共用資料並逐批替換 worker（程式碼更新需重新啟動主程序）；
+                     songs.json、其快照、觸發檔或集合指標檔變更時主程序也會自動執行同樣的替換
+    SIGTERM / SIGINT 優雅關閉
+"""
+import argparse
+import sys
+import config
+
+
+def load_app():
+    from server import app
+    return app
+
+
+def preload() -> None:
+    # 一般啟動時延後匯入的 SDK 在此預先匯入，讓 worker 共用其模組與程式碼物件。
+    import chromadb  # noqa: F401
+    from google import genai  # noqa: F401
+    from lib.dependencies import delegate_reload_to_master, load_shared_data
+    from lib.embeddings import query_encoder
+    load_shared_data(config.SONGS_DB_PATH)
+    # 重新載入由主程序進行並重新 fork，worker 不各自載入（否則會失去共用的記憶體）。
+    delegate_reload_to_master()
+    # 查詢編碼模型在 fork 前載入，worker 以 copy-on-write 共用權重。
+    query_encoder.load()
+
+
+def reload_shared_data() -> None:
+    from lib.dependencies import load_shared_data
+    load_shared_data(config.SONGS_DB_PATH, strict=True)
+
+
+def shared_data_sources():
+    from lib.dependencies import source_signature
+    return source_signature(config.SONGS_DB_PATH)
+
+
+def main() -> int:
+    from lib.prefork import PreforkServer
+
+    parser = argparse.ArgumentParser(description="Taiko AI Advisor pre-fork 啟動器")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=config.WEB_CONCURRENCY)
+    parser.add_argument("--max-requests", type=int, default=config.WORKER_MAX_REQUESTS)
+    parser.add_argument("--max-requests-jitter", type=int, default=config.WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=float, default=config.WORKER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    return PreforkServer(
+        load_app=load_app,
+        preload=preload,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout,
+        reload=reload_shared_data,
+        sources=shared_data_sources,
+        watch_interval=config.RESOURCE_WATCH_INTERVAL_SECONDS,
+    ).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+LLM 生成的准入控制
+
+限制每個 worker 同時進行的 Gemini 串流數量，超出時進入有上限的等待佇列，
+等待逾時或佇列已滿時快速回傳 503。同一存取代碼同時只允許一個生成，
+新訊息會取代（中止）該代碼先前仍在進行的串流。
+"""
+import asyncio
+import math
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import config
+from lib.exceptions import ServiceUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionTicket:
+    """一次獲准的生成；串流結束時必須呼叫 release()。"""
+
+    def __init__(self, controller: "AdmissionController", key: str):
+        self._controller = controller
+        self.key = key
+        self.cancelled = asyncio.Event()
+        self.wait_seconds = 0.0
+        self.admitted_at: Optional[float] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._released = False
+
+    def preempt(self) -> None:
+        """由同一存取代碼的新請求取代：中止串流或放棄排隊。"""
+        self.cancelled.set()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.cancel()
+
+    def release(self) -> None:
+        """釋放名額（可重複呼叫）。"""
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self)
+
+    def __enter__(self) -> "AdmissionTicket":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """全域併發上限 + 有界等待佇列 + 每個存取代碼一個生成。"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._by_key: Dict[str, AdmissionTicket] = {}
+        self._avg_hold_seconds = 10.0
+        self.admitted = 0
+        self.rejected = 0
+        self.preempted = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def retry_after(self) -> int:
+        """依平均生成時間與佇列長度估算建議的重試秒數。"""
+        estimate = self._avg_hold_seconds * (self.queue_depth + 1) / max(self.max_concurrent, 1)
+        return max(1, min(60, math.ceil(estimate)))
+
+    async def admit(self, key: str) -> AdmissionTicket:
+        """取得生成名額，無法准入時拋出 ServiceUnavailableError。"""
+        previous = self._by_key.get(key)
+        if previous is not None:
+            previous.preempt()
+            self.preempted += 1
+
+        ticket = AdmissionTicket(self, key)
+        self._by_key[key] = ticket
+        started_at = time.monotonic()
+        try:
+            if self._active < self.max_concurrent and self.queue_depth == 0:
+                self._active += 1
+            else:
+                await self._wait_in_queue(ticket)
+        except BaseException:
+            if self._by_key.get(key) is ticket:
+                del self._by_key[key]
+            raise
+
+        ticket.admitted_at = time.monotonic()
+        ticket.wait_seconds = ticket.admitted_at - started_at
+        self.admitted += 1
+        self.total_wait_seconds += ticket.wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, ticket.wait_seconds)
+        return ticket
+
+    async def _wait_in_queue(self, ticket: AdmissionTicket) -> None:
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            logger.warning(f"LLM 等待佇列已滿，拒絕請求 (active: {self._active}, queued: {self.queue_depth})")
+            raise ServiceUnavailableError("目前使用人數過多，請稍後再試", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        ticket._waiter = waiter
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+        if waiter.done() and not waiter.cancelled():
+            # 名額已由 _release 直接轉交給此請求。
+            return
+
+        self._abandon(waiter)
+        self.rejected += 1
+        if ticket.cancelled.is_set():
+            raise ServiceUnavailableError("此請求已被新的訊息取代", 1)
+        logger.warning(f"LLM 排隊逾時 ({self.queue_timeout}s)，拒絕請求")
+        raise ServiceUnavailableError("目前使用人數過多，請稍後再試", self.retry_after())
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        """放棄排隊；若名額已轉交過來則立即歸還。"""
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        if waiter.done() and not waiter.cancelled():
+            self._hand_off_or_free()
+        else:
+            waiter.cancel()
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        if self._by_key.get(ticket.key) is ticket:
+            del self._by_key[ticket.key]
+        if ticket.admitted_at is not None:
+            hold = time.monotonic() - ticket.admitted_at
+            self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * hold
+            self._hand_off_or_free()
+
+    def _hand_off_or_free(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self._active -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """回傳目前的併發、佇列深度與等待時間統計。"""
+        return {
+            "active": self._active,
+            "queued": self.queue_depth,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "preempted": self.preempted,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 4),
+        }
+
+
+admission_controller = AdmissionController(
+    max_concurrent=config.LLM_MAX_CONCURRENT_STREAMS,
+    max_queue=config.LLM_MAX_QUEUE,
+    queue_timeout=config.LLM_QUEUE_TIMEOUT_SECONDS,
+)
@@ -5,6 +5,8 @@ import time
 import math
 import logging
 import config
+from lib.metrics import AUTH_VALIDATE_SECONDS
+from lib.tracing import bind_user, trace_stage
 
 # 令牌過期時間（天數）
 TOKEN_EXPIRY_DAYS = config.TOKEN_EXPIRY_DAYS
@@ -14,9 +16,15 @@ logger = logging.getLogger(__name__)
 def logout_user(code: str) -> bool:
     """登出用戶（刪除用戶記錄）"""
     from lib.services.user_service import delete_user
+    _forget_quota(code)
     return delete_user(code)
 
 
+def _forget_quota(code: str) -> None:
+    from lib.services.quota_service import quota_service
+    quota_service.forget(code)
+
+
 def validate_token(code: str) -> bool:
     """
     驗證令牌是否有效
@@ -24,6 +32,12 @@ def validate_token(code: str) -> bool:
     - 檢查是否過期
     - 自動清理過期用戶
     """
+    bind_user(code)
+    with AUTH_VALIDATE_SECONDS.time(), trace_stage("auth"):
+        return _validate_token(code)
+
+
+def _validate_token(code: str) -> bool:
     from .validators import sanitize_input
     from lib.services.user_service import load_users, save_users, delete_user
     
@@ -52,7 +66,8 @@ def validate_token(code: str) -> bool:
         if not math.isfinite(created_at):
             raise ValueError("created_at is not finite")
     except (TypeError, ValueError):
-        logger.warning(f"偵測到無效 token 時間戳，已清理用戶資料 (code: {code[:8]}...)")
+        logger.warning("偵測到無效 token 時間戳，已清理用戶資料")
+        _forget_quota(code)
         delete_user(code)
         return False
     
@@ -60,6 +75,7 @@ def validate_token(code: str) -> bool:
     expiry_time = created_at + (TOKEN_EXPIRY_DAYS * 86400)
     if time.time() > expiry_time:
         # 令牌已過期，刪除用戶
+        _forget_quota(code)
         delete_user(code)
         return False
     
@@ -3,6 +3,9 @@
 """
 import re
 
+# 對話 ID：由伺服器產生的 UUID 或舊版客戶端的 ID，也用作對話檔名，只允許英數字與連字號。
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
 
 def sanitize_input(text: str, max_length: int = 500) -> str:
     """
@@ -0,0 +1,105 @@
+"""
+ChromaDB 集合版本管理
+
+init_chroma.py 每次都建立新的版本化集合（<CHROMA_COLLECTION_NAME>_v<內容雜湊>），
+驗證通過後才原子性地更新指標檔，伺服器依指標檔決定要查詢的集合。
+每首歌的 metadata 記錄 doc_hash，文件與模型都未變更的歌曲直接沿用使用中集合的向量。
+重建期間伺服器持續查詢舊集合，不受影響；舊版本在保留數量之外的部分會被刪除。
+
+指標檔不存在時沿用未版本化的 CHROMA_COLLECTION_NAME，與舊部署相容。
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import config
+
+if TYPE_CHECKING:
+    import chromadb
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], model: str) -> str:
+    """以寫入集合的內容與嵌入模型計算版本雜湊；內容相同時得到相同的版本。"""
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for item in zip(ids, documents, metadatas):
+        digest.update(json.dumps(item, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def document_hash(document: str, model: str) -> str:
+    """單首歌曲文件與嵌入模型的雜湊，存於 metadata 的 doc_hash，用於判斷向量能否沿用。"""
+    return hashlib.sha256(f"{model}\0{document}".encode("utf-8")).hexdigest()[:16]
+
+
+def versioned_name(base: str, version: str) -> str:
+    return f"{base}_v{version}"
+
+
+def read_pointer(path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """讀取指標檔；不存在或格式錯誤時回傳 None。"""
+    path = path or config.CHROMA_POINTER_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            pointer = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"無法讀取集合指標檔 {path}: {e}")
+        return None
+    if not isinstance(pointer, dict) or not isinstance(pointer.get("collection"), str):
+        logger.error(f"集合指標檔格式錯誤: {path}")
+        return None
+    return pointer
+
+
+def resolve_collection_name(default: str, path: Optional[str] = None) -> str:
+    """回傳目前使用中的集合名稱。"""
+    pointer = read_pointer(path)
+    return pointer["collection"] if pointer else default
+
+
+def write_pointer(name: str, version: str, count: int, path: Optional[str] = None) -> Dict[str, Any]:
+    """以 os.replace 原子性地將指標切換到新集合，並保留先前版本的順序供垃圾回收參考。"""
+    path = path or config.CHROMA_POINTER_PATH
+    previous = read_pointer(path)
+    history = [name] + [old for old in (previous or {}).get("history", []) if old != name]
+    pointer = {
+        "collection": name,
+        "version": version,
+        "count": count,
+        "activated_at": time.time(),
+        "history": history,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", delete=False, dir=directory if directory else None, suffix=".tmp"
+    ) as tmp_file:
+        json.dump(pointer, tmp_file, indent=2, ensure_ascii=False)
+        tmp_path = tmp_file.name
+    os.replace(tmp_path, path)
+    return pointer
+
+
+def garbage_collect(client: "chromadb.ClientAPI", base: str, keep: int, path: Optional[str] = None) -> List[str]:
+    """刪除最近 keep 個版本（含使用中的版本）之外的版本化集合，回傳被刪除的名稱。"""
+    pointer = read_pointer(path)
+    if pointer is None:
+        return []
+    retained = set(pointer.get("history", [])[: max(1, keep)]) | {pointer["collection"]}
+    prefix = f"{base}_v"
+    deleted = []
+    for collection in client.list_collections():
+        name = getattr(collection, "name", collection)
+        if name.startswith(prefix) and name not in retained:
+            client.delete_collection(name)
+            deleted.append(name)
+    if deleted:
+        logger.info(f"已刪除舊版集合: {', '.join(deleted)}")
+    return deleted
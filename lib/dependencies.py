@@ -2,82 +2,379 @@
 FastAPI 依賴注入 - 全局資源管理
 
 此模塊管理所有全局資源，使其可以通過 FastAPI 的依賴注入系統傳遞到路由。
+
+歌曲資料、歌曲 ID 索引與向量集合組成一個不可變的 ResourceSnapshot。重新載入時在背景建立
+新的快照，驗證後以單一指派替換；進行中的請求持有開始時取得的快照，不受替換影響。
+重新載入可由檔案變更（songs.json 與其快照、觸發檔或集合指標檔，見 ResourceWatcher）或管理端點觸發。
+由 pre-fork 啟動器執行時改由主程序監看並重新 fork worker（見 delegate_reload_to_master），
+worker 不各自重新載入，新 worker 仍以 copy-on-write 共用主程序載入的資料。
 """
-from typing import Optional
-import chromadb
-from google import genai
-import json
+from dataclasses import dataclass, field, replace
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import asyncio
 import logging
+import os
+import threading
+import time
+import config
+from lib.chroma_versions import resolve_collection_name
+from lib.embeddings import query_encoder
+from lib.exceptions import ResourceReloadError
+from lib.metrics import RESOURCE_RELOADS_TOTAL
+from lib.song_snapshot import load_songs, snapshot_path
+from lib.songs import Song
+
+if TYPE_CHECKING:
+    import chromadb
+    from google import genai
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    """某一版本的歌曲資料與向量集合；替換時整個物件一起換掉，不就地修改。"""
+    version: int = 0
+    songs: List[Song] = field(default_factory=list)
+    songs_by_id: Dict[str, Song] = field(default_factory=dict)
+    collection: Optional["chromadb.Collection"] = None
+    collection_loaded: bool = False
+    # 建立快照時各監看檔案的 (路徑, mtime_ns, 大小)，用於判斷是否需要重新載入。
+    sources: Tuple[Tuple[str, Optional[int], Optional[int]], ...] = ()
+    loaded_at: float = 0.0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "songs_count": len(self.songs),
+            "collection": getattr(self.collection, "name", None),
+            "loaded_at": self.loaded_at,
+        }
+
+
 # 全局資源存儲
-_client: Optional[genai.Client] = None
-_collection: Optional[chromadb.Collection] = None
-_all_songs: list = []
+_client: Optional["genai.Client"] = None
+_client_ready = False
+_snapshot = ResourceSnapshot()
+_settings: Dict[str, Any] = {}
+_init_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_shared_data_loaded = False
+_reload_delegated = False
+
+
+def source_signature(songs_path: str) -> Tuple[Tuple[str, Optional[int], Optional[int]], ...]:
+    """各監看檔案的 (路徑, mtime_ns, 大小)。"""
+    signature = []
+    paths = (songs_path, snapshot_path(songs_path), config.RESOURCE_RELOAD_TRIGGER_PATH, config.CHROMA_POINTER_PATH)
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def _read_songs(songs_path: str) -> List[Song]:
+    return load_songs(songs_path)
+
+
+def _index_songs(songs: List[Song]) -> Dict[str, Song]:
+    return {song.key: song for song in songs if song.key is not None}
+
+
+def _open_collection(chroma_path: str, collection_name: str) -> "chromadb.Collection":
+    """開啟指標檔指向的版本化集合（沒有指標檔時使用 collection_name）。"""
+    import chromadb
+
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+    return chroma_client.get_collection(name=resolve_collection_name(collection_name))
+
+
+def query_collection(collection: "chromadb.Collection", texts: List[str], n_results: int) -> Dict[str, Any]:
+    """以建立索引時的同一模型編碼查詢；查詢編碼器無法使用時改由 Chroma 內建模型編碼。"""
+    query_embeddings = query_encoder.encode(texts)
+    if query_embeddings is not None:
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results)
+    return collection.query(query_texts=texts, n_results=n_results)
+
 
+def _validate_collection(collection: "chromadb.Collection") -> None:
+    """確認新集合可用：非空，且金絲雀查詢能取得結果（同時載入索引）。"""
+    if collection.count() == 0:
+        raise ValueError("向量集合為空")
+    results = query_collection(collection, [config.READINESS_CANARY_QUERY], n_results=1)
+    if not (results.get("ids") or [[]])[0]:
+        raise ValueError("金絲雀查詢沒有結果")
 
-def init_resources(gemini_key: str, chroma_path: str, collection_name: str, songs_path: str):
-    """初始化全局資源 - 在應用啟動時調用"""
-    global _client, _collection, _all_songs
-    
-    # 初始化 Gemini
+
+def load_shared_data(songs_path: str, strict: bool = False) -> None:
+    """
+    載入唯讀的共用資料：歌曲與歌曲 ID 索引。
+
+    pre-fork 啟動器在 fork 前於主程序呼叫，worker 之後的 init_resources 不會重新載入。
+    查詢編碼模型不在此載入（見 lib.embeddings）。
+    strict 時（主程序重新載入）歌曲無法讀取或為空會拋出 ResourceReloadError 並保留目前的資料。
+    """
+    global _snapshot, _shared_data_loaded
+
+    sources = source_signature(songs_path)
+    try:
+        songs = _read_songs(songs_path)
+        if strict and not songs:
+            raise ValueError("歌曲資料為空")
+        logger.info(f"✅ 載入歌曲數據成功 ({len(songs)} 首)")
+    except Exception as e:
+        logger.error(f"❌ 無法載入歌曲數據: {e}")
+        if strict:
+            raise ResourceReloadError(f"重新載入資源失敗: {e}") from e
+        songs = []
+    _snapshot = ResourceSnapshot(
+        version=_snapshot.version + 1,
+        songs=songs,
+        songs_by_id=_index_songs(songs),
+        sources=sources,
+        loaded_at=time.time(),
+    )
+    _shared_data_loaded = True
+
+
+def init_resources(
+    gemini_key: str,
+    chroma_path: str,
+    collection_name: str,
+    songs_path: str,
+    run_warmup: Optional[bool] = None,
+    warmup_in_background: Optional[bool] = None,
+):
+    """
+    初始化全局資源 - 在應用啟動時調用
+
+    Gemini 客戶端、ChromaDB 與查詢編碼模型在第一次取用時才建立：SDK 匯入與模型載入需要數秒，
+    延後到背景的預熱或第一個聊天請求，/livez 在啟動後即可回應。
+    啟用預熱時（預設依 config.WARMUP_ENABLED）接著執行啟動預熱，見 lib.warmup。
+    """
+    global _settings
+
+    with _init_lock:
+        _settings = {
+            "gemini_key": gemini_key,
+            "chroma_path": chroma_path,
+            "collection_name": collection_name,
+            "songs_path": songs_path,
+        }
+    if not gemini_key:
+        logger.warning("⚠️ 未提供 GEMINI_API_KEY，聊天功能將無法使用")
+
+    # 讀取歌曲數據（pre-fork 啟動時已由主程序載入）
+    if not _shared_data_loaded:
+        load_shared_data(songs_path)
+
+    if config.WARMUP_ENABLED if run_warmup is None else run_warmup:
+        # 預熱模組依賴聊天服務，而聊天服務依賴本模組，因此在此才匯入。
+        from lib.warmup import warmup
+
+        background = config.WARMUP_IN_BACKGROUND if warmup_in_background is None else warmup_in_background
+        warmup.start(chroma_path, background=background)
+
+
+def _init_client() -> None:
+    global _client, _client_ready
+
+    gemini_key = _settings.get("gemini_key")
     if gemini_key:
         try:
-            _client = genai.Client(api_key=gemini_key)
+            from google import genai
+            from google.genai import types
+
+            http_options = (
+                types.HttpOptions(base_url=config.GEMINI_BASE_URL) if config.GEMINI_BASE_URL else None
+            )
+            _client = genai.Client(api_key=gemini_key, http_options=http_options)
             logger.info("✅ Gemini 客戶端初始化成功")
         except Exception as e:
             logger.error(f"❌ Gemini 初始化失敗: {e}")
             _client = None
-    else:
-        logger.warning("⚠️ 未提供 GEMINI_API_KEY，聊天功能將無法使用")
-        _client = None
-    
-    # 初始化 ChromaDB
+    _client_ready = True
+
+
+def _init_collection() -> None:
+    global _snapshot
+
     try:
-        chroma_client = chromadb.PersistentClient(path=chroma_path)
-        _collection = chroma_client.get_collection(name=collection_name)
-        logger.info(f"✅ ChromaDB 連接成功 (collection: {collection_name})")
+        collection = _open_collection(_settings["chroma_path"], _settings["collection_name"])
+        logger.info(f"✅ ChromaDB 連接成功 (collection: {collection.name})")
     except Exception as e:
         logger.error(f"❌ ChromaDB 初始化失敗: {e}")
-        _collection = None
-    
-    # 讀取歌曲數據
-    try:
-        with open(songs_path, "r", encoding="utf-8") as f:
-            _all_songs = json.load(f)
-        logger.info(f"✅ 載入歌曲數據成功 ({len(_all_songs)} 首)")
-    except Exception as e:
-        logger.error(f"❌ 無法載入歌曲數據: {e}")
-        _all_songs = []
+        collection = None
+    _snapshot = replace(_snapshot, collection=collection, collection_loaded=True)
+
+
+def reload_resources(reason: str = "manual") -> ResourceSnapshot:
+    """
+    重新載入歌曲資料與向量集合並替換目前的快照
+
+    新快照在呼叫端的執行緒中建立與驗證，完成後才以單一指派替換；
+    任何一步失敗時保留目前的快照並拋出 ResourceReloadError。
+    """
+    global _snapshot
+
+    if not _settings:
+        raise ResourceReloadError("資源尚未初始化")
+    with _reload_lock:
+        started = time.perf_counter()
+        settings = dict(_settings)
+        # 先記錄來源狀態：建立期間若檔案再次變更，監看器會再觸發一次重新載入。
+        sources = source_signature(settings["songs_path"])
+        try:
+            songs = _read_songs(settings["songs_path"])
+            if not songs:
+                raise ValueError("歌曲資料為空")
+            collection = _open_collection(settings["chroma_path"], settings["collection_name"])
+            _validate_collection(collection)
+        except Exception as e:
+            RESOURCE_RELOADS_TOTAL.labels("failed").inc()
+            logger.error(f"❌ 重新載入資源失敗 ({reason}): {e}")
+            raise ResourceReloadError(f"重新載入資源失敗: {e}") from e
+
+        with _init_lock:
+            snapshot = ResourceSnapshot(
+                version=_snapshot.version + 1,
+                songs=songs,
+                songs_by_id=_index_songs(songs),
+                collection=collection,
+                collection_loaded=True,
+                sources=sources,
+                loaded_at=time.time(),
+            )
+            _snapshot = snapshot
+        RESOURCE_RELOADS_TOTAL.labels("success").inc()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(
+            f"✅ 資源已重新載入 ({reason}): 第 {snapshot.version} 版，{len(songs)} 首歌，{elapsed_ms:.0f}ms"
+        )
+        return snapshot
+
+
+def delegate_reload_to_master() -> None:
+    """由 pre-fork 主程序負責重新載入：停用 worker 內的 ResourceWatcher，管理端點只更新觸發檔。"""
+    global _reload_delegated
+    _reload_delegated = True
+
+
+def reload_delegated() -> bool:
+    return _reload_delegated
+
+
+def touch_reload_trigger() -> None:
+    """更新重新載入觸發檔的時間戳記，同一主機上所有 worker 的監看器都會重新載入。"""
+    path = config.RESOURCE_RELOAD_TRIGGER_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8"):
+        pass
+    os.utime(path, None)
+
+
+class ResourceWatcher:
+    """定期檢查歌曲資料與重新載入觸發檔，變更後在背景重新載入資源。"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Optional[Tuple] = None
+        self._failed: Optional[Tuple] = None
+
+    def check(self) -> bool:
+        """檢查一次；來源已變更且與上次檢查相同（寫入已完成）時重新載入並回傳 True。"""
+        if not _settings:
+            return False
+        current = source_signature(_settings["songs_path"])
+        if current == _snapshot.sources or current == self._failed:
+            self._pending = None
+            return False
+        if current != self._pending:
+            self._pending = current
+            return False
+        self._pending = None
+        try:
+            reload_resources("檔案變更")
+        except ResourceReloadError:
+            # 同一版本的檔案不再重試，等下一次變更。
+            self._failed = current
+            return False
+        self._failed = None
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                logger.error(f"檢查資源檔案失敗: {e}", exc_info=True)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0 and not _reload_delegated:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+resource_watcher = ResourceWatcher(config.RESOURCE_WATCH_INTERVAL_SECONDS)
 
 
 def cleanup_resources():
     """清理全局資源 - 在應用關閉時調用"""
-    global _client, _collection, _all_songs
+    global _client, _client_ready, _snapshot, _settings, _shared_data_loaded, _reload_delegated
 
-    if _collection is not None:
-        # ChromaDB 集合清理
-        _collection = None
-    if _client is not None:
-        # Gemini 客戶端清理
+    with _init_lock:
         _client = None
-
-    _client = None
-    _collection = None
-    _all_songs = []
+        _client_ready = False
+        _snapshot = ResourceSnapshot()
+        _settings = {}
+    _shared_data_loaded = False
+    _reload_delegated = False
+    query_encoder.unload()
     logger.info("資源清理完成")
 
-def get_client() -> Optional[genai.Client]:
-    """獲取 Gemini 客戶端"""
+def get_client() -> Optional["genai.Client"]:
+    """獲取 Gemini 客戶端（第一次呼叫時建立）"""
+    if not _client_ready and _settings:
+        with _init_lock:
+            if not _client_ready and _settings:
+                _init_client()
     return _client
 
 
-def get_collection() -> Optional[chromadb.Collection]:
-    """獲取 ChromaDB 集合"""
-    return _collection
+def get_snapshot() -> ResourceSnapshot:
+    """獲取目前的資源快照（第一次呼叫時連線 ChromaDB）"""
+    if not _snapshot.collection_loaded and _settings:
+        with _init_lock:
+            if not _snapshot.collection_loaded and _settings:
+                _init_collection()
+    return _snapshot
 
 
-def get_all_songs() -> list:
+def get_collection() -> Optional["chromadb.Collection"]:
+    """獲取 ChromaDB 集合（第一次呼叫時連線）"""
+    return get_snapshot().collection
+
+
+def get_all_songs() -> List[Song]:
     """獲取所有歌曲"""
-    return _all_songs
+    return _snapshot.songs
+
+
+def get_song_by_id(song_id: str) -> Optional[Song]:
+    """以歌曲 ID 取得歌曲"""
+    return _snapshot.songs_by_id.get(song_id)
@@ -0,0 +1,253 @@
+"""
+內容定址的嵌入向量快取
+
+鍵為 SHA-256(模型名稱 + 文字)，更換 config.EMBEDDING_MODEL 時自然不會命中舊的向量；
+檔案中只有雜湊值，不保存原始文字。init_chroma.py 的歌曲文件與查詢編碼器的查詢文字各用一個快取目錄，
+兩者的使用模式不同，壓縮時不會互相淘汰。
+
+向量以 float32 存在單一只附加的檔案中，每筆紀錄為 32 bytes 的鍵、4 bytes 的維度
+（little-endian uint32）與 dim 個 float32；讀取時以 mmap 取出。開啟時掃描紀錄標頭建立索引，
+其他程序新增的紀錄在查詢未命中時補讀。
+
+檔案超過上限時由背景執行緒依最近使用順序保留向量並重寫檔案（以 os.replace 替換，
+其他程序偵測到 inode 變更後重新掃描）。最近使用順序只記錄在各程序的記憶體中：
+壓縮時以執行壓縮的程序看到的順序為準，其餘紀錄依寫入順序。
+重寫期間持有跨程序的檔案鎖，但不持有讀取用的鎖，查詢照常讀取舊檔案；
+查詢路徑以 wait=False 寫入，檔案鎖被佔用時略過寫入而不等待。
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+from filelock import FileLock, Timeout
+from lib.metrics import EMBEDDING_CACHE_LOOKUPS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<32sI")
+# 壓縮時保留到上限的這個比例，避免每次寫入都觸發壓縮。
+COMPACT_TARGET_RATIO = 0.75
+
+
+class EmbeddingCache:
+    """以 mmap 讀取、只附加寫入的嵌入向量快取。"""
+
+    def __init__(self, directory: str, model_name: str, max_bytes: int):
+        self.directory = directory
+        self.path = os.path.join(directory, "vectors.bin")
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(directory, "vectors.lock"))
+        # 鍵 -> (向量的位移, 維度)；順序即最近使用順序（最後面為最近使用）。
+        self._index: "OrderedDict[bytes, Tuple[int, int]]" = OrderedDict()
+        self._scanned = 0
+        self._inode: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._compactor: Optional[threading.Thread] = None
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    # ---- 檔案與索引 ----
+
+    def _reset(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._index.clear()
+        self._scanned = 0
+        self._inode = None
+
+    def _refresh(self) -> int:
+        """補讀檔案中尚未索引的紀錄，回傳最後一筆完整紀錄的結尾位置。"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return 0
+        if stat.st_ino != self._inode:
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size <= self._scanned:
+            return self._scanned
+
+        position = self._scanned
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            while position + RECORD_HEADER.size <= stat.st_size:
+                key, dim = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                end = position + RECORD_HEADER.size + dim * 4
+                # 寫入到一半的紀錄（程序中斷）視為不存在，下次寫入時截掉。
+                if end > stat.st_size:
+                    break
+                self._index[key] = (position + RECORD_HEADER.size, dim)
+                self._index.move_to_end(key)
+                f.seek(end)
+                position = end
+        self._scanned = position
+        return position
+
+    def _read(self, offset: int, dim: int) -> Optional[np.ndarray]:
+        end = offset + dim * 4
+        if self._mm is None or len(self._mm) < end:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_ino != self._inode:
+                    # 其他程序剛壓縮過檔案，索引已過期。
+                    self._reset()
+                    return None
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(self._mm, dtype=np.float32, count=dim, offset=offset).copy()
+
+    # ---- 讀寫 ----
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """回傳每段文字的快取向量，未命中者為 None。"""
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self._refresh()
+            vectors: List[Optional[np.ndarray]] = []
+            for key in keys:
+                entry = self._index.get(key)
+                vector = self._read(*entry) if entry is not None else None
+                if vector is not None:
+                    self._index.move_to_end(key)
+                vectors.append(vector)
+        hits = sum(vector is not None for vector in vectors)
+        EMBEDDING_CACHE_LOOKUPS_TOTAL.labels("hit").inc(hits)
+        EMBEDDING_CACHE_LOOKUPS_TOTAL.labels("miss").inc(len(vectors) - hits)
+        return vectors
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray, wait: bool = True) -> bool:
+        """
+        附加新的向量（已存在的鍵略過），回傳是否已寫入。
+
+        wait=False 時若其他程序或執行緒正持有檔案鎖（寫入或壓縮中）則直接略過。
+        超過上限時在背景執行緒壓縮檔案，不在呼叫端等待。
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            self._file_lock.acquire(timeout=-1 if wait else 0)
+        except Timeout:
+            return False
+        try:
+            with self._lock:
+                position = self._refresh()
+                buffer = bytearray()
+                for text, vector in zip(texts, vectors):
+                    key = self.key(text)
+                    if key in self._index:
+                        continue
+                    buffer += RECORD_HEADER.pack(key, vector.shape[0])
+                    self._index[key] = (position + len(buffer), vector.shape[0])
+                    buffer += vector.tobytes()
+                if not buffer:
+                    return True
+                with open(self.path, "ab") as f:
+                    os.ftruncate(f.fileno(), position)
+                    f.write(buffer)
+                    if self._inode is None:
+                        self._inode = os.fstat(f.fileno()).st_ino
+                self._scanned = position + len(buffer)
+                oversized = self._scanned > self.max_bytes
+        finally:
+            self._file_lock.release()
+        if oversized:
+            self._schedule_compaction()
+        return True
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        encode: Callable[[List[str]], Sequence[Sequence[float]]],
+        wait: bool = True,
+    ) -> np.ndarray:
+        """取得 texts 的向量：命中者取自快取，其餘以 encode 計算後寫入快取（wait 見 put_many）。"""
+        vectors = self.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32)
+            try:
+                self.put_many([texts[i] for i in missing], computed, wait=wait)
+            except OSError as e:
+                logger.warning(f"寫入嵌入向量快取失敗: {e}")
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def _schedule_compaction(self) -> None:
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(
+                target=self._compact_in_background, name="embedding-cache-compact", daemon=True
+            )
+            self._compactor.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            logger.warning(f"壓縮嵌入向量快取失敗: {e}")
+
+    def compact(self) -> bool:
+        """檔案超過上限時依最近使用順序保留向量並重寫檔案，回傳是否已壓縮。"""
+        with self._file_lock:
+            with self._lock:
+                self._refresh()
+                if self._scanned <= self.max_bytes:
+                    return False
+                entries = list(self._index.items())
+                inode = self._inode
+
+            target = int(self.max_bytes * COMPACT_TARGET_RATIO)
+            kept: List[Tuple[bytes, int, int]] = []
+            total = 0
+            for key, (offset, dim) in reversed(entries):
+                size = RECORD_HEADER.size + dim * 4
+                if total + size > target:
+                    break
+                kept.append((key, offset, dim))
+                total += size
+            kept.reverse()
+
+            # 以獨立的 mmap 複製，查詢仍可在讀取用的鎖下使用舊檔案。
+            tmp_path = self.path + ".tmp"
+            with open(self.path, "rb") as source:
+                if os.fstat(source.fileno()).st_ino != inode:
+                    return False
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm, open(tmp_path, "wb") as out:
+                    for key, offset, dim in kept:
+                        out.write(RECORD_HEADER.pack(key, dim))
+                        out.write(mm[offset:offset + dim * 4])
+            os.replace(tmp_path, self.path)
+
+            with self._lock:
+                # 新檔案依最近使用順序寫入，重新掃描後索引仍維持該順序。
+                self._reset()
+                self._refresh()
+        logger.info(f"嵌入向量快取已壓縮：保留 {len(kept)} 筆，淘汰 {len(entries) - len(kept)} 筆")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._index), "bytes": self._scanned, "max_bytes": self.max_bytes}
+
+    def close(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            self._reset()
@@ -0,0 +1,89 @@
+"""
+查詢向量編碼
+
+ChromaDB 中的歌曲向量由 init_chroma.py 以 config.EMBEDDING_MODEL 計算；查詢時若只傳 query_texts，
+Chroma 會改用集合的預設嵌入函式，與建立索引時的模型不一致。此模組以同一個模型編碼查詢文字。
+
+模型在程序內只載入一次，匯入 torch 與讀入權重需要數秒，因此不在啟動時載入：
+一般啟動時由背景預熱或第一次編碼載入；pre-fork 啟動器會在 fork 前於主程序載入，
+讓所有 worker 以 copy-on-write 共用模型權重。停用、未安裝 sentence-transformers 或載入失敗時退回 query_texts。
+啟用 EMBEDDING_CACHE_ENABLED 時，常見查詢的向量取自磁碟快取（與 init_chroma.py 的歌曲向量分開存放）。
+encode() 會載入模型、執行推論並讀寫快取，應在執行緒池中呼叫。
+"""
+import logging
+import threading
+from typing import Any, List, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEncoder:
+    """以建立索引時的嵌入模型編碼查詢文字。"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model: Any = None
+        self._cache: Any = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> bool:
+        """載入模型（可重複呼叫）；停用或無法載入時回傳 False，載入失敗後不再重試。"""
+        if not config.QUERY_ENCODER_ENABLED:
+            return False
+        with self._lock:
+            if self._model is not None:
+                return True
+            if self._failed:
+                return False
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                self._failed = True
+                logger.warning("未安裝 sentence-transformers，查詢將使用 ChromaDB 預設的嵌入函式")
+                return False
+            try:
+                # 只載入權重、不在此執行推論：推論會建立執行緒池，fork 之後無法安全使用。
+                self._model = SentenceTransformer(self.model_name)
+            except Exception as e:
+                self._failed = True
+                logger.error(f"❌ 嵌入模型載入失敗: {e}")
+                return False
+            if config.EMBEDDING_CACHE_ENABLED:
+                # 快取檔在第一次查詢時才開啟，fork 前的主程序不持有 mmap。
+                from lib.embedding_cache import EmbeddingCache
+
+                self._cache = EmbeddingCache(
+                    config.EMBEDDING_QUERY_CACHE_DIR, self.model_name, config.EMBEDDING_QUERY_CACHE_MAX_BYTES
+                )
+            logger.info(f"✅ 嵌入模型載入成功 ({self.model_name})")
+            return True
+
+    def encode(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """回傳查詢向量；模型尚未載入時先載入（其他執行緒正在載入時等待），無法使用時回傳 None。"""
+        model = self._model
+        if model is None:
+            if not self.load():
+                return None
+            model = self._model
+        cache = self._cache
+        if cache is None:
+            return model.encode(texts).tolist()
+        # 查詢路徑不等待其他程序寫入或壓縮快取，檔案鎖被佔用時只是不寫入。
+        return cache.encode(texts, model.encode, wait=False).tolist()
+
+    def unload(self) -> None:
+        with self._lock:
+            self._model = None
+            self._failed = False
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+
+query_encoder = QueryEncoder(config.EMBEDDING_MODEL)
@@ -35,3 +35,16 @@ class RateLimitError(TaikoAdvisorException):
     """速率限制異常"""
     def __init__(self, message: str = "請求過於頻繁，請稍後再試"):
         super().__init__(message, 429)
+
+
+class ServiceUnavailableError(TaikoAdvisorException):
+    """服務暫時無法處理請求（附帶建議的重試秒數）"""
+    def __init__(self, message: str = "服務繁忙，請稍後再試", retry_after: int = 5):
+        super().__init__(message, 503)
+        self.retry_after = retry_after
+
+
+class ResourceReloadError(TaikoAdvisorException):
+    """重新載入歌曲資料或向量集合失敗（目前的資料維持不變）"""
+    def __init__(self, message: str = "重新載入資源失敗"):
+        super().__init__(message, 500)
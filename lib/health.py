@@ -0,0 +1,142 @@
+"""
+存活與就緒檢查
+
+- /livez：常數時間、不做任何 I/O
+- /readyz：回傳背景探測器的快取結果；探測器定期執行 Chroma 檢索（與聊天相同，以查詢編碼器編碼）與用戶資料讀取，
+  記錄延遲，並在超過 SLO 時標記為 degraded。啟動預熱結束前不執行探測（維持 starting）
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+import config
+from lib.dependencies import get_all_songs, get_client, get_collection, query_collection
+from lib.warmup import Warmup, warmup
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProbeCheck:
+    """單一探測項目；critical 失敗時為 unavailable，否則僅標記 degraded。"""
+    name: str
+    run: Callable[[], Any]
+    slo_seconds: Optional[float] = None
+    critical: bool = True
+
+
+class ReadinessProber:
+    """在背景定期執行探測，請求端只讀取快取的結果。"""
+
+    def __init__(self, checks: List[ProbeCheck], interval: float, timeout: float, warmup: Optional[Warmup] = None):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.warmup = warmup
+        self._task: Optional[asyncio.Task] = None
+        self._result: Dict[str, Any] = {"status": "starting", "checked_at": None, "checks": {}}
+
+    async def _run_check(self, check: ProbeCheck) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.to_thread(check.run), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return {"ok": False, "latency_ms": round(self.timeout * 1000, 1), "error": "逾時"}
+        except Exception as e:
+            return {"ok": False, "latency_ms": round((time.perf_counter() - started) * 1000, 1), "error": str(e)}
+        latency = time.perf_counter() - started
+        result: Dict[str, Any] = {"ok": True, "latency_ms": round(latency * 1000, 1)}
+        if check.slo_seconds is not None:
+            result["slo_ms"] = round(check.slo_seconds * 1000, 1)
+            result["within_slo"] = latency <= check.slo_seconds
+        return result
+
+    async def run_once(self) -> Dict[str, Any]:
+        """執行所有探測並更新快取結果。"""
+        results = await asyncio.gather(*(self._run_check(check) for check in self.checks))
+        checks = {check.name: result for check, result in zip(self.checks, results)}
+
+        status = "ready"
+        for check in self.checks:
+            result = checks[check.name]
+            if not result["ok"] and check.critical:
+                status = "unavailable"
+                break
+            if not result["ok"] or not result.get("within_slo", True):
+                status = "degraded"
+
+        previous = self._result["status"]
+        self._result = {"status": status, "checked_at": time.time(), "checks": checks}
+        if status != previous:
+            logger.info(f"就緒狀態變更: {previous} -> {status}")
+        return self._result
+
+    async def _loop(self) -> None:
+        if self.warmup is not None:
+            await self.warmup.wait()
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"就緒探測失敗: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        if self.warmup is None:
+            return self._result
+        return {**self._result, "warmup": self.warmup.snapshot()}
+
+
+def _probe_chroma() -> None:
+    collection = get_collection()
+    if collection is None:
+        raise RuntimeError("ChromaDB 未初始化")
+    query_collection(collection, [config.READINESS_CANARY_QUERY], n_results=1)
+
+
+def _probe_user_store() -> None:
+    # save_users 以 os.replace 原子性寫入，因此不需持有檔案鎖即可讀取。
+    if os.path.exists(config.USERS_DB_PATH):
+        with open(config.USERS_DB_PATH, "r", encoding="utf-8") as f:
+            json.load(f)
+        if not os.access(config.USERS_DB_PATH, os.W_OK):
+            raise RuntimeError("用戶資料庫不可寫入")
+
+
+def _probe_songs() -> None:
+    if not get_all_songs():
+        raise RuntimeError("歌曲資料未載入")
+
+
+def _probe_gemini() -> None:
+    if get_client() is None:
+        raise RuntimeError("Gemini 客戶端未初始化")
+
+
+readiness_prober = ReadinessProber(
+    checks=[
+        ProbeCheck("chromadb", _probe_chroma, slo_seconds=config.READINESS_CHROMA_SLO_SECONDS, critical=False),
+        ProbeCheck("user_store", _probe_user_store, slo_seconds=config.READINESS_USER_STORE_SLO_SECONDS),
+        ProbeCheck("songs_loaded", _probe_songs),
+        ProbeCheck("gemini", _probe_gemini, critical=False),
+    ],
+    interval=config.READINESS_PROBE_INTERVAL_SECONDS,
+    timeout=config.READINESS_PROBE_TIMEOUT_SECONDS,
+    warmup=warmup,
+)
@@ -0,0 +1,296 @@
+"""
+LLM 閘道 - Gemini 模型級聯與斷路器
+
+包裝 genai 客戶端的串流呼叫：
+- 依模型追蹤滾動的首個 token 延遲（TTFT）與錯誤率
+- 主要模型超出延遲 SLO 時，改為優先使用較快/較便宜的備援模型
+- 連續失敗達門檻時開啟斷路器，在冷卻期間直接快速失敗
+- 僅在送出第一個位元組之前進行對沖（hedged）重試
+"""
+import asyncio
+import math
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+import config
+from lib.exceptions import ServiceUnavailableError
+from lib.metrics import LLM_TTFT_SECONDS
+from lib.streaming import UpstreamPump
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailableError(ServiceUnavailableError):
+    """所有模型皆無法在期限內開始回應"""
+    def __init__(self, message: str = "LLM 服務暫時無法使用", retry_after: int = 5):
+        super().__init__(message, retry_after)
+
+
+class ModelHealth:
+    """單一模型的滾動統計與斷路器狀態。"""
+
+    def __init__(self, name: str, window_seconds: float, failure_threshold: int, cooldown_seconds: float):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._ttft: Deque[Tuple[float, float]] = deque(maxlen=256)
+        self._outcomes: Deque[Tuple[float, bool]] = deque(maxlen=256)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        for samples in (self._ttft, self._outcomes):
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+
+    def ttft_p95(self, min_samples: int) -> Optional[float]:
+        """回傳視窗內 TTFT 的 p95（含對沖落敗的下界樣本），樣本不足時回傳 None。"""
+        self._prune(time.monotonic())
+        values = sorted(value for _, value in self._ttft)
+        if len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, math.ceil(0.95 * len(values)) - 1)]
+
+    def error_rate(self) -> float:
+        self._prune(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def cooldown_remaining(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+
+    def allow_request(self) -> bool:
+        state = self.state()
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            return True
+        return False
+
+    def on_attempt(self) -> None:
+        if self.state() == "half_open":
+            self._probe_in_flight = True
+
+    def on_abandoned(self) -> None:
+        """對沖落敗或被取消的嘗試不計入成敗統計，但需釋放半開狀態的探測名額。"""
+        self._probe_in_flight = False
+
+    def record_censored(self, elapsed: float) -> None:
+        """
+        記錄對沖落敗的嘗試：真實 TTFT 至少為 elapsed。
+        只記錄勝出者會讓 p95 只剩較快的樣本而偏低，因此以下界計入。
+        """
+        self._ttft.append((time.monotonic(), elapsed))
+
+    def record_first_byte(self, ttft: float) -> None:
+        now = time.monotonic()
+        self._ttft.append((now, ttft))
+        self._outcomes.append((now, True))
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        if self.opened_at is not None:
+            logger.info(f"模型 {self.name} 已恢復，關閉斷路器")
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self._outcomes.append((time.monotonic(), False))
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            if self.state() != "open":
+                logger.warning(f"模型 {self.name} 連續失敗 {self.consecutive_failures} 次，開啟斷路器")
+            self.opened_at = time.monotonic()
+
+    def snapshot(self, min_samples: int) -> Dict[str, Any]:
+        p95 = self.ttft_p95(min_samples)
+        return {
+            "state": self.state(),
+            "ttft_p95_seconds": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class GatewayStream:
+    """已收到第一個區塊的上游串流，介面與 UpstreamPump 相同。"""
+
+    def __init__(self, model: str, pump: UpstreamPump, first_chunk: Any, health: ModelHealth):
+        self.model = model
+        self._pump = pump
+        self._pending_first: Optional[Any] = first_chunk
+        self._health = health
+
+    @property
+    def usage_metadata(self) -> Any:
+        return self._pump.usage_metadata
+
+    async def next_chunk(self) -> Optional[Any]:
+        if self._pending_first is not None:
+            chunk, self._pending_first = self._pending_first, None
+            return chunk
+        try:
+            return await self._pump.next_chunk()
+        except Exception:
+            # 已送出位元組後不再重試，只記錄失敗並讓錯誤往上傳遞。
+            self._health.record_failure()
+            raise
+
+    def close(self) -> None:
+        self._pump.close()
+
+
+class _Attempt:
+    def __init__(self, model: str, pump: UpstreamPump):
+        self.model = model
+        self.pump = pump
+        self.started_at = time.monotonic()
+        self.task = asyncio.ensure_future(pump.next_chunk())
+
+
+class LLMGateway:
+    """依延遲與健康狀態選擇模型，並在第一個位元組前進行對沖重試。"""
+
+    def __init__(
+        self,
+        models: Sequence[str],
+        ttft_slo: float,
+        first_byte_timeout: float,
+        hedge_delay: float,
+        failure_threshold: int,
+        cooldown_seconds: float,
+        window_seconds: float,
+        min_samples: int,
+    ):
+        self.models = list(dict.fromkeys(models))
+        self.ttft_slo = ttft_slo
+        self.first_byte_timeout = first_byte_timeout
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.health: Dict[str, ModelHealth] = {
+            model: ModelHealth(model, window_seconds, failure_threshold, cooldown_seconds)
+            for model in self.models
+        }
+
+    def route(self) -> List[str]:
+        """回傳依優先順序排列的可用模型；超出 SLO 的模型排在符合 SLO 的模型之後。"""
+        within_slo, over_slo = [], []
+        for model in self.models:
+            health = self.health[model]
+            if not health.allow_request():
+                continue
+            p95 = health.ttft_p95(self.min_samples)
+            if p95 is None or p95 <= self.ttft_slo:
+                within_slo.append(model)
+            else:
+                over_slo.append((p95, model))
+        return within_slo + [model for _, model in sorted(over_slo)]
+
+    def _retry_after(self) -> int:
+        remaining = [h.cooldown_remaining() for h in self.health.values() if h.state() == "open"]
+        return max(1, math.ceil(min(remaining))) if remaining else 5
+
+    async def open_stream(self, client: Any, contents: Any) -> GatewayStream:
+        """開啟串流並等待第一個區塊，失敗時依序改用下一個候選模型。"""
+        candidates = self.route()
+        if not candidates:
+            logger.warning("所有 LLM 模型的斷路器皆已開啟，快速失敗")
+            raise LLMUnavailableError(retry_after=self._retry_after())
+
+        attempts: List[_Attempt] = []
+        deadline = time.monotonic() + self.first_byte_timeout
+
+        def launch() -> bool:
+            if not candidates:
+                return False
+            model = candidates.pop(0)
+            self.health[model].on_attempt()
+            pump = UpstreamPump(
+                lambda: client.models.generate_content_stream(model=model, contents=contents)
+            )
+            attempts.append(_Attempt(model, pump))
+            return True
+
+        launch()
+        winner: Optional[Tuple[_Attempt, Any]] = None
+        try:
+            while winner is None:
+                pending = [a for a in attempts if not a.task.done()]
+                finished = [a for a in attempts if a.task.done()]
+                for attempt in finished:
+                    attempts.remove(attempt)
+                    if attempt.task.exception() is not None:
+                        logger.warning(f"模型 {attempt.model} 在首個區塊前失敗: {attempt.task.exception()}")
+                        self.health[attempt.model].record_failure()
+                    else:
+                        winner = (attempt, attempt.task.result())
+                        break
+                if winner is not None:
+                    break
+                if not pending:
+                    if not launch():
+                        raise LLMUnavailableError(retry_after=self._retry_after())
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    for attempt in pending:
+                        self.health[attempt.model].record_failure()
+                    logger.warning(f"LLM 首個區塊逾時 ({self.first_byte_timeout}s)")
+                    raise LLMUnavailableError(retry_after=self._retry_after())
+                timeout = remaining
+                can_hedge = self.hedge_delay > 0 and bool(candidates)
+                if can_hedge:
+                    timeout = min(timeout, self.hedge_delay)
+                done, _ = await asyncio.wait(
+                    [a.task for a in pending], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done and can_hedge:
+                    logger.info(f"模型 {pending[-1].model} 超過 {self.hedge_delay}s 未回應，啟動對沖請求")
+                    launch()
+        finally:
+            for attempt in attempts:
+                if winner is None or attempt is not winner[0]:
+                    attempt.task.cancel()
+                    attempt.pump.close()
+                    self.health[attempt.model].on_abandoned()
+                    if winner is not None:
+                        self.health[attempt.model].record_censored(time.monotonic() - attempt.started_at)
+
+        attempt, first_chunk = winner
+        ttft = time.monotonic() - attempt.started_at
+        self.health[attempt.model].record_first_byte(ttft)
+        LLM_TTFT_SECONDS.labels(attempt.model).observe(ttft)
+        logger.info(f"LLM 串流開始 (model: {attempt.model}, ttft: {ttft:.2f}s)")
+        if first_chunk is None:
+            # 上游沒有任何輸出，仍以空串流回傳。
+            attempt.pump.close()
+        return GatewayStream(attempt.model, attempt.pump, first_chunk, self.health[attempt.model])
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {model: health.snapshot(self.min_samples) for model, health in self.health.items()}
+
+
+llm_gateway = LLMGateway(
+    models=[config.GEMINI_MODEL, *config.GEMINI_FALLBACK_MODELS],
+    ttft_slo=config.LLM_TTFT_SLO_SECONDS,
+    first_byte_timeout=config.LLM_FIRST_BYTE_TIMEOUT_SECONDS,
+    hedge_delay=config.LLM_HEDGE_DELAY_SECONDS,
+    failure_threshold=config.LLM_CIRCUIT_FAILURE_THRESHOLD,
+    cooldown_seconds=config.LLM_CIRCUIT_COOLDOWN_SECONDS,
+    window_seconds=config.LLM_STATS_WINDOW_SECONDS,
+    min_samples=config.LLM_STATS_MIN_SAMPLES,
+)
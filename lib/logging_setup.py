@@ -0,0 +1,240 @@
+"""
+日誌初始化
+
+根 logger 只掛一個非阻塞的 QueueHandler；實際的檔案與主控台輸出由背景執行緒的
+QueueListener 處理，事件迴圈上的 logger.info 不會等待磁碟 I/O。
+
+- 檔案依大小（預設）或時間輪替
+- 佇列有上限，塞滿時丟棄紀錄並累計丟棄數，不會阻塞呼叫端
+- 請求上下文（request id 等）在呼叫端的執行緒中由 QueueHandler 的 filter 加入
+- pre-fork 時 worker 不自行寫檔：紀錄經由 LogChannel 送往主程序，只有主程序持有檔案處理器，
+  輪替不會在多個程序之間互相覆蓋
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import pickle
+import queue
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+import config
+from lib.metrics import LOG_RECORDS_DROPPED_TOTAL
+from lib.tracing import JsonFormatter, RequestContextFilter
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """佇列已滿時丟棄紀錄並計數，而不是阻塞。"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            LOG_RECORDS_DROPPED_TOTAL.inc()
+
+
+class LogChannel:
+    """pre-fork 的日誌通道：worker 以 datagram 將紀錄送往主程序（同一主機、fork 前建立）。"""
+
+    # 單筆紀錄的上限；超過時截斷訊息。
+    MAX_DATAGRAM_BYTES = 60 * 1024
+    # 主程序暫停接收（fork 期間）且緩衝區已滿時，worker 最多等待的秒數，逾時則丟棄。
+    SEND_TIMEOUT_SECONDS = 1.0
+
+    def __init__(self):
+        self.receiver, self.sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.settimeout(self.SEND_TIMEOUT_SECONDS)
+
+    def close(self) -> None:
+        self.receiver.close()
+        self.sender.close()
+
+
+class LogForwardingHandler(logging.Handler):
+    """worker 的輸出端：將紀錄送往主程序；送不出去時丟棄並計數。"""
+
+    def __init__(self, channel: LogChannel):
+        super().__init__()
+        self.channel = channel
+        self.pid = os.getpid()
+        self.dropped = 0
+
+    def _encode(self, record: logging.LogRecord) -> bytes:
+        # QueueHandler 已將 args 與例外合併進 msg；extra 欄位轉為可序列化的值。
+        fields: Dict[str, Any] = {
+            key: value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+            for key, value in vars(record).items()
+        }
+        fields["worker_pid"] = self.pid
+        data = pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > LogChannel.MAX_DATAGRAM_BYTES:
+            fields["msg"] = str(fields["msg"])[: LogChannel.MAX_DATAGRAM_BYTES // 8] + "…（已截斷）"
+            data = pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL)
+        return data
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.channel.sender.send(self._encode(record))
+        except OSError:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED_TOTAL.inc()
+
+
+class _LogReceiver(threading.Thread):
+    """主程序接收 worker 紀錄的執行緒，與主程序自己的紀錄寫入同一組處理器；收到空 datagram 時結束。"""
+
+    def __init__(self, channel: LogChannel, handlers: List[logging.Handler]):
+        super().__init__(name="log-receiver", daemon=True)
+        self.channel = channel
+        self.handlers = handlers
+        self.pid = os.getpid()
+
+    def run(self) -> None:
+        while True:
+            try:
+                data = self.channel.receiver.recv(LogChannel.MAX_DATAGRAM_BYTES)
+            except OSError:
+                return
+            if not data:
+                return
+            try:
+                record = logging.makeLogRecord(pickle.loads(data))
+            except Exception:
+                continue
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self) -> None:
+        if os.getpid() != self.pid:
+            # fork 出的 worker 繼承了這個物件，但執行緒只存在於主程序。
+            return
+        # 緩衝區已滿時送出會逾時；接收執行緒仍在讀取，重試幾次即可送出。
+        for _ in range(5):
+            try:
+                self.channel.sender.send(b"")
+                break
+            except OSError:
+                continue
+        self.join(timeout=5)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_receiver: Optional[_LogReceiver] = None
+_channel: Optional[LogChannel] = None
+_channel_role: Optional[str] = None
+_lock = threading.Lock()
+
+
+def attach_log_channel(channel: Optional[LogChannel], role: Optional[str] = None) -> None:
+    """
+    設定之後的 setup_logging() 在 pre-fork 下的角色（None 表示一般的單一程序）。
+
+    - "master"：寫入檔案與主控台，並接收 worker 送來的紀錄
+    - "worker"：不寫檔，所有紀錄送往主程序；同時關閉本程序中的接收端
+    """
+    global _channel, _channel_role
+
+    if role == "worker" and channel is not None:
+        channel.receiver.close()
+    _channel, _channel_role = channel, role
+
+
+def _build_file_handler(path: str) -> logging.Handler:
+    if config.LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+
+def setup_logging(
+    log_dir: Optional[str] = None,
+    level: Optional[str] = None,
+    json_format: Optional[bool] = None,
+    queue_size: Optional[int] = None,
+) -> DroppingQueueHandler:
+    """設定根 logger；重複呼叫時會先關閉先前的設定。"""
+    global _listener, _queue_handler, _receiver
+
+    log_dir = log_dir or config.LOG_DIR
+    level_name = (level or config.LOG_LEVEL).upper()
+    if json_format is None:
+        json_format = config.LOG_FORMAT == "json"
+
+    with _lock:
+        _shutdown_locked()
+        os.makedirs(log_dir, exist_ok=True)
+
+        if _channel is not None and _channel_role == "worker":
+            handlers: List[logging.Handler] = [LogForwardingHandler(_channel)]
+        else:
+            formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+            handlers = [
+                _build_file_handler(os.path.join(log_dir, "taiko_advisor.log")),
+                logging.StreamHandler(),
+            ]
+            for handler in handlers:
+                handler.setFormatter(formatter)
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size or config.LOG_QUEUE_SIZE)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RequestContextFilter())
+
+        root = logging.getLogger()
+        root.setLevel(getattr(logging, level_name, logging.INFO))
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _queue_handler = queue_handler
+        if _channel is not None and _channel_role == "master":
+            _receiver = _LogReceiver(_channel, handlers)
+            _receiver.start()
+    return queue_handler
+
+
+def _shutdown_locked() -> None:
+    global _listener, _queue_handler, _receiver
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+    if _receiver is not None:
+        # 尚未讀取的 worker 紀錄留在 socket 緩衝區，由下一次 setup_logging() 的接收執行緒處理。
+        _receiver.stop()
+        _receiver = None
+    if _listener is not None:
+        # stop() 會先處理完佇列中剩餘的紀錄。
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
+    _queue_handler = None
+
+
+def shutdown_logging() -> None:
+    """停止背景寫入執行緒並關閉檔案。"""
+    with _lock:
+        _shutdown_locked()
+
+
+def logging_stats() -> Dict[str, int]:
+    handler = _queue_handler
+    if handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+
+
+atexit.register(shutdown_logging)
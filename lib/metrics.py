@@ -0,0 +1,102 @@
+"""
+Prometheus 指標
+
+聊天請求各階段的延遲直方圖與計數器，透過 /metrics 以 Prometheus 文字格式輸出。
+
+多 worker（uvicorn --workers）部署時設定環境變數 PROMETHEUS_MULTIPROC_DIR
+指向一個每次啟動前清空的目錄，各 worker 會將數值寫入該目錄，
+/metrics 再由 MultiProcessCollector 彙總所有 worker 的數值。
+"""
+import os
+from typing import Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(float(2 ** n) for n in range(8, 19))
+
+AUTH_VALIDATE_SECONDS = Histogram(
+    "taiko_auth_validate_seconds", "validate_token 耗時", buckets=FAST_BUCKETS, registry=REGISTRY
+)
+USER_STORE_SECONDS = Histogram(
+    "taiko_user_store_seconds",
+    "用戶資料讀寫耗時（不含等待檔案鎖）",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+    registry=REGISTRY,
+)
+USER_STORE_LOCK_WAIT_SECONDS = Histogram(
+    "taiko_user_store_lock_wait_seconds",
+    "用戶資料檔案鎖等待時間",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+    registry=REGISTRY,
+)
+CHROMA_QUERY_SECONDS = Histogram(
+    "taiko_chroma_query_seconds", "ChromaDB 檢索耗時", buckets=FAST_BUCKETS, registry=REGISTRY
+)
+PROMPT_BUILD_SECONDS = Histogram(
+    "taiko_prompt_build_seconds", "聊天 prompt 構建耗時", buckets=FAST_BUCKETS, registry=REGISTRY
+)
+PROMPT_SIZE_BYTES = Histogram(
+    "taiko_prompt_size_bytes", "聊天 prompt 大小（UTF-8 位元組）", buckets=SIZE_BUCKETS, registry=REGISTRY
+)
+PROMPT_SIZE_TOKENS = Histogram(
+    "taiko_prompt_size_tokens", "聊天 prompt 估計 token 數", buckets=SIZE_BUCKETS, registry=REGISTRY
+)
+LLM_TTFT_SECONDS = Histogram(
+    "taiko_llm_ttft_seconds", "Gemini 首個 token 延遲", ["model"], buckets=SLOW_BUCKETS, registry=REGISTRY
+)
+STREAM_DURATION_SECONDS = Histogram(
+    "taiko_stream_duration_seconds",
+    "聊天串流總耗時",
+    ["outcome"],
+    buckets=SLOW_BUCKETS,
+    registry=REGISTRY,
+)
+STREAM_CHUNKS = Histogram(
+    "taiko_stream_chunks",
+    "每次回覆的串流區塊數",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+    registry=REGISTRY,
+)
+WARMUP_STEP_SECONDS = Histogram(
+    "taiko_warmup_step_seconds", "啟動預熱各步驟耗時", ["step"], buckets=SLOW_BUCKETS, registry=REGISTRY
+)
+
+CANDIDATE_FALLBACK_TOTAL = Counter(
+    "taiko_candidate_fallback_total", "改用隨機抽樣候選歌曲的次數", registry=REGISTRY
+)
+RATE_LIMIT_REJECTIONS_TOTAL = Counter(
+    "taiko_rate_limit_rejections_total", "速率限制拒絕次數", ["path"], registry=REGISTRY
+)
+STREAMS_CANCELLED_TOTAL = Counter(
+    "taiko_streams_cancelled_total", "中途取消的聊天串流數", registry=REGISTRY
+)
+LOG_RECORDS_DROPPED_TOTAL = Counter(
+    "taiko_log_records_dropped_total", "日誌佇列已滿而丟棄的紀錄數", registry=REGISTRY
+)
+EMBEDDING_CACHE_LOOKUPS_TOTAL = Counter(
+    "taiko_embedding_cache_lookups_total", "嵌入向量快取查詢次數", ["result"], registry=REGISTRY
+)
+RESOURCE_RELOADS_TOTAL = Counter(
+    "taiko_resource_reloads_total", "歌曲資料與向量集合重新載入次數", ["outcome"], registry=REGISTRY
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """輸出 Prometheus 文字格式；多程序模式下彙總所有 worker 的數值。"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
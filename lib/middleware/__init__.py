@@ -0,0 +1,19 @@
+"""
+ASGI 中間件模塊
+
+皆以原生 ASGI 介面實作，避免 BaseHTTPMiddleware 為每個請求建立額外的任務
+與串流包裝（對聊天端點的 StreamingResponse 影響最大）。
+"""
+from .compression import CompressionMiddleware
+from .rate_limit import RateLimitMiddleware
+from .request_size import LimitRequestSizeMiddleware
+from .security_headers import SecurityHeadersMiddleware
+from .tracing import TracingMiddleware
+
+__all__ = [
+    "CompressionMiddleware",
+    "LimitRequestSizeMiddleware",
+    "RateLimitMiddleware",
+    "SecurityHeadersMiddleware",
+    "TracingMiddleware",
+]
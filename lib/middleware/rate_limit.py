@@ -0,0 +1,52 @@
+"""
+速率限制中間件
+
+取代 slowapi 的 SlowAPIASGIMiddleware：在執行緒池中檢查限制，
+儲存後端（SQLite 寫入交易、Redis 往返）的等待不會阻塞事件迴圈。
+@limiter.limit 裝飾的路由也在這裡一併檢查，裝飾器本身不再於事件迴圈上存取儲存後端。
+"""
+import inspect
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+from lib.rate_limiter import check_request_limits
+
+
+def _find_route_handler(routes, scope: Scope):
+    handler = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL and hasattr(route, "endpoint"):
+            handler = route.endpoint
+    return handler
+
+
+class RateLimitMiddleware:
+    """在執行緒池中檢查速率限制，超過時以應用程式的 RateLimitExceeded 處理器回應"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        app = scope["app"]
+        handler = _find_route_handler(app.routes, scope)
+        if handler is not None:
+            request = Request(scope, receive=receive, send=send)
+            try:
+                await run_in_threadpool(check_request_limits, request, handler)
+            except RateLimitExceeded as exc:
+                exception_handler = app.exception_handlers.get(RateLimitExceeded, _rate_limit_exceeded_handler)
+                response = exception_handler(request, exc)
+                if inspect.isawaitable(response):
+                    response = await response
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,95 @@
+"""
+請求體積限制中間件
+
+除了檢查 Content-Length 標頭，也會累計實際收到的 http.request 區塊，
+因此 chunked 傳輸（沒有 Content-Length）的請求同樣受到限制。
+"""
+import logging
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Content-Length 標頭的合理值上限（0~10MB），超出視為無效標頭。
+CONTENT_LENGTH_CEILING = 10 * 1024 * 1024
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+
+class RequestTooLarge(Exception):
+    """串流讀取的請求本文超過上限"""
+
+
+class LimitRequestSizeMiddleware:
+    """限制請求體積大小"""
+
+    def __init__(self, app: ASGIApp, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    def _too_large_response(self) -> JSONResponse:
+        return JSONResponse(status_code=413, content={"error": "請求體積過大，上限為 1MB"})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        if scope["method"] in BODY_METHODS:
+            content_length = None
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    content_length = value.decode("latin-1")
+                    break
+            if content_length:
+                try:
+                    content_length_value = int(content_length)
+                except (ValueError, OverflowError):
+                    logger.warning(f"無效的 Content-Length 標頭: {content_length!r} (path: {path})")
+                    response = JSONResponse(status_code=400, content={"error": "無效的 Content-Length 標頭"})
+                    await response(scope, receive, send)
+                    return
+                # 先做標頭合理值檢查（0~10MB），再套用實際業務上限。
+                if not (0 <= content_length_value <= CONTENT_LENGTH_CEILING):
+                    logger.warning(f"Content-Length 超出合理範圍: {content_length_value} (path: {path})")
+                    response = JSONResponse(
+                        status_code=400, content={"error": "Content-Length 必須在 0 到 10MB 之間"}
+                    )
+                    await response(scope, receive, send)
+                    return
+                if content_length_value > self.max_size:
+                    logger.warning(f"請求體積過大: {content_length_value} bytes (path: {path})")
+                    await self._too_large_response()(scope, receive, send)
+                    return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def receive_limited() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    exceeded = True
+                    raise RequestTooLarge()
+            return message
+
+        async def send_unless_exceeded(message: Message) -> None:
+            nonlocal response_started
+            # 超過上限後丟棄應用程式自行產生的錯誤回應，改由本中間件回傳 413。
+            if exceeded and not response_started:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_unless_exceeded)
+        except RequestTooLarge:
+            pass
+        if exceeded:
+            logger.warning(f"請求體積過大: 已接收超過 {self.max_size} bytes (path: {path})")
+            if not response_started:
+                await self._too_large_response()(scope, receive, send)
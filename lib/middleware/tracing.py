@@ -0,0 +1,77 @@
+"""
+請求追蹤中間件
+
+為每個請求建立追蹤上下文，回應時加上 X-Request-Id 與 Server-Timing 標頭，
+串流回應結束後再輸出一筆包含各階段耗時的結束日誌。
+"""
+import asyncio
+import logging
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import lib.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+
+class TracingMiddleware:
+    """建立 RequestTrace 並透過 contextvars 傳遞給後續所有階段。"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        trace = tracing.RequestTrace(
+            scope["method"], scope["path"], headers.get("x-request-id"), headers.get("traceparent")
+        )
+        token = tracing.start_trace(trace)
+        status_code: Optional[int] = None
+        streamed = False
+        chunks = 0
+
+        async def send_traced(message: Message) -> None:
+            nonlocal status_code, streamed, chunks
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                route = scope.get("route")
+                trace.route = getattr(route, "path", None)
+                response_headers = MutableHeaders(scope=message)
+                response_headers["X-Request-Id"] = trace.request_id
+                # 串流回應在此時只包含開始串流前的階段。
+                response_headers["Server-Timing"] = trace.server_timing()
+            elif message["type"] == "http.response.body":
+                if message.get("more_body", False):
+                    streamed = True
+                if message.get("body"):
+                    chunks += 1
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            trace.root.end()
+            stages = {span.name: round(span.duration_ms, 1) for span in trace.stage_timings()}
+            level = logging.INFO if streamed or (status_code or 500) >= 500 else logging.DEBUG
+            logger.log(
+                level,
+                "請求完成",
+                extra={
+                    "method": trace.method,
+                    "status": status_code,
+                    "duration_ms": round(trace.root.duration_ms, 1),
+                    "stages": stages,
+                    "streamed": streamed,
+                    "chunks": chunks,
+                },
+            )
+            if tracing.span_exporter is not None:
+                try:
+                    await asyncio.to_thread(tracing.span_exporter.export, trace, status_code)
+                except Exception as e:
+                    logger.warning(f"寫入追蹤資料失敗: {e}")
+            tracing.end_trace(token)
@@ -0,0 +1,305 @@
+"""
+Pre-fork 多 worker 伺服器
+
+主程序先匯入應用程式並載入唯讀資料（歌曲、ID 索引、查詢編碼模型），以 gc.freeze() 將這些物件
+移出垃圾回收的追蹤範圍後再 fork 出 worker，worker 之間以 copy-on-write 共用這些記憶體分頁。
+
+- 監聽 socket 由主程序建立，worker 共用同一個 socket
+- worker 處理 max_requests（加上隨機抖動）個請求後優雅結束，主程序補上新的 worker
+- SIGHUP 或共用資料的來源檔案變更：主程序重新載入共用資料並逐批替換 worker（舊 worker 處理完
+  進行中的請求才結束）。重新載入只在主程序進行，新 worker 仍共用同一份資料；載入失敗時保留目前的 worker
+- SIGTERM / SIGINT：優雅關閉所有 worker
+- worker 的日誌經由 LogChannel 送往主程序，由主程序的單一檔案處理器寫入與輪替
+"""
+import errno
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+from lib.logging_setup import LogChannel, attach_log_channel, setup_logging, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+# worker 在啟動後這麼短的時間內異常結束時，延後重新啟動以免不斷 fork。
+CRASH_BACKOFF_SECONDS = 1.0
+
+
+class PreforkServer:
+    """在主程序預載資料後 fork 出多個 uvicorn worker。"""
+
+    def __init__(
+        self,
+        load_app: Callable[[], Any],
+        preload: Callable[[], None],
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        workers: int = 2,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: float = 30.0,
+        reload: Optional[Callable[[], None]] = None,
+        sources: Optional[Callable[[], Any]] = None,
+        watch_interval: float = 0.0,
+    ):
+        """
+        reload 在 SIGHUP 或來源檔案變更時取代 preload 重新載入共用資料，失敗時應拋出例外；
+        sources 回傳共用資料來源檔案的狀態，每 watch_interval 秒比對一次（0 表示不監看）。
+        """
+        self.load_app = load_app
+        self.preload = preload
+        self.reload = reload or preload
+        self.sources = sources
+        self.watch_interval = watch_interval
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.app: Any = None
+        self.sock: Optional[socket.socket] = None
+        # pid -> (世代, 啟動時間)；SIGHUP 後世代加一，舊世代的 worker 結束時不再補上。
+        self._children: Dict[int, tuple] = {}
+        self._generation = 0
+        self._signals: List[int] = []
+        # 主程序要求結束的 worker；新版 uvicorn 在優雅關閉後會以原訊號結束程序。
+        self._retiring: Set[int] = set()
+        self._wakeup_r = self._wakeup_w = -1
+        self._log_channel: Optional[LogChannel] = None
+        # 共用資料的來源狀態：目前 worker 使用的版本、待確認的變更（寫入可能尚未完成）與載入失敗的版本。
+        self._loaded_sources: Any = None
+        self._pending_sources: Any = None
+        self._failed_sources: Any = None
+        self._next_watch = 0.0
+
+    # ---- 主程序 ----
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self.port = sock.getsockname()[1]
+        return sock
+
+    def _current_sources(self) -> Any:
+        return self.sources() if self.sources is not None else None
+
+    def _prepare_shared_state(self, load: Callable[[], None]) -> None:
+        # 先記錄來源狀態：載入期間若檔案再次變更，下一次檢查會再重新載入。
+        sources = self._current_sources()
+        load()
+        self._loaded_sources = sources
+        # 將目前所有物件移到永久世代：worker 的 GC 不會再寫入這些物件的標頭，分頁得以保持共用。
+        gc.collect()
+        gc.freeze()
+
+    def run(self) -> int:
+        self._log_channel = LogChannel()
+        attach_log_channel(self._log_channel, "master")
+        setup_logging()
+        self.app = self.load_app()
+        self._prepare_shared_state(self.preload)
+        self.sock = self.bind()
+        logger.info(f"主程序 {os.getpid()} 監聽 {self.host}:{self.port}，啟動 {self.workers} 個 worker")
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        try:
+            self._spawn_missing()
+            while True:
+                self._wait_for_signal(1.0)
+                signals, self._signals = self._signals, []
+                if signal.SIGTERM in signals or signal.SIGINT in signals:
+                    break
+                self._reap()
+                if signal.SIGHUP in signals:
+                    self._reload("SIGHUP")
+                else:
+                    self._check_sources()
+                self._spawn_missing()
+        finally:
+            self._stop_all()
+            self.sock.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            logger.info("主程序已結束")
+            shutdown_logging()
+            attach_log_channel(None)
+            self._log_channel.close()
+        return 0
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self._signals.append(signum)
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except OSError:
+            pass
+
+    def _wait_for_signal(self, timeout: float) -> None:
+        try:
+            ready, _, _ = select.select([self._wakeup_r], [], [], timeout)
+        except InterruptedError:
+            return
+        if ready:
+            try:
+                while os.read(self._wakeup_r, 64):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _spawn_missing(self) -> None:
+        current = [pid for pid, (gen, _) in self._children.items() if gen == self._generation]
+        for _ in range(self.workers - len(current)):
+            self._spawn()
+
+    def _spawn(self) -> int:
+        # 背景日誌執行緒可能在 fork 當下持有佇列的鎖，因此 fork 前先停止、fork 後再重新啟動。
+        shutdown_logging()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._run_worker()
+            except BaseException:
+                logging.getLogger(__name__).exception("worker 異常結束")
+            finally:
+                os._exit(code)
+        setup_logging()
+        self._children[pid] = (self._generation, time.monotonic())
+        logger.info(f"啟動 worker {pid}（第 {self._generation} 代）")
+        return pid
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation, started = self._children.pop(pid, (None, time.monotonic()))
+            exit_code = os.waitstatus_to_exitcode(status)
+            _mark_metrics_dead(pid)
+            if exit_code == 0 or pid in self._retiring:
+                self._retiring.discard(pid)
+                logger.info(f"worker {pid} 已結束")
+            else:
+                logger.warning(f"worker {pid} 異常結束 (exit code: {exit_code})")
+                if generation == self._generation and time.monotonic() - started < CRASH_BACKOFF_SECONDS:
+                    time.sleep(CRASH_BACKOFF_SECONDS)
+
+    def _check_sources(self) -> None:
+        """來源檔案已變更，且與上次檢查相同（寫入已完成）時重新載入。"""
+        if self.sources is None or self.watch_interval <= 0:
+            return
+        now = time.monotonic()
+        if now < self._next_watch:
+            return
+        self._next_watch = now + self.watch_interval
+        current = self._current_sources()
+        if current == self._loaded_sources or current == self._failed_sources:
+            self._pending_sources = None
+            return
+        if current != self._pending_sources:
+            self._pending_sources = current
+            return
+        self._pending_sources = None
+        self._reload("檔案變更")
+
+    def _reload(self, reason: str) -> None:
+        logger.info(f"重新載入共用資料並替換 worker ({reason})")
+        gc.unfreeze()
+        failed_sources = self._current_sources()
+        try:
+            self._prepare_shared_state(self.reload)
+        except Exception as e:
+            # 同一版本的檔案不再重試，等下一次變更；目前的 worker 繼續服務。
+            self._failed_sources = failed_sources
+            gc.freeze()
+            logger.error(f"❌ 重新載入共用資料失敗，保留目前的 worker: {e}")
+            return
+        self._failed_sources = None
+        old = list(self._children)
+        self._generation += 1
+        self._spawn_missing()
+        for pid in old:
+            self._retire(pid)
+
+    def _stop_all(self) -> None:
+        for pid in list(self._children):
+            self._retire(pid)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self._children):
+            logger.warning(f"worker {pid} 未在期限內結束，強制終止")
+            _signal_child(pid, signal.SIGKILL)
+        while self._children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self._children.pop(pid, None)
+            _mark_metrics_dead(pid)
+
+    def _retire(self, pid: int) -> None:
+        self._retiring.add(pid)
+        _signal_child(pid, signal.SIGTERM)
+
+    # ---- worker ----
+
+    def _worker_max_requests(self) -> Optional[int]:
+        if self.max_requests <= 0:
+            return None
+        # 加上抖動，避免所有 worker 在同一時間重新啟動。
+        return self.max_requests + random.randint(0, max(0, self.max_requests_jitter))
+
+    def _run_worker(self) -> int:
+        import uvicorn
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        # 紀錄送往主程序；之後 lifespan 中的 setup_logging() 也沿用此設定。
+        attach_log_channel(self._log_channel, "worker")
+        setup_logging()
+
+        server = uvicorn.Server(
+            uvicorn.Config(
+                self.app,
+                limit_max_requests=self._worker_max_requests(),
+                timeout_graceful_shutdown=self.graceful_timeout,
+                proxy_headers=True,
+            )
+        )
+        server.run(sockets=[self.sock])
+        return 0 if server.started else 3
+
+
+def _signal_child(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _mark_metrics_dead(pid: int) -> None:
+    """多程序 Prometheus 模式下，清除已結束 worker 的即時量測檔。"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,166 @@
+"""
+速率限制的 SQLite 儲存後端
+
+slowapi 預設的 memory:// 只在單一程序內計數，uvicorn --workers N 時實際額度會變成 N 倍。
+此後端以同一台主機上的 SQLite 檔案（WAL 模式）在多個 worker 之間共用計數，
+支援 sliding-window-counter 與 fixed-window 策略。
+
+URI 格式：sqlite://<檔案路徑>，例如 sqlite:///var/lib/taiko/rate_limits.db
+（"sqlite://" 之後的部分即為檔案路徑）。定義此類別時會自動註冊到 limits 的 storage registry。
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from math import floor
+from typing import Iterator, Optional, Tuple
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+# 每個程序最多每隔多久清除一次過期的計數列。
+PURGE_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+# 已過期的列視為不存在：重新從 amount 開始計數並設定新的到期時間。
+_INCR_SQL = """
+INSERT INTO rate_limits (key, value, expires_at) VALUES (?1, ?2, ?3 + ?4)
+ON CONFLICT (key) DO UPDATE SET
+    value = CASE WHEN expires_at <= ?3 THEN excluded.value ELSE value + excluded.value END,
+    expires_at = CASE WHEN expires_at <= ?3 THEN excluded.expires_at ELSE expires_at END
+RETURNING value
+"""
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """以 SQLite 檔案在同主機的多個程序之間共用速率限制計數。"""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, timeout: float = 5.0, **options):
+        self.path = uri.split("://", 1)[1]
+        if not self.path:
+            raise ValueError("sqlite:// 需要指定檔案路徑")
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_purge = 0.0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        # 連線不可跨 fork 共用，因此以 (pid, thread) 為單位建立。
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _purge_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL_SECONDS
+            conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+
+    @staticmethod
+    def _get(conn: sqlite3.Connection, key: str, now: float) -> int:
+        row = conn.execute(
+            "SELECT value FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            value = conn.execute(_INCR_SQL, (key, amount, now, expiry)).fetchone()[0]
+            self._purge_expired(conn, now)
+        return value
+
+    def decr(self, key: str, amount: int = 1) -> int:
+        row = self._connection().execute(
+            "UPDATE rate_limits SET value = max(value - ?, 0) WHERE key = ? AND expires_at > ? RETURNING value",
+            (amount, key, time.time()),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key: str) -> int:
+        return self._get(self._connection(), key, time.time())
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def _window_info(
+        self, conn: sqlite3.Connection, key: str, expiry: int, now: float
+    ) -> Tuple[int, float, int, float]:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._get(conn, previous_key, now)
+        current_count = self._get(conn, current_key, now)
+        previous_ttl = 0.0 if previous_count == 0 else (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        # 讀取與遞增在同一個寫入交易內，其他 worker 無法在中間插入。
+        with self._transaction() as conn:
+            previous_count, previous_ttl, current_count, _ = self._window_info(conn, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            _, current_key = self.sliding_window_keys(key, expiry, now)
+            conn.execute(_INCR_SQL, (current_key, amount, now, 2 * expiry)).fetchone()
+            self._purge_expired(conn, now)
+        return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        return self._window_info(self._connection(), key, expiry, time.time())
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
@@ -1,11 +1,55 @@
 """
 速率限制配置
+
+- 計數儲存於 config.RATE_LIMIT_STORAGE_URI（預設為同主機 worker 共用的 SQLite 檔案）
+- 帶有 Bearer 存取代碼的請求以代碼的雜湊值計數，同一 NAT 後的用戶不再共用額度；
+  鍵只由請求本身決定，不依賴各 worker 的狀態，因此每個 worker 算出的鍵都相同
+- 另外以遠端 IP 計算總量上限（config.RATE_LIMIT_PER_IP），輪換偽造的代碼無法繞過限制
+- 檢查在執行緒池中進行（見 lib.middleware.rate_limit），SQLite 交易不佔用事件迴圈
 """
+import hashlib
+from typing import Callable, Optional
 from slowapi import Limiter
 from slowapi.util import get_remote_address
+from slowapi.wrappers import LimitGroup
+from starlette.requests import Request
+import config
+import lib.rate_limit_storage  # noqa: F401  註冊 sqlite:// 儲存後端
+
+
+def rate_limit_key(request: Request) -> str:
+    """速率限制的鍵：有 Bearer 存取代碼時使用其雜湊值，否則使用遠端 IP。"""
+    parts = request.headers.get("authorization", "").split()
+    if len(parts) == 2 and parts[0].lower() == "bearer":
+        return "user:" + hashlib.sha256(parts[1].encode("utf-8")).hexdigest()
+    return f"ip:{get_remote_address(request)}"
 
 
 limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["30/minute"],
+    key_func=rate_limit_key,
+    default_limits=[config.RATE_LIMIT_DEFAULT],
+    storage_uri=config.RATE_LIMIT_STORAGE_URI,
+    strategy=config.RATE_LIMIT_STRATEGY,
 )
+# slowapi 的 application_limits 只能使用 key_func，IP 總量上限因此直接建立 LimitGroup。
+limiter._application_limits = [
+    LimitGroup(config.RATE_LIMIT_PER_IP, get_remote_address, "per-ip", False, None, None, None, 1, False)
+]
+
+
+def route_name(handler: Callable) -> str:
+    return f"{handler.__module__}.{handler.__name__}"
+
+
+def check_request_limits(request: Request, handler: Optional[Callable]) -> None:
+    """
+    檢查 IP 總量上限、預設限制與路由的 @limiter.limit 限制，超過時拋出 RateLimitExceeded。
+
+    會存取儲存後端，應在執行緒池中呼叫；完成後標記請求，路由裝飾器不再重複檢查。
+    """
+    if handler is None or not limiter.enabled or route_name(handler) in limiter._exempt_routes:
+        return
+    limiter._check_request_limit(request, handler, True)
+    if route_name(handler) in limiter._route_limits or route_name(handler) in limiter._dynamic_route_limits:
+        limiter._check_request_limit(request, handler, False)
+    request.state._rate_limiting_complete = True
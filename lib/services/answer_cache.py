@@ -0,0 +1,244 @@
+"""
+答案快取模塊
+
+無對話歷史的推薦問題在不同玩家之間高度重複，每次都完整呼叫 Gemini 相當浪費。
+此模塊以「正規化訊息 + 玩家設定指紋 + 候選歌曲 ID 集合」作為鍵值快取完整回覆，
+並可選擇以嵌入向量相似度比對近似問題。
+
+鍵帶有建立時的資源快照版本（ResourceSnapshot.version）；出現較新的版本時清空快取，
+較舊快照上的請求不寫入。近似比對只在同一 context 最近的 SIMILARITY_CANDIDATES_PER_CONTEXT 筆中進行，
+且在鎖外計算相似度。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+import config
+from lib.songs import Song
+
+logger = logging.getLogger(__name__)
+
+EmbedFunction = Callable[[List[str]], Optional[Sequence[Sequence[float]]]]
+
+# 每個 context（玩家設定 + 候選歌曲）參與近似比對的最近項目數。
+SIMILARITY_CANDIDATES_PER_CONTEXT = 32
+
+
+@dataclass(frozen=True)
+class AnswerCacheKey:
+    """快取鍵：context 為玩家設定與候選歌曲指紋，text 為正規化後的訊息，data_version 為資源快照版本。"""
+    context: str
+    text: str
+    data_version: int = 0
+    # 已正規化為單位長度的嵌入向量。
+    embedding: Optional[tuple] = field(default=None, compare=False, hash=False)
+
+
+@dataclass
+class _CacheEntry:
+    answer: str
+    created_at: float
+    upstream_seconds: float
+
+
+def normalize_message(message: str) -> str:
+    """正規化訊息：全半形統一、轉小寫、壓縮空白並去除結尾標點。"""
+    text = unicodedata.normalize("NFKC", message).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.。？！～~ ")
+
+
+def build_cache_key(
+    message: str,
+    profile: Optional[Dict[str, Any]],
+    candidate_songs: List[Song],
+    data_version: int = 0,
+) -> AnswerCacheKey:
+    """根據訊息、玩家設定、候選歌曲與資源快照版本建立快取鍵。"""
+    candidate_ids = sorted(song.key or "" for song in candidate_songs)
+    fingerprint_source = json.dumps(
+        {"profile": profile or {}, "candidates": candidate_ids},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    context = hashlib.sha256(fingerprint_source.encode("utf-8")).hexdigest()
+    return AnswerCacheKey(context=context, text=normalize_message(message), data_version=data_version)
+
+
+def _unit_vector(values: Sequence[float]) -> Optional[tuple]:
+    vector = tuple(float(x) for x in values)
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return None
+    return tuple(x / norm for x in vector)
+
+
+class AnswerCache:
+    """具 TTL 與容量上限（LRU 淘汰）的答案快取。"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity_threshold: float = 0.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[AnswerCacheKey, _CacheEntry]" = OrderedDict()
+        # context -> 該 context 最近寫入且帶有嵌入向量的鍵（最後面為最新）。
+        self._similar_index: Dict[str, "OrderedDict[AnswerCacheKey, None]"] = {}
+        self._lock = threading.Lock()
+        self._data_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_upstream_seconds = 0.0
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return self.similarity_threshold > 0
+
+    def with_embedding(self, key: AnswerCacheKey, embed_fn: Optional[EmbedFunction]) -> AnswerCacheKey:
+        """
+        若啟用相似度比對，為鍵值附加訊息的嵌入向量。
+
+        embed_fn 通常為 query_encoder.encode（執行推論），應在執行緒池中呼叫；回傳 None 時改用精確比對。
+        """
+        if not self.similarity_enabled or embed_fn is None or not key.text:
+            return key
+        try:
+            vectors = embed_fn([key.text])
+        except Exception as e:
+            logger.warning(f"答案快取嵌入計算失敗，改用精確比對: {e}")
+            return key
+        embedding = _unit_vector(vectors[0]) if vectors else None
+        if embedding is None:
+            return key
+        return AnswerCacheKey(
+            context=key.context, text=key.text, data_version=key.data_version, embedding=embedding
+        )
+
+    def get(self, key: AnswerCacheKey) -> Optional[str]:
+        """查詢快取；命中時回傳完整回覆文字。"""
+        now = time.time()
+        with self._lock:
+            self._observe_version(key.data_version)
+            entry = self._entries.get(key)
+            candidates: List[Tuple[AnswerCacheKey, tuple]] = []
+            if entry is None and key.embedding is not None:
+                candidates = [
+                    (cached_key, cached_key.embedding)
+                    for cached_key in self._similar_index.get(key.context, ())
+                    if cached_key.data_version == key.data_version
+                ]
+        matched_key = key
+        if entry is None and candidates:
+            # 向量已正規化，內積即為餘弦相似度；在鎖外計算，不阻塞其他請求。
+            best_score = self.similarity_threshold
+            for cached_key, embedding in candidates:
+                score = sum(a * b for a, b in zip(key.embedding, embedding))
+                if score >= best_score:
+                    matched_key, best_score = cached_key, score
+
+        with self._lock:
+            if entry is None and matched_key is not key:
+                entry = self._entries.get(matched_key)
+            if entry is not None and now - entry.created_at > self.ttl_seconds:
+                self._remove(matched_key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                logger.debug(f"答案快取未命中 (hits: {self.hits}, misses: {self.misses})")
+                return None
+            self._entries.move_to_end(matched_key)
+            self.hits += 1
+            self.saved_upstream_seconds += entry.upstream_seconds
+            hits, misses, saved = self.hits, self.misses, self.saved_upstream_seconds
+        logger.info(
+            f"答案快取命中 (hits: {hits}, misses: {misses}, 累計節省上游時間: {saved:.2f}s)"
+        )
+        return entry.answer
+
+    def put(self, key: AnswerCacheKey, answer: str, upstream_seconds: float) -> None:
+        """寫入完整回覆，超過容量時淘汰最久未使用的項目；較舊資源快照上產生的回覆不寫入。"""
+        if not answer:
+            return
+        with self._lock:
+            self._observe_version(key.data_version)
+            if key.data_version < self._data_version:
+                return
+            self._remove(key)
+            self._entries[key] = _CacheEntry(
+                answer=answer,
+                created_at=time.time(),
+                upstream_seconds=upstream_seconds,
+            )
+            if key.embedding is not None:
+                similar = self._similar_index.setdefault(key.context, OrderedDict())
+                similar[key] = None
+                while len(similar) > SIMILARITY_CANDIDATES_PER_CONTEXT:
+                    similar.popitem(last=False)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """清空快取（資料更新時調用）。"""
+        with self._lock:
+            self._entries.clear()
+            self._similar_index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """回傳命中統計。"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_upstream_seconds": round(self.saved_upstream_seconds, 3),
+            }
+
+    def _remove(self, key: AnswerCacheKey) -> None:
+        self._entries.pop(key, None)
+        similar = self._similar_index.get(key.context)
+        if similar is not None:
+            similar.pop(key, None)
+            if not similar:
+                del self._similar_index[key.context]
+
+    def _observe_version(self, data_version: int) -> None:
+        """出現較新的資源快照版本時清空快取（呼叫端持有鎖）。"""
+        if data_version > self._data_version:
+            if self._entries:
+                logger.info(f"資源快照更新為第 {data_version} 版，清空答案快取")
+            self._entries.clear()
+            self._similar_index.clear()
+            self._data_version = data_version
+
+
+async def replay_answer(
+    answer: str,
+    chunk_chars: Optional[int] = None,
+    interval: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """以設定的節奏將快取回覆分段串流回傳，模擬原本的串流體驗。"""
+    chunk_chars = chunk_chars or config.ANSWER_CACHE_REPLAY_CHUNK_CHARS
+    interval = config.ANSWER_CACHE_REPLAY_INTERVAL if interval is None else interval
+    for start in range(0, len(answer), chunk_chars):
+        if start and interval > 0:
+            await asyncio.sleep(interval)
+        yield answer[start:start + chunk_chars]
+
+
+answer_cache = AnswerCache(
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
@@ -4,35 +4,47 @@
 import json
 import random
 import logging
-from typing import Optional, List, Dict, Any
-import chromadb
+from typing import TYPE_CHECKING, Optional, List, Dict, Any
 import config
 from lib.auth.validators import sanitize_input
+from lib.dependencies import get_song_by_id, query_collection
+from lib.metrics import CANDIDATE_FALLBACK_TOTAL, CHROMA_QUERY_SECONDS
+from lib.songs import Song
+
+if TYPE_CHECKING:
+    import chromadb
 
 logger = logging.getLogger(__name__)
 
 
 def get_candidate_songs(
     message: str, 
-    collection: Optional[chromadb.Collection] = None, 
-    all_songs: Optional[List[Dict[str, Any]]] = None
-) -> List[Dict[str, Any]]:
+    collection: Optional["chromadb.Collection"] = None, 
+    all_songs: Optional[List[Song]] = None,
+    songs_by_id: Optional[Dict[str, Song]] = None,
+) -> List[Song]:
     """
     獲取候選歌曲列表
+
+    songs_by_id 為請求開始時取得的資源快照中的 ID 索引；未提供時使用目前的快照。
     """
+    lookup = songs_by_id.get if songs_by_id is not None else get_song_by_id
     candidate_songs = []
     
     if collection:
         try:
-            # 進行語意查詢，取出前 N 筆
-            results = collection.query(query_texts=[message], n_results=config.CHROMA_QUERY_LIMIT)
+            # 進行語意查詢，取出前 N 筆（以建立索引時的同一模型編碼查詢）
+            with CHROMA_QUERY_SECONDS.time():
+                results = query_collection(collection, [message], n_results=config.CHROMA_QUERY_LIMIT)
             if results and results["metadatas"] and len(results["metadatas"][0]) > 0:
-                for meta in results["metadatas"][0]:
-                    json_data = meta.get("json")
-                    if isinstance(json_data, str):
-                        song_obj = json.loads(json_data)
-                    else:
-                        song_obj = json_data
+                ids = (results.get("ids") or [[]])[0]
+                for i, meta in enumerate(results["metadatas"][0]):
+                    # 優先使用記憶體中的歌曲索引，省去逐筆解析 metadata 中的 JSON。
+                    song_obj = lookup(ids[i]) if i < len(ids) else None
+                    if song_obj is None:
+                        json_data = meta.get("json")
+                        json_data = json.loads(json_data) if isinstance(json_data, str) else json_data
+                        song_obj = Song.from_dict(json_data) if json_data else None
                     if song_obj:
                         candidate_songs.append(song_obj)
         except Exception as e:
@@ -41,11 +53,19 @@ def get_candidate_songs(
     # Fallback 機制
     if not candidate_songs and all_songs:
         candidate_songs = random.sample(all_songs, min(config.FALLBACK_SONGS_COUNT, len(all_songs)))
+        CANDIDATE_FALLBACK_TOTAL.inc()
         logger.warning(f"使用 Fallback 機制，隨機選取 {len(candidate_songs)} 首歌")
     
     return candidate_songs
 
 
+def build_songs_context(songs: List[Song]) -> str:
+    """
+    構建候選歌曲資料庫文本（songs.json 格式的 JSON）
+    """
+    return json.dumps([song.to_dict() for song in songs], ensure_ascii=False)
+
+
 def build_profile_context(profile: Optional[Dict[str, Any]] = None) -> str:
     """
     構建玩家實力上下文文本
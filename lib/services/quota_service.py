@@ -0,0 +1,281 @@
+"""
+以 token 成本計算的用量配額
+
+每個存取代碼有兩個 token bucket（每分鐘、每日），容量即為額度，因此輕度用戶可以一次用完整個額度：
+- 構建 prompt 後以估計的輸入 token 預扣，餘額不足時回傳 429
+- 串流結束後依上游回報的 usage metadata 補扣輸出 token，並修正輸入 token 的估計誤差
+  （可能使餘額變為負數，之後的請求要等補充後才能再送出）
+
+餘額保存在同主機所有 worker 共用的 SQLite 檔案（config.QUOTA_STORAGE_PATH），
+每次預扣都在寫入交易內完成，多個 worker 不會各自擁有一份完整額度。
+已補滿的 bucket 與不存在等價，會定期刪除，檔案大小只與近期活躍的用戶數有關。
+
+每日用量統計在程序內累計，定期在同一個檔案鎖內合併寫回用戶資料的 "quota" 欄位，
+而非每次請求都寫檔。
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+import config
+from lib.exceptions import RateLimitError
+from lib.services.user_service import users_transaction
+
+logger = logging.getLogger(__name__)
+
+# 每個程序最多每隔多久清除一次已補滿的 bucket。
+PURGE_INTERVAL_SECONDS = 60.0
+
+
+class QuotaExceededError(RateLimitError):
+    """token 配額不足"""
+    def __init__(self, message: str = "用量已達上限，請稍後再試", retry_after: int = 60):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """容量為 capacity、每秒補充 rate 的 token bucket；餘額可為負數（欠額）。"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, period_seconds: float, tokens: Optional[float] = None,
+                 updated_at: Optional[float] = None):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = self.capacity if tokens is None else min(float(tokens), self.capacity)
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def refill(self, now: float) -> None:
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def seconds_until(self, amount: float) -> float:
+        """餘額補充到 amount 所需的秒數。"""
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quota_buckets (
+    user TEXT PRIMARY KEY,
+    minute_tokens REAL NOT NULL,
+    minute_updated_at REAL NOT NULL,
+    day_tokens REAL NOT NULL,
+    day_updated_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+# 補充後兩個 bucket 都已全滿的列與不存在的列等價，可以刪除。
+_PURGE_SQL = """
+DELETE FROM quota_buckets
+WHERE minute_tokens + (?1 - minute_updated_at) * ?2 >= ?3
+  AND day_tokens + (?1 - day_updated_at) * ?4 >= ?5
+"""
+
+
+def _storage_key(code: str) -> str:
+    # 配額檔案中不保存存取代碼本身。
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+class QuotaService:
+    """以 token 成本限制每個存取代碼的 Gemini 用量。"""
+
+    def __init__(self, per_minute: int, per_day: int, flush_interval: float, path: str,
+                 timeout: float = 5.0):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.flush_interval = flush_interval
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_purge = 0.0
+        # 自上次寫回以來的用量（只在本程序累計，寫回後清空）。
+        self._pending_usage: Dict[str, Dict[str, int]] = {}
+        self._usage_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # 連線不可跨 fork 共用，因此以 (pid, thread) 為單位建立。
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _buckets(self, code: str, write: bool = True) -> Iterator[Tuple[TokenBucket, TokenBucket]]:
+        """在寫入交易內取得（已補充的）兩個 bucket，區塊結束時寫回；其他 worker 無法在中間插入。"""
+        conn = self._connection()
+        key = _storage_key(code)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            row = conn.execute(
+                "SELECT minute_tokens, minute_updated_at, day_tokens, day_updated_at "
+                "FROM quota_buckets WHERE user = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                minute = TokenBucket(self.per_minute, 60, updated_at=now)
+                day = TokenBucket(self.per_day, 86400, updated_at=now)
+            else:
+                minute = TokenBucket(self.per_minute, 60, tokens=row[0], updated_at=row[1])
+                day = TokenBucket(self.per_day, 86400, tokens=row[2], updated_at=row[3])
+            minute.refill(now)
+            day.refill(now)
+            yield minute, day
+            if write:
+                conn.execute(
+                    "INSERT OR REPLACE INTO quota_buckets VALUES (?, ?, ?, ?, ?)",
+                    (key, minute.tokens, minute.updated_at, day.tokens, day.updated_at),
+                )
+                self._purge_full(conn, now)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _purge_full(self, conn: sqlite3.Connection, now: float) -> None:
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL_SECONDS
+            conn.execute(
+                _PURGE_SQL,
+                (now, self.per_minute / 60, self.per_minute, self.per_day / 86400, self.per_day),
+            )
+
+    def _record_usage(self, code: str, **amounts: int) -> None:
+        with self._usage_lock:
+            usage = self._pending_usage.setdefault(
+                code, {"input_tokens": 0, "output_tokens": 0, "requests": 0}
+            )
+            for key, value in amounts.items():
+                usage[key] += value
+
+    def reserve(self, code: str, input_tokens: int) -> Dict[str, int]:
+        """預扣估計的輸入 token 並回傳剩餘額度；不足時拋出 QuotaExceededError。"""
+        with self._buckets(code) as buckets:
+            for bucket in buckets:
+                # 單次請求超過容量時只要求餘額全滿，避免大型 prompt 永遠無法送出。
+                if bucket.tokens < min(input_tokens, bucket.capacity):
+                    retry_after = max(1, math.ceil(bucket.seconds_until(input_tokens)))
+                    raise QuotaExceededError(retry_after=retry_after)
+            for bucket in buckets:
+                bucket.tokens -= input_tokens
+            remaining = _remaining(*buckets)
+        self._record_usage(code, requests=1, input_tokens=input_tokens)
+        return remaining
+
+    def settle(self, code: str, estimated_input_tokens: int, prompt_tokens: Optional[int],
+               output_tokens: int) -> None:
+        """串流結束後補扣輸出 token，並以上游回報的輸入 token 修正預扣量。"""
+        correction = (prompt_tokens - estimated_input_tokens) if prompt_tokens is not None else 0
+        with self._buckets(code) as buckets:
+            for bucket in buckets:
+                bucket.tokens -= output_tokens + correction
+        self._record_usage(code, input_tokens=correction, output_tokens=output_tokens)
+
+    def refund(self, code: str, input_tokens: int) -> None:
+        """上游未開始生成時退回預扣的輸入 token。"""
+        with self._buckets(code) as buckets:
+            for bucket in buckets:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + input_tokens)
+        self._record_usage(code, requests=-1, input_tokens=-input_tokens)
+
+    def remaining(self, code: str) -> Dict[str, int]:
+        with self._buckets(code, write=False) as buckets:
+            return _remaining(*buckets)
+
+    def forget(self, code: str) -> None:
+        """刪除存取代碼的配額狀態（用戶登出或過期時呼叫）。"""
+        with self._usage_lock:
+            self._pending_usage.pop(code, None)
+        self._connection().execute("DELETE FROM quota_buckets WHERE user = ?", (_storage_key(code),))
+
+    def flush(self) -> int:
+        """將本程序自上次寫回以來的用量合併到用戶資料的 "quota" 欄位，回傳寫回的帳戶數。"""
+        with self._usage_lock:
+            pending, self._pending_usage = self._pending_usage, {}
+        if not pending:
+            return 0
+
+        today = time.strftime("%Y-%m-%d")
+        written = 0
+        try:
+            with users_transaction() as users:
+                for code, usage in pending.items():
+                    if code not in users:
+                        continue
+                    totals = (users[code].get("quota") or {}).get("usage") or {}
+                    if totals.get("date") != today:
+                        totals = {"date": today, "input_tokens": 0, "output_tokens": 0, "requests": 0}
+                    for key, value in usage.items():
+                        totals[key] = totals.get(key, 0) + value
+                    users[code]["quota"] = {"usage": totals}
+                    written += 1
+        except BaseException:
+            # 寫回失敗時保留用量，下次再寫。
+            for code, usage in pending.items():
+                self._record_usage(code, **usage)
+            raise
+        for code in pending:
+            if code not in users:
+                # 寫回前已被刪除的用戶：一併清除配額狀態。
+                self.forget(code)
+        return written
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"寫回用量配額失敗: {e}", exc_info=True)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+
+def _remaining(minute: TokenBucket, day: TokenBucket) -> Dict[str, int]:
+    return {"minute": max(0, int(minute.tokens)), "day": max(0, int(day.tokens))}
+
+
+def quota_headers(remaining: Dict[str, int]) -> Dict[str, str]:
+    return {
+        "X-Quota-Remaining-Minute": str(remaining["minute"]),
+        "X-Quota-Remaining-Day": str(remaining["day"]),
+    }
+
+
+quota_service = QuotaService(
+    per_minute=config.QUOTA_TOKENS_PER_MINUTE,
+    per_day=config.QUOTA_TOKENS_PER_DAY,
+    flush_interval=config.QUOTA_FLUSH_INTERVAL_SECONDS,
+    path=config.QUOTA_STORAGE_PATH,
+)
@@ -2,37 +2,35 @@
 import os
 import json
 import time
+import shutil
+import hashlib
 import tempfile
 import logging
-from typing import Optional, Dict, List, Any
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator, List, Tuple, Any
 from filelock import FileLock
 import config
+from lib.auth.validators import SESSION_ID_PATTERN
+from lib.metrics import USER_STORE_LOCK_WAIT_SECONDS, USER_STORE_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
-def load_users() -> Dict[str, Any]:
-    """載入用戶資料。"""
-    if not os.path.exists(config.USERS_DB_PATH):
-        return {}
-    lock_path = config.USERS_DB_PATH + ".lock"
-    with FileLock(lock_path):
+def _read_users_file() -> Dict[str, Any]:
+    with USER_STORE_SECONDS.labels("load").time():
         try:
             with open(config.USERS_DB_PATH, "r", encoding="utf-8") as f:
                 return json.load(f)
+        except FileNotFoundError:
+            return {}
         except (json.JSONDecodeError, OSError) as e:
             logger.error(f"讀取用戶數據失敗: {e}")
             return {}
 
 
-def save_users(users_data: Dict[str, Any]) -> None:
-    """保存用戶資料。"""
+def _write_users_file(users_data: Dict[str, Any]) -> None:
     dir_path = os.path.dirname(config.USERS_DB_PATH)
-    if dir_path:
-        os.makedirs(dir_path, exist_ok=True)
-
-    lock_path = config.USERS_DB_PATH + ".lock"
-    with FileLock(lock_path):
+    with USER_STORE_SECONDS.labels("save").time():
         with tempfile.NamedTemporaryFile(
             "w",
             encoding="utf-8",
@@ -44,7 +42,52 @@ def save_users(users_data: Dict[str, Any]) -> None:
             tmp_path = tmp_file.name
 
         os.replace(tmp_path, config.USERS_DB_PATH)
-        logger.debug("用戶數據已保存")
+    logger.debug("用戶數據已保存")
+
+
+def load_users() -> Dict[str, Any]:
+    """載入用戶資料。"""
+    if not os.path.exists(config.USERS_DB_PATH):
+        return {}
+    lock_path = config.USERS_DB_PATH + ".lock"
+    wait_started = time.perf_counter()
+    with FileLock(lock_path):
+        USER_STORE_LOCK_WAIT_SECONDS.labels("load").observe(time.perf_counter() - wait_started)
+        return _read_users_file()
+
+
+def save_users(users_data: Dict[str, Any]) -> None:
+    """保存用戶資料。"""
+    dir_path = os.path.dirname(config.USERS_DB_PATH)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+
+    lock_path = config.USERS_DB_PATH + ".lock"
+    wait_started = time.perf_counter()
+    with FileLock(lock_path):
+        USER_STORE_LOCK_WAIT_SECONDS.labels("save").observe(time.perf_counter() - wait_started)
+        _write_users_file(users_data)
+
+
+@contextmanager
+def users_transaction() -> Iterator[Dict[str, Any]]:
+    """
+    在同一個檔案鎖內讀取並寫回用戶資料。
+
+    load_users() 與 save_users() 各自取得鎖，兩者之間其他程序的寫入會被覆蓋；
+    需要讀取－修改－寫回時改用此函式。區塊內拋出例外時不寫回。
+    """
+    dir_path = os.path.dirname(config.USERS_DB_PATH)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+
+    lock_path = config.USERS_DB_PATH + ".lock"
+    wait_started = time.perf_counter()
+    with FileLock(lock_path):
+        USER_STORE_LOCK_WAIT_SECONDS.labels("update").observe(time.perf_counter() - wait_started)
+        users = _read_users_file()
+        yield users
+        _write_users_file(users)
 
 
 def get_user(code: str) -> Optional[Dict[str, Any]]:
@@ -82,6 +125,7 @@ def delete_user(code: str) -> bool:
     
     del users[code]
     save_users(users)
+    delete_conversations(code)
     return True
 
 
@@ -121,6 +165,13 @@ def add_session(code: str, session: dict) -> bool:
         return False
     
     sessions = users[code].get("chat_sessions", [])
+    for index, existing in enumerate(sessions):
+        # 重新儲存同一個對話時直接覆寫，不佔用新的名額。
+        if isinstance(existing, dict) and existing.get("id") == session.get("id"):
+            sessions[index] = session
+            save_users(users)
+            return True
+
     if len(sessions) >= config.MAX_SESSIONS_PER_USER:
         return False
     
@@ -138,7 +189,7 @@ def delete_session(code: str, session_id: str) -> bool:
     
     sessions = users[code].get("chat_sessions", [])
     if not isinstance(sessions, list):
-        logger.warning(f"用戶對話資料格式異常，無法刪除對話 (code: {code[:8]}...)")
+        logger.warning("用戶對話資料格式異常，無法刪除對話")
         return False
 
     new_sessions = [
@@ -154,3 +205,110 @@ def delete_session(code: str, session_id: str) -> bool:
     users[code]["chat_sessions"] = new_sessions
     save_users(users)
     return True
+
+
+def _conversation_dir(code: str) -> str:
+    # 目錄名稱使用存取代碼的雜湊值，檔案系統中不出現代碼本身。
+    return os.path.join(config.CONVERSATIONS_DIR, hashlib.sha256(code.encode("utf-8")).hexdigest()[:32])
+
+
+def _conversation_path(code: str, session_id: str) -> Optional[str]:
+    if not SESSION_ID_PATTERN.match(session_id or ""):
+        return None
+    return os.path.join(_conversation_dir(code), session_id + ".jsonl")
+
+
+def _read_conversation_file(path: str) -> List[Dict[str, Any]]:
+    messages = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 寫入中斷留下的不完整行。
+                continue
+    return messages
+
+
+def _saved_session_messages(code: str, session_id: str) -> Tuple[bool, Optional[List[Dict[str, Any]]]]:
+    """回傳（用戶是否存在, 同 ID 已儲存對話的訊息或 None）。"""
+    users = load_users()
+    if code not in users:
+        return False, None
+    for session in users[code].get("chat_sessions", []):
+        if isinstance(session, dict) and session.get("id") == session_id:
+            return True, session.get("messages", [])
+    return True, None
+
+
+def get_conversation(code: str, session_id: str) -> Optional[List[Dict[str, Any]]]:
+    """取得伺服器端保存的對話訊息；找不到時改用同 ID 的已儲存對話。"""
+    path = _conversation_path(code, session_id)
+    if path is None:
+        return None
+    try:
+        return _read_conversation_file(path)[-config.CONVERSATION_MAX_MESSAGES:]
+    except FileNotFoundError:
+        return _saved_session_messages(code, session_id)[1]
+
+
+def append_conversation_turns(code: str, session_id: str, messages: List[Dict[str, Any]]) -> bool:
+    """
+    將新訊息附加到伺服器端對話（不存在時建立），並淘汰最久未更新的對話。
+
+    每段對話是 CONVERSATIONS_DIR 下的一個 JSON Lines 檔案，每輪只附加新的訊息，
+    不重寫 users.json；行數超過上限的兩倍時才壓縮為最近的 CONVERSATION_MAX_MESSAGES 則。
+    """
+    path = _conversation_path(code, session_id)
+    if path is None:
+        return False
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    with FileLock(os.path.join(directory, ".lock")):
+        with USER_STORE_SECONDS.labels("append_conversation").time():
+            seed: List[Dict[str, Any]] = []
+            created = not os.path.exists(path)
+            if created:
+                # 延續已儲存的對話時，以其內容作為起點。
+                user_found, saved = _saved_session_messages(code, session_id)
+                if not user_found:
+                    return False
+                seed = list(saved or [])
+
+            payload = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in seed + messages)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(payload)
+
+            stored = _read_conversation_file(path)
+            if len(stored) > 2 * config.CONVERSATION_MAX_MESSAGES:
+                _compact_conversation(path, stored[-config.CONVERSATION_MAX_MESSAGES:])
+            if created:
+                _evict_conversations(directory)
+    return True
+
+
+def _compact_conversation(path: str, messages: List[Dict[str, Any]]) -> None:
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", delete=False, dir=os.path.dirname(path), suffix=".tmp"
+    ) as tmp_file:
+        for message in messages:
+            tmp_file.write(json.dumps(message, ensure_ascii=False) + "\n")
+        tmp_path = tmp_file.name
+    os.replace(tmp_path, path)
+
+
+def _evict_conversations(directory: str) -> None:
+    paths = [
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jsonl")
+    ]
+    if len(paths) <= config.MAX_CONVERSATIONS_PER_USER:
+        return
+    paths.sort(key=os.path.getmtime)
+    for stale in paths[: len(paths) - config.MAX_CONVERSATIONS_PER_USER]:
+        os.remove(stale)
+
+
+def delete_conversations(code: str) -> None:
+    """刪除用戶所有伺服器端對話。"""
+    shutil.rmtree(_conversation_dir(code), ignore_errors=True)
@@ -0,0 +1,301 @@
+"""
+歌曲資料的二進位快照
+
+build_songs_snapshot.py 將 songs.json 編譯為與其同目錄的 songs.snapshot：
+- 數值欄位（BPM 範圍、鬼級星數、最大連擊數）為欄式陣列
+- 字串欄位為字串表的索引，相同字串（類別、描述、標籤等）只存一份
+- 攻略內文 strategy_text 存於獨立的文字區塊，Song 只記錄位移，讀取時才從映射的分頁解碼
+
+伺服器以 mmap 唯讀開啟快照，不必解析整份 JSON；攻略內文留在 page cache 中由所有 worker 共用。
+快照記錄建立時 songs.json 的大小、mtime 與 SHA-256，與目前的 songs.json 不符（過期）、
+格式版本不符或無法讀取時改讀 songs.json。
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+import config
+from lib.songs import Song, read_songs
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TKSS"
+FORMAT_VERSION = 1
+# magic、格式版本、目錄（JSON）長度
+HEADER = struct.Struct("<4sII")
+ALIGNMENT = 8
+
+# 欄名 -> array 型別碼；字串欄位存字串表的索引（0 為空字串）。
+COLUMNS = {
+    "id_kind": "B",
+    "id_ref": "I",
+    "title": "I",
+    "subtitle": "I",
+    "genre": "I",
+    "bpm_kind": "B",
+    "bpm_ref": "I",
+    "bpm_min": "d",
+    "bpm_max": "d",
+    "oni": "i",
+    "max_combo": "q",
+    "detail_url": "I",
+    "description": "I",
+    "feature_offsets": "I",
+    "features": "I",
+    "extra": "I",
+    "strategy_start": "q",
+    "strategy_end": "q",
+    "string_offsets": "Q",
+}
+
+# id 與 bpm 在 songs.json 中可能是數字或字串，以型別碼還原。
+KIND_NONE, KIND_INT, KIND_FLOAT, KIND_STR = range(4)
+
+
+def snapshot_path(songs_path: str) -> str:
+    """songs.json 對應的快照路徑（同目錄、副檔名為 .snapshot）。"""
+    return os.path.splitext(songs_path)[0] + ".snapshot"
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_scalar(value: Any) -> Tuple[int, str]:
+    if value is None:
+        return KIND_NONE, ""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return KIND_STR, str(value)
+    return (KIND_INT if isinstance(value, int) else KIND_FLOAT), repr(value)
+
+
+def _decode_scalar(kind: int, text: str) -> Any:
+    if kind == KIND_INT:
+        return int(text)
+    if kind == KIND_FLOAT:
+        return float(text)
+    if kind == KIND_STR:
+        return text
+    return None
+
+
+class _StringTable:
+    def __init__(self):
+        self.index: Dict[str, int] = {"": 0}
+
+    def add(self, text: str) -> int:
+        ref = self.index.get(text)
+        if ref is None:
+            ref = self.index[text] = len(self.index)
+        return ref
+
+    def encode(self) -> Tuple[array, bytes]:
+        offsets = array(COLUMNS["string_offsets"], [0])
+        blob = bytearray()
+        for text in self.index:
+            blob += text.encode("utf-8")
+            offsets.append(len(blob))
+        return offsets, bytes(blob)
+
+
+def build_snapshot(songs_path: str, output: Optional[str] = None) -> str:
+    """將 songs.json 編譯為快照（以 os.replace 原子性地替換），回傳快照路徑。"""
+    output = output or snapshot_path(songs_path)
+    stat = os.stat(songs_path)
+    with open(songs_path, "rb") as f:
+        raw = f.read()
+    songs = [Song.from_dict(song) for song in json.loads(raw)]
+
+    strings = _StringTable()
+    columns = {name: array(code) for name, code in COLUMNS.items() if name != "string_offsets"}
+    texts = bytearray()
+    columns["feature_offsets"].append(0)
+    for song in songs:
+        for name, value in (("id", song.id), ("bpm", song.bpm)):
+            kind, text = _encode_scalar(value)
+            columns[f"{name}_kind"].append(kind)
+            columns[f"{name}_ref"].append(strings.add(text))
+        for name in ("title", "subtitle", "genre", "detail_url", "description"):
+            columns[name].append(strings.add(getattr(song, name)))
+        columns["bpm_min"].append(float("nan") if song.bpm_min is None else song.bpm_min)
+        columns["bpm_max"].append(float("nan") if song.bpm_max is None else song.bpm_max)
+        columns["oni"].append(song.oni)
+        columns["max_combo"].append(-1 if song.max_combo is None else song.max_combo)
+        columns["features"].extend(strings.add(feature) for feature in song.features)
+        columns["feature_offsets"].append(len(columns["features"]))
+        columns["extra"].append(strings.add(json.dumps(song.extra, ensure_ascii=False)) if song.extra else 0)
+        strategy_text = song.strategy_text
+        if strategy_text is None:
+            columns["strategy_start"].append(-1)
+            columns["strategy_end"].append(-1)
+        else:
+            columns["strategy_start"].append(len(texts))
+            texts += strategy_text.encode("utf-8")
+            columns["strategy_end"].append(len(texts))
+    columns["string_offsets"], string_blob = strings.encode()
+
+    sections = [(name, columns[name].tobytes()) for name in COLUMNS] + [
+        ("strings", string_blob),
+        ("texts", bytes(texts)),
+    ]
+    directory: Dict[str, Any] = {
+        "count": len(songs),
+        "byteorder": sys.byteorder,
+        "itemsizes": {code: array(code).itemsize for code in set(COLUMNS.values())},
+        "source": {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": hashlib.sha256(raw).hexdigest(),
+        },
+        "sections": {},
+    }
+    # 區塊位移相對於資料區起點，與目錄的長度無關。
+    offset = 0
+    for name, data in sections:
+        directory["sections"][name] = [offset, len(data)]
+        offset = _align(offset + len(data))
+    directory_bytes = json.dumps(directory).encode("utf-8")
+    data_start = _align(HEADER.size + len(directory_bytes))
+
+    directory_name = os.path.dirname(output)
+    if directory_name:
+        os.makedirs(directory_name, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "wb", delete=False, dir=directory_name if directory_name else None, suffix=".tmp"
+    ) as tmp_file:
+        tmp_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(directory_bytes)))
+        tmp_file.write(directory_bytes)
+        for name, data in sections:
+            tmp_file.seek(data_start + directory["sections"][name][0])
+            tmp_file.write(data)
+        tmp_file.truncate(data_start + offset)
+        tmp_path = tmp_file.name
+    os.replace(tmp_path, output)
+    return output
+
+
+class SongSnapshot:
+    """以 mmap 唯讀開啟的歌曲快照。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            raise ValueError("快照檔案不完整")
+        magic, version, length = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"快照格式不符 (版本 {version})")
+        self.directory = json.loads(self._mm[HEADER.size : HEADER.size + length])
+        itemsizes = self.directory["itemsizes"]
+        if self.directory["byteorder"] != sys.byteorder or any(
+            array(code).itemsize != size for code, size in itemsizes.items()
+        ):
+            raise ValueError("快照的位元組順序或數值大小與本機不符")
+        self._data_start = _align(HEADER.size + length)
+        self._view = memoryview(self._mm)
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self.directory["sections"][name]
+        start = self._data_start + offset
+        if start + length > len(self._mm):
+            raise ValueError("快照檔案不完整")
+        view = self._view[start : start + length]
+        return view.cast(COLUMNS[name]) if name in COLUMNS else view
+
+    def matches(self, songs_path: str) -> bool:
+        """快照是否由目前的 songs.json 建立。"""
+        source = self.directory["source"]
+        try:
+            stat = os.stat(songs_path)
+        except OSError:
+            return False
+        if stat.st_size != source["size"]:
+            return False
+        if stat.st_mtime_ns == source["mtime_ns"]:
+            return True
+        # mtime 不同（例如複製或重新部署）時以內容雜湊確認。
+        return _file_sha256(songs_path) == source["sha256"]
+
+    def text(self, start: int, end: int) -> str:
+        texts_start = self._data_start + self.directory["sections"]["texts"][0]
+        return str(self._view[texts_start + start : texts_start + end], "utf-8")
+
+    def songs(self) -> List[Song]:
+        # 欄位一次轉為 list，比逐筆索引 memoryview 快得多。
+        columns = {name: self._section(name).tolist() for name in COLUMNS}
+        string_offsets = columns["string_offsets"]
+        blob = self._section("strings")
+        strings = [str(blob[start:end], "utf-8") for start, end in zip(string_offsets, string_offsets[1:])]
+        feature_offsets = columns["feature_offsets"]
+        features = columns["features"]
+
+        songs = []
+        rows = zip(
+            *(
+                columns[name]
+                for name in (
+                    "id_kind", "id_ref", "title", "subtitle", "genre", "bpm_kind", "bpm_ref", "bpm_min", "bpm_max",
+                    "oni", "max_combo", "detail_url", "description", "extra", "strategy_start", "strategy_end",
+                )
+            )
+        )
+        for i, row in enumerate(rows):
+            (
+                id_kind, id_ref, title, subtitle, genre, bpm_kind, bpm_ref, bpm_min, bpm_max,
+                oni, max_combo, detail_url, description, extra, start, end,
+            ) = row
+            songs.append(
+                Song(
+                    id=_decode_scalar(id_kind, strings[id_ref]),
+                    title=strings[title],
+                    subtitle=strings[subtitle],
+                    genre=strings[genre],
+                    bpm=_decode_scalar(bpm_kind, strings[bpm_ref]),
+                    oni=oni,
+                    detail_url=strings[detail_url],
+                    features=[strings[ref] for ref in features[feature_offsets[i] : feature_offsets[i + 1]]],
+                    description=strings[description],
+                    max_combo=None if max_combo < 0 else max_combo,
+                    strategy_text=partial(self.text, start, end) if start >= 0 else None,
+                    extra=json.loads(strings[extra]) if extra else None,
+                    # NaN 表示無法解析
+                    bpm_range=(None if bpm_min != bpm_min else bpm_min, None if bpm_max != bpm_max else bpm_max),
+                )
+            )
+        return songs
+
+
+def load_songs(songs_path: str) -> List[Song]:
+    """優先載入 songs.json 的快照；快照不存在、過期或無法讀取時改讀 songs.json。"""
+    if config.SONGS_SNAPSHOT_ENABLED:
+        path = snapshot_path(songs_path)
+        if os.path.exists(path):
+            started = time.perf_counter()
+            try:
+                snapshot = SongSnapshot(path)
+                if snapshot.matches(songs_path):
+                    songs = snapshot.songs()
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    logger.info(f"✅ 載入歌曲快照 {path} ({len(songs)} 首，{elapsed_ms:.1f}ms)")
+                    return songs
+                logger.warning(f"⚠️ 歌曲快照已過期，改讀 {songs_path}（請重新執行 build_songs_snapshot.py）")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"⚠️ 無法讀取歌曲快照 {path}，改讀 songs.json: {e}")
+    return read_songs(songs_path)
@@ -0,0 +1,228 @@
+"""
+歌曲資料模型
+
+songs.json 在載入時轉換為 Song：BPM 字串（例如 "9.38?-150"）在建立時解析一次為 bpm_min/bpm_max，
+鬼級星數轉為整數（無法解析的原始值如 "10+" 保留在 extra，寫回時原樣還原），
+類別與標籤字串以 sys.intern 共用（重新指定 features 時同樣共用），標籤存為 tuple。以 __slots__ 取代每首歌的 dict，
+減少每個 worker 常駐的記憶體，使用端也不必各自以正規表示式解析 BPM。
+
+攻略內文 strategy_text 可以是字串或載入函式；設定為載入函式時，每次讀取才取得內文，不常駐於物件中。
+to_dict() 還原 songs.json 的格式，用於寫回檔案、ChromaDB metadata 與 prompt。
+"""
+import json
+import re
+import sys
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+BPM_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+# 有對應屬性的欄位；其他欄位原樣保留在 extra。
+KNOWN_FIELDS = frozenset(
+    (
+        "id",
+        "title",
+        "subtitle",
+        "genre",
+        "difficulty",
+        "bpm",
+        "detail_url",
+        "features",
+        "description",
+        "max_combo",
+        "strategy_text",
+    )
+)
+
+StrategyText = Union[None, str, Callable[[], Optional[str]]]
+
+
+def parse_bpm(value: Any) -> Tuple[Optional[float], Optional[float]]:
+    """取出 BPM 字串中的最小與最大值；沒有數字時回傳 (None, None)。"""
+    numbers = [float(n) for n in BPM_NUMBER_PATTERN.findall(str(value))]
+    if not numbers:
+        return None, None
+    return min(numbers), max(numbers)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    """轉為整數；無法轉換時回傳 None，由呼叫端保留原始值。"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Song:
+    """一首歌（一個譜面）；數值欄位在建立時解析完成。"""
+
+    __slots__ = (
+        "id",
+        "title",
+        "subtitle",
+        "genre",
+        "bpm",
+        "bpm_min",
+        "bpm_max",
+        "_oni",
+        "detail_url",
+        "_features",
+        "description",
+        "_max_combo",
+        "extra",
+        "_strategy_text",
+    )
+
+    def __init__(
+        self,
+        id: Any = None,
+        title: str = "",
+        subtitle: str = "",
+        genre: str = "",
+        bpm: Any = "0",
+        oni: int = 0,
+        detail_url: str = "",
+        features: Iterable[str] = (),
+        description: str = "",
+        max_combo: Optional[int] = None,
+        strategy_text: StrategyText = None,
+        extra: Optional[Dict[str, Any]] = None,
+        bpm_range: Optional[Tuple[Optional[float], Optional[float]]] = None,
+    ):
+        self.id = id
+        self.title = title
+        self.subtitle = subtitle
+        self.genre = sys.intern(genre)
+        self.bpm = bpm
+        # 由歌曲快照載入時已有解析好的範圍，不必重新解析。
+        self.bpm_min, self.bpm_max = bpm_range if bpm_range is not None else parse_bpm(bpm)
+        # 直接設定欄位：from_dict 傳入的 0 / None 不應清除 extra 中的原始值。
+        self._oni = oni
+        self.detail_url = detail_url
+        self.features = features
+        self.description = description
+        self._max_combo = max_combo
+        self.extra = extra or None
+        self._strategy_text = strategy_text
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Song":
+        difficulty = dict(data.get("difficulty") or {})
+        extra = {key: value for key, value in data.items() if key not in KNOWN_FIELDS}
+        oni = _to_int(difficulty.get("oni", 0))
+        if oni is None:
+            # 無法解析的星數（例如 "10+"）以 0 參與篩選，原始值留在 extra 供寫回。
+            oni = 0
+        else:
+            difficulty.pop("oni", None)
+        if difficulty:
+            extra["difficulty"] = difficulty
+        max_combo = data.get("max_combo")
+        if max_combo is not None and _to_int(max_combo) is None:
+            extra["max_combo"] = max_combo
+            max_combo = None
+        return cls(
+            id=data.get("id"),
+            title=data.get("title") or "",
+            subtitle=data.get("subtitle") or "",
+            genre=data.get("genre") or "",
+            bpm=data.get("bpm", "0"),
+            oni=oni,
+            detail_url=data.get("detail_url") or "",
+            features=data.get("features") or (),
+            description=data.get("description") or "",
+            max_combo=_to_int(max_combo) if max_combo is not None else None,
+            strategy_text=data.get("strategy_text"),
+            extra=extra,
+        )
+
+    def _discard_raw(self, key: str, nested: Optional[str] = None) -> None:
+        """數值欄位重新指定後，丟棄 extra 中對應的無法解析原始值。"""
+        if not self.extra or key not in self.extra:
+            return
+        if nested is None:
+            del self.extra[key]
+        elif isinstance(self.extra[key], dict) and nested in self.extra[key]:
+            del self.extra[key][nested]
+            if not self.extra[key]:
+                del self.extra[key]
+        if not self.extra:
+            self.extra = None
+
+    @property
+    def oni(self) -> int:
+        return self._oni
+
+    @oni.setter
+    def oni(self, value: int) -> None:
+        self._oni = value
+        self._discard_raw("difficulty", "oni")
+
+    @property
+    def max_combo(self) -> Optional[int]:
+        return self._max_combo
+
+    @max_combo.setter
+    def max_combo(self, value: Optional[int]) -> None:
+        self._max_combo = value
+        self._discard_raw("max_combo")
+
+    @property
+    def features(self) -> Tuple[str, ...]:
+        return self._features
+
+    @features.setter
+    def features(self, value: Iterable[str]) -> None:
+        self._features = tuple(sys.intern(str(feature)) for feature in value)
+
+    @property
+    def strategy_text(self) -> Optional[str]:
+        value = self._strategy_text
+        return value() if callable(value) else value
+
+    @strategy_text.setter
+    def strategy_text(self, value: StrategyText) -> None:
+        self._strategy_text = value
+
+    @property
+    def key(self) -> Optional[str]:
+        """歌曲 ID 的字串形式，與 ChromaDB 的 ids 相同。"""
+        return str(self.id) if self.id is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """還原為 songs.json 中的格式。"""
+        extra = dict(self.extra or {})
+        data: Dict[str, Any] = {} if self.id is None else {"id": self.id}
+        data.update(
+            {
+                "title": self.title,
+                "subtitle": self.subtitle,
+                "genre": self.genre,
+                # extra 中的 difficulty.oni 是尚未重新指定的無法解析原始值，優先寫回。
+                "difficulty": {"oni": self.oni, **extra.pop("difficulty", {})},
+                "bpm": self.bpm,
+                "detail_url": self.detail_url,
+                "features": list(self.features),
+                "description": self.description,
+            }
+        )
+        if self.max_combo is not None:
+            data["max_combo"] = self.max_combo
+        strategy_text = self.strategy_text
+        if strategy_text is not None:
+            data["strategy_text"] = strategy_text
+        data.update(extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"Song(id={self.id!r}, title={self.title!r})"
+
+
+def read_songs(path: str) -> List[Song]:
+    """讀取 songs.json 並轉換為 Song。"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [Song.from_dict(song) for song in json.load(f)]
+
+
+def write_songs(songs: List[Song], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([song.to_dict() for song in songs], f, indent=2, ensure_ascii=False)
@@ -0,0 +1,166 @@
+"""
+前端靜態資源
+
+- index.html 於啟動時載入一次，並預先以 {CSP_NONCE} 切割，渲染時只需 join
+- app.js / style.css 以內容雜湊命名（/assets/app.<hash>.js），可設為 immutable 長期快取
+- 啟動時預先產生 gzip / brotli 壓縮版本，依 Accept-Encoding 選擇，不在請求時壓縮
+- 每個壓縮版本有各自的 ETag（"<hash>-br"），位元組不同的版本不共用強驗證器
+- 除錯模式下依檔案 mtime 自動重新載入
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，缺少時僅提供 gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+NONCE_PLACEHOLDER = "{CSP_NONCE}"
+ASSET_URL_PREFIX = "/assets/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """解析 Accept-Encoding 標頭，回傳編碼與權重（q 值）。"""
+    encodings: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 採弱比較：忽略 W/ 前綴，支援多個值與 *。"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+class StaticAsset:
+    """單一靜態檔案與其預先壓縮的版本。"""
+
+    __slots__ = ("name", "url", "media_type", "etags", "variants")
+
+    def __init__(self, name: str, content: bytes):
+        digest = hashlib.sha256(content).hexdigest()
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.url = f"{ASSET_URL_PREFIX}{stem}.{digest[:12]}{ext}"
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type.endswith("javascript"):
+            self.media_type += "; charset=utf-8"
+        self.variants: Dict[str, bytes] = {"identity": content}
+        self.variants["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(content, quality=11)
+        self.etags: Dict[str, str] = {
+            encoding: f'"{digest[:16]}"' if encoding == "identity" else f'"{digest[:16]}-{encoding}"'
+            for encoding in self.variants
+        }
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[str, bytes]:
+        """依 Accept-Encoding 選擇最小的可接受版本。"""
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, wildcard) > 0:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
+class StaticSite:
+    """index.html 範本與雜湊命名資源的快取。"""
+
+    def __init__(self, static_dir: str, asset_names: Sequence[str] = ("app.js", "style.css"), auto_reload: bool = False):
+        self.static_dir = static_dir
+        self.asset_names = list(asset_names)
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._mtimes: Optional[Dict[str, float]] = None
+        self._parts: List[str] = []
+        self._index: Optional[StaticAsset] = None
+        self._assets: Dict[str, StaticAsset] = {}
+        self._by_url: Dict[str, StaticAsset] = {}
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.static_dir, "index.html")
+
+    def _current_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for name in ["index.html", *self.asset_names]:
+            try:
+                mtimes[name] = os.stat(os.path.join(self.static_dir, name)).st_mtime
+            except OSError:
+                mtimes[name] = -1.0
+        return mtimes
+
+    def load(self) -> None:
+        """讀取範本與資源，建立雜湊網址與壓縮版本。"""
+        with self._lock:
+            mtimes = self._current_mtimes()
+            assets: Dict[str, StaticAsset] = {}
+            for name in self.asset_names:
+                try:
+                    with open(os.path.join(self.static_dir, name), "rb") as f:
+                        assets[name] = StaticAsset(name, f.read())
+                except OSError:
+                    logger.warning(f"找不到靜態資源: {name}")
+
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    html = f.read()
+            except FileNotFoundError:
+                html = "<h1>找不到 index.html 檔案</h1>"
+            for name, asset in assets.items():
+                html = html.replace(f"/static/{name}", asset.url)
+
+            self._assets = assets
+            self._by_url = {asset.url: asset for asset in assets.values()}
+            self._parts = html.split(NONCE_PLACEHOLDER)
+            # 含 nonce 的頁面每次內容不同，不提供驗證器；否則與資源一樣預先壓縮。
+            self._index = None if len(self._parts) > 1 else StaticAsset("index.html", html.encode("utf-8"))
+            self._mtimes = mtimes
+        logger.info(f"前端範本已載入 (assets: {', '.join(a.url for a in assets.values())})")
+
+    def _ensure_loaded(self) -> None:
+        if self._mtimes is None or (self.auto_reload and self._current_mtimes() != self._mtimes):
+            self.load()
+
+    @property
+    def index(self) -> Optional[StaticAsset]:
+        """不含 nonce 的 index.html（含各編碼版本與 ETag）；含 nonce 時為 None。"""
+        self._ensure_loaded()
+        return self._index
+
+    def render(self, nonce: str) -> str:
+        """以 nonce 填入預先切割的範本。"""
+        self._ensure_loaded()
+        return nonce.join(self._parts)
+
+    def asset(self, url_path: str) -> Optional[StaticAsset]:
+        """以雜湊網址（/assets/app.<hash>.js）查詢資源。"""
+        self._ensure_loaded()
+        return self._by_url.get(url_path)
@@ -0,0 +1,240 @@
+"""
+上游 LLM 串流管理
+
+將 Gemini 的同步串流迭代器包裝為可在事件迴圈中逐塊拉取的物件，
+並在客戶端斷線時立即中止上游呼叫，避免浪費配額、工作執行緒與上游連線。
+"""
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Protocol
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from starlette.types import Receive as ASGIReceive, Scope, Send
+import config
+from lib.metrics import STREAM_CHUNKS, STREAM_DURATION_SECONDS, STREAMS_CANCELLED_TOTAL
+from lib.utils import estimate_tokens
+from lib.tracing import start_stage
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class ChunkSource(Protocol):
+    """可逐塊拉取並可中止的上游串流（UpstreamPump 或 LLM 閘道的串流）。"""
+
+    usage_metadata: Any
+
+    async def next_chunk(self) -> Optional[Any]: ...
+
+    def close(self) -> None: ...
+
+
+class UpstreamPump:
+    """
+    逐塊拉取上游串流的包裝器。
+
+    每次 next_chunk() 只在執行緒池中執行一次 next()，因此事件迴圈可以在兩個區塊之間
+    決定是否繼續；close() 可從任何時間點呼叫，若此時仍有 next() 在執行中，
+    該次拉取完成後會立即關閉上游迭代器。
+    """
+
+    def __init__(self, open_stream: Callable[[], Iterable[Any]]):
+        self._open_stream = open_stream
+        self._iterator = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.usage_metadata: Any = None
+
+    def _pull(self) -> Any:
+        with self._lock:
+            if self._closed:
+                return _DONE
+            if self._iterator is None:
+                self._iterator = iter(self._open_stream())
+            chunk = next(self._iterator, _DONE)
+            if self._closed:
+                self._close_iterator()
+                return _DONE
+            return chunk
+
+    async def next_chunk(self) -> Optional[Any]:
+        """取得下一個上游區塊，串流結束時回傳 None。"""
+        chunk = await run_in_threadpool(self._pull)
+        if chunk is _DONE:
+            return None
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage is not None:
+            self.usage_metadata = usage
+        return chunk
+
+    def close(self) -> None:
+        """中止上游串流（可重複呼叫）。"""
+        self._closed = True
+        if self._lock.acquire(blocking=False):
+            try:
+                self._close_iterator()
+            finally:
+                self._lock.release()
+
+    def _close_iterator(self) -> None:
+        iterator, self._iterator = self._iterator, None
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                logger.debug(f"關閉上游串流時發生錯誤: {e}")
+
+
+class StreamStats:
+    """串流統計：完成數、取消數與估計節省的輸出 token。"""
+
+    def __init__(self, expected_output_tokens: int):
+        self._lock = threading.Lock()
+        self.completed_streams = 0
+        self.cancelled_streams = 0
+        self.tokens_saved = 0
+        self.avg_output_tokens = float(expected_output_tokens)
+
+    def record_completed(self, output_tokens: int) -> None:
+        with self._lock:
+            self.completed_streams += 1
+            # 以指數移動平均追蹤一般回覆長度，用於估算取消時節省的 token。
+            self.avg_output_tokens = 0.9 * self.avg_output_tokens + 0.1 * output_tokens
+
+    def record_cancelled(self, emitted_tokens: int) -> int:
+        with self._lock:
+            saved = max(0, int(self.avg_output_tokens) - emitted_tokens)
+            self.cancelled_streams += 1
+            self.tokens_saved += saved
+            return saved
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "completed_streams": self.completed_streams,
+                "cancelled_streams": self.cancelled_streams,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+stream_stats = StreamStats(expected_output_tokens=config.LLM_EXPECTED_OUTPUT_TOKENS)
+
+
+def _prompt_tokens(pump: ChunkSource) -> Optional[int]:
+    count = getattr(pump.usage_metadata, "prompt_token_count", None)
+    return count if isinstance(count, int) else None
+
+
+def _output_tokens(pump: ChunkSource, emitted_text: str) -> int:
+    """優先使用上游回報的 token 數，缺少時以文字估算。"""
+    count = getattr(pump.usage_metadata, "candidates_token_count", None)
+    if isinstance(count, int):
+        return count
+    return estimate_tokens(emitted_text)
+
+
+async def _wait_for_disconnect(receive: Receive) -> None:
+    while True:
+        message = await receive()
+        if message.get("type") == "http.disconnect":
+            return
+
+
+async def stream_upstream_text(
+    pump: ChunkSource,
+    receive: Receive,
+    on_complete: Optional[Callable[[str, float], Optional[Awaitable[None]]]] = None,
+    cancel_event: Optional[asyncio.Event] = None,
+    on_usage: Optional[Callable[[Optional[int], int], None]] = None,
+) -> AsyncIterator[str]:
+    """
+    將上游串流轉為文字區塊，並同時監聽 ASGI http.disconnect。
+
+    客戶端斷線或 cancel_event 被設定時立即停止等待並關閉上游串流；
+    正常結束時以完整文字與耗時呼叫 on_complete（可為同步函式或協程函式）。
+    不論結果為何，結束時都會以（上游回報的輸入 token 數或 None, 輸出 token 數）呼叫 on_usage。
+    """
+    started_at = time.perf_counter()
+    parts: list[str] = []
+    completed = False
+    cancelled = False
+    reason = "客戶端已斷線"
+    watchers = {asyncio.ensure_future(_wait_for_disconnect(receive))}
+    if cancel_event is not None:
+        watchers.add(asyncio.ensure_future(cancel_event.wait()))
+    span = start_stage("stream")
+    try:
+        while True:
+            pull_task = asyncio.ensure_future(pump.next_chunk())
+            done, _ = await asyncio.wait(
+                {pull_task, *watchers}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if pull_task not in done:
+                pull_task.cancel()
+                cancelled = True
+                if cancel_event is not None and cancel_event.is_set():
+                    reason = "串流已被取代"
+                break
+            chunk = pull_task.result()
+            if chunk is None:
+                completed = True
+                break
+            text = getattr(chunk, "text", None)
+            if text:
+                parts.append(text)
+                yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        cancelled = True
+        raise
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        pump.close()
+        emitted_text = "".join(parts)
+        outcome = "completed" if completed else "cancelled" if cancelled else "error"
+        if span is not None:
+            span.attributes.update({"outcome": outcome, "chunks": len(parts)})
+            span.end()
+        STREAM_DURATION_SECONDS.labels(outcome).observe(time.perf_counter() - started_at)
+        STREAM_CHUNKS.observe(len(parts))
+        if completed:
+            stream_stats.record_completed(_output_tokens(pump, emitted_text))
+        elif cancelled:
+            STREAMS_CANCELLED_TOTAL.inc()
+            saved = stream_stats.record_cancelled(_output_tokens(pump, emitted_text))
+            logger.info(f"{reason}，中止上游串流 (估計節省 {saved} tokens)")
+        if on_usage is not None:
+            try:
+                on_usage(_prompt_tokens(pump), _output_tokens(pump, emitted_text))
+            except Exception as e:
+                logger.error(f"記錄 token 用量失敗: {e}", exc_info=True)
+
+    if completed and on_complete is not None:
+        result = on_complete(emitted_text, time.perf_counter() - started_at)
+        if inspect.isawaitable(result):
+            await result
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """
+    串流結束（含例外與斷線）後必定呼叫 on_close 的 StreamingResponse。
+
+    單靠產生器的 finally 不足以保證釋放資源：若回應在開始迭代前就失敗，產生器本體永遠不會執行。
+    """
+
+    def __init__(self, content: Any, on_close: Callable[[], None], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: ASGIReceive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._on_close()
@@ -0,0 +1,238 @@
+"""
+請求追蹤
+
+- 每個請求建立一個 RequestTrace（request id、雜湊後的用戶、路由），透過 contextvars
+  傳遞到中間件、服務層與串流階段的每一筆日誌
+- trace_stage() 記錄各階段耗時，用於 Server-Timing 標頭與結束日誌
+- 設定 TRACE_EXPORT_PATH 時，以 OTLP/JSON 格式（與 OpenTelemetry Collector 的 file exporter 相同）
+  將 span 逐行寫入本機檔案
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def hash_user(code: str) -> str:
+    """以雜湊值取代存取代碼，日誌中不出現代碼本身。"""
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()[:12]
+
+
+class Span:
+    """單一階段的 span（時間以 epoch 奈秒記錄，與 OTLP 相同）。"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class RequestTrace:
+    """單一請求的追蹤狀態。"""
+
+    def __init__(self, method: str, path: str, request_id: Optional[str] = None, traceparent: Optional[str] = None):
+        parent_span_id = None
+        match = TRACEPARENT_PATTERN.match(traceparent or "")
+        if match:
+            self.trace_id, parent_span_id = match.group(1), match.group(2)
+        else:
+            self.trace_id = os.urandom(16).hex()
+        self.request_id = request_id if request_id and REQUEST_ID_PATTERN.match(request_id) else self.trace_id[:16]
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.user: Optional[str] = None
+        self.root = Span(f"{method} {path}", parent_span_id)
+        self.spans: List[Span] = []
+
+    def stage_timings(self) -> List[Span]:
+        return [span for span in self.spans if span.end_ns is not None]
+
+    def server_timing(self) -> str:
+        """組成 Server-Timing 標頭（同名階段累加）。"""
+        totals: Dict[str, float] = {}
+        for span in self.stage_timings():
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        entries = [f"{name};dur={duration:.1f}" for name, duration in totals.items()]
+        entries.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def log_fields(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "user": self.user,
+            "route": self.route or self.path,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def start_trace(trace: RequestTrace) -> contextvars.Token:
+    return _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+def bind_user(code: str) -> None:
+    """將雜湊後的用戶綁定到目前請求。"""
+    trace = current_trace()
+    if trace is not None and code:
+        trace.user = hash_user(code)
+
+
+def start_stage(name: str, **attributes: Any) -> Optional[Span]:
+    """開始一個階段並回傳其 span（呼叫端負責 end()）；不在請求中時回傳 None。"""
+    trace = current_trace()
+    if trace is None:
+        return None
+    span = Span(name, trace.root.span_id, attributes)
+    trace.spans.append(span)
+    return span
+
+
+@contextmanager
+def trace_stage(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """記錄一個階段的耗時；不在請求中時不做任何事。"""
+    span = start_stage(name, **attributes)
+    try:
+        yield span
+    finally:
+        if span is not None:
+            span.end()
+
+
+class RequestContextFilter(logging.Filter):
+    """將目前請求的 request id、用戶與路由加入每一筆日誌紀錄。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = current_trace()
+        fields = trace.log_fields() if trace is not None else {}
+        for key in ("request_id", "trace_id", "user", "route"):
+            if not hasattr(record, key):
+                setattr(record, key, fields.get(key))
+        return True
+
+
+_RESERVED_RECORD_KEYS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌輸出為一行 JSON；logger 的 extra 欄位會一併輸出。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_RECORD_KEYS and value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class SpanFileExporter:
+    """以 OTLP/JSON 格式將每個請求的 span 逐行附加到檔案。"""
+
+    def __init__(self, path: str, service_name: str = "taiko-advisor"):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def _encode_span(self, trace: RequestTrace, span: Span, attributes: Dict[str, Any]) -> Dict[str, Any]:
+        encoded = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 2 if span is trace.root else 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+            "attributes": [_attribute(k, v) for k, v in attributes.items() if v is not None],
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, trace: RequestTrace, status_code: Optional[int]) -> None:
+        root_attributes = {
+            "http.request.method": trace.method,
+            "url.path": trace.path,
+            "http.route": trace.route,
+            "http.response.status_code": status_code,
+            "enduser.id": trace.user,
+            "request.id": trace.request_id,
+        }
+        spans = [self._encode_span(trace, trace.root, root_attributes)]
+        spans += [self._encode_span(trace, span, span.attributes) for span in trace.spans]
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+                        "scopeSpans": [{"scope": {"name": "taiko-advisor"}, "spans": spans}],
+                    }
+                ]
+            },
+            ensure_ascii=False,
+        )
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+span_exporter: Optional[SpanFileExporter] = (
+    SpanFileExporter(config.TRACE_EXPORT_PATH) if config.TRACE_EXPORT_PATH else None
+)
+
@@ -1,3 +1,8 @@
 """
 工具函數模塊
 """
+from .tokens import estimate_tokens
+
+__all__ = [
+    "estimate_tokens",
+]
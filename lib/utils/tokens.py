@@ -0,0 +1,17 @@
+"""
+Token 數量估算
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文字的 token 數量。
+
+    Gemini 的分詞器對 ASCII 文字約 4 字元一個 token，中日文字約 1 字元一個 token，
+    此處依字元類型分別估算，足以用於統計與配額預估，不代表實際計費數字。
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return other_chars + (ascii_chars + 3) // 4
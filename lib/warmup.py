@@ -0,0 +1,195 @@
+"""
+啟動預熱
+
+部署後的第一批聊天請求會承擔延遲初始化的成本：SDK 匯入與客戶端建立、HNSW 索引從磁碟載入、
+嵌入模型的載入（匯入 torch 與讀入權重，冷啟動最大的成本）與第一次推論等。預熱在 init_resources 之後
+載入嵌入模型、以金絲雀查詢走過一次檢索與 prompt 構建，並預先讀入 ChromaDB 目錄下的索引檔，記錄每個步驟的耗時。
+
+就緒探測器會等預熱結束後才執行第一次探測，因此 /readyz 在預熱完成前維持 503；
+背景執行時 /livez 不受影響。單一步驟失敗只會記錄下來，不會中止其餘步驟。
+"""
+import asyncio
+import logging
+import mmap
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import config
+from lib.dependencies import get_all_songs, get_client, get_collection
+from lib.embeddings import query_encoder
+from lib.metrics import WARMUP_STEP_SECONDS
+from lib.services.chat_service import (
+    build_chat_prompt,
+    build_history_context,
+    build_profile_context,
+    build_songs_context,
+    get_candidate_songs,
+)
+from lib.songs import Song
+from lib.utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# prompt 構建步驟使用的代表性玩家設定。
+SAMPLE_PROFILE = {"name": "玩家", "level": "十段", "star_pref": "9星", "style": "綜合"}
+
+
+def pretouch_file(path: str) -> int:
+    """以 mmap 讀過檔案的每一個分頁，使其進入 page cache；回傳檔案大小。"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_WILLNEED)
+            for offset in range(0, size, mmap.PAGESIZE):
+                mm[offset]
+    return size
+
+
+def pretouch_directory(root: str) -> Tuple[int, int]:
+    """預先讀入目錄下的所有檔案，回傳 (檔案數, 位元組數)。"""
+    files = total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += pretouch_file(os.path.join(dirpath, name))
+                files += 1
+            except (OSError, ValueError) as e:
+                logger.debug(f"略過預讀 {name}: {e}")
+    return files, total
+
+
+class Warmup:
+    """依序執行預熱步驟並記錄各步驟耗時。"""
+
+    def __init__(self, canary_queries: List[str]):
+        self.canary_queries = canary_queries
+        self._chroma_path = ""
+        self._candidates: List[Song] = []
+        self._state = "pending"
+        self._started_at: Optional[float] = None
+        self._duration_ms: Optional[float] = None
+        self._steps: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._state == "running"
+
+    def start(self, chroma_path: str, background: bool = True) -> None:
+        """開始預熱；background 為 False 時在目前執行緒執行完才返回。"""
+        with self._lock:
+            if self.running:
+                return
+            self._chroma_path = chroma_path
+            self._state = "running"
+            self._started_at = time.time()
+            self._steps = {}
+        if background:
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+        else:
+            self._run()
+
+    async def wait(self, poll_interval: float = 0.05) -> None:
+        """等待預熱結束（未啟動預熱時立即返回）。"""
+        while self.running:
+            await asyncio.sleep(poll_interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "status": self._state,
+            "started_at": self._started_at,
+            "duration_ms": self._duration_ms,
+            "steps": dict(self._steps),
+        }
+
+    def _steps_to_run(self) -> List[Tuple[str, Callable[[], Optional[str]]]]:
+        return [
+            ("index_files", self._step_index_files),
+            ("chroma", self._step_chroma),
+            ("encoder_load", self._step_encoder_load),
+            ("encoder", self._step_encoder),
+            ("retrieval", self._step_retrieval),
+            ("prompt", self._step_prompt),
+            ("gemini", self._step_gemini),
+        ]
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        logger.info("開始啟動預熱")
+        self._candidates = []
+        for name, step in self._steps_to_run():
+            step_started = time.perf_counter()
+            result: Dict[str, Any] = {"ok": True}
+            try:
+                detail = step()
+                if detail:
+                    result["detail"] = detail
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            elapsed = time.perf_counter() - step_started
+            result["duration_ms"] = round(elapsed * 1000, 1)
+            WARMUP_STEP_SECONDS.labels(name).observe(elapsed)
+            self._steps[name] = result
+            if result["ok"]:
+                logger.info(f"預熱 {name}: {result['duration_ms']}ms")
+            else:
+                logger.warning(f"預熱 {name} 失敗 ({result['duration_ms']}ms): {result['error']}")
+        self._candidates = []
+        self._duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._state = "done"
+        logger.info(f"✅ 啟動預熱完成 ({self._duration_ms}ms)")
+
+    def _step_index_files(self) -> Optional[str]:
+        if not os.path.isdir(self._chroma_path):
+            return "找不到 ChromaDB 目錄，略過"
+        files, total = pretouch_directory(self._chroma_path)
+        return f"{files} 個檔案，{total / 1024 / 1024:.1f} MB"
+
+    def _step_chroma(self) -> Optional[str]:
+        if get_collection() is None:
+            raise RuntimeError("ChromaDB 未初始化")
+        return None
+
+    def _step_encoder_load(self) -> Optional[str]:
+        if not query_encoder.load():
+            return "未載入查詢編碼模型，由 ChromaDB 預設嵌入函式編碼"
+        return query_encoder.model_name
+
+    def _step_encoder(self) -> Optional[str]:
+        if not query_encoder.available:
+            return "未載入查詢編碼模型，略過"
+        query_encoder.encode(self.canary_queries)
+        return None
+
+    def _step_retrieval(self) -> Optional[str]:
+        collection = get_collection()
+        if collection is None:
+            return "ChromaDB 未初始化，略過"
+        # 不傳入歌曲清單：預熱不應觸發隨機抽樣的 fallback 與其計數。
+        for query in self.canary_queries:
+            self._candidates = get_candidate_songs(query, collection, None)
+        return f"{len(self.canary_queries)} 筆查詢，最後一筆取得 {len(self._candidates)} 首"
+
+    def _step_prompt(self) -> Optional[str]:
+        candidates = self._candidates or get_all_songs()[: config.CHROMA_QUERY_LIMIT]
+        songs_context = build_songs_context(candidates)
+        profile_context = build_profile_context(SAMPLE_PROFILE)
+        history_context = build_history_context([])
+        tokens = 0
+        for query in self.canary_queries:
+            tokens = estimate_tokens(build_chat_prompt(query, profile_context, history_context, songs_context))
+        return f"約 {tokens} tokens"
+
+    def _step_gemini(self) -> Optional[str]:
+        if get_client() is None:
+            raise RuntimeError("Gemini 客戶端未初始化")
+        return None
+
+
+warmup = Warmup(config.WARMUP_CANARY_QUERIES)
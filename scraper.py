@@ -1,167 +1,295 @@
-import requests
-from bs4 import BeautifulSoup
+"""
+wikiwiki.jp 歌曲列表爬蟲
+
+各類別頁面以共用連線池的 httpx.AsyncClient 並行抓取，由每個主機的禮貌排程控制
+（同時請求數上限、相鄰兩次請求開始的最小間隔與隨機抖動），取代每頁之後的固定等待。
+HTML 解析交給程序池，與其他頁面的網路等待重疊；連線錯誤、逾時與 429/5xx 以指數退避重試。
+
+--base-url 可指向本機的替身伺服器（例如以儲存的 HTML 離線測試，見 tests/test_scraper.py）。
+"""
+import argparse
+import asyncio
 import json
 import os
-import time
 import random
 import re
 import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+from bs4 import BeautifulSoup
 import config
+from lib.logging_setup import setup_logging
+
+# 視為暫時性錯誤而重試的狀態碼
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_AFTER_MAX_SECONDS = 60.0
+
+
+class FetchError(Exception):
+    """重試後仍無法取得頁面。"""
+
+
+class HostPoliteness:
+    """單一主機的禮貌排程：同時最多 max_in_flight 個請求，相鄰兩次請求開始至少間隔 min_delay + 抖動。"""
+
+    def __init__(self, max_in_flight: int, min_delay: float, jitter: float):
+        self.min_delay = min_delay
+        self.jitter = jitter
+        self._semaphore = asyncio.Semaphore(max(1, max_in_flight))
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._semaphore:
+            async with self._lock:
+                loop = asyncio.get_running_loop()
+                wait = self._next_start - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start = loop.time() + self.min_delay + random.uniform(0, self.jitter)
+            yield
+
+
+class PolitenessScheduler:
+    """依 URL 的主機分配各自的 HostPoliteness。"""
+
+    def __init__(self, max_in_flight: int, min_delay: float, jitter: float):
+        self.max_in_flight = max_in_flight
+        self.min_delay = min_delay
+        self.jitter = jitter
+        self._hosts: Dict[str, HostPoliteness] = {}
+
+    def slot(self, url: str):
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = HostPoliteness(self.max_in_flight, self.min_delay, self.jitter)
+        return self._hosts[host].slot()
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return min(float(response.headers["retry-after"]), RETRY_AFTER_MAX_SECONDS)
+    except (KeyError, ValueError):
+        return None
+
+
+async def fetch_page(
+    client: httpx.AsyncClient,
+    scheduler: PolitenessScheduler,
+    url: str,
+    max_retries: Optional[int] = None,
+    backoff: Optional[float] = None,
+) -> str:
+    """取得頁面內容；暫時性錯誤以指數退避重試（回應帶 Retry-After 時依其等待）。"""
+    max_retries = config.SCRAPER_MAX_RETRIES if max_retries is None else max_retries
+    backoff = config.SCRAPER_RETRY_BACKOFF_SECONDS if backoff is None else backoff
+    attempt = 0
+    while True:
+        retry_after = None
+        try:
+            async with scheduler.slot(url):
+                response = await client.get(url)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.text
+            error = f"HTTP {response.status_code}"
+            retry_after = _retry_after(response)
+        except httpx.TransportError as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if attempt >= max_retries:
+            raise FetchError(f"{url} 重試 {max_retries} 次後仍失敗 ({error})")
+        attempt += 1
+        delay = retry_after if retry_after is not None else backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+        print(f"請求失敗 ({error})，{delay:.1f} 秒後第 {attempt} 次重試: {url}")
+        await asyncio.sleep(delay)
+
+
+def parse_category_page(html: str, category: str, url: str) -> List[Dict]:
+    """解析類別頁面的歌曲表格（在解析程序池中執行）。"""
+    songs = []
+    # 類別內的流水號，與類別前綴組成歌曲 ID
+    counter = 1
+    prefix = config.CATEGORY_PREFIXES[category]
+
+    soup = BeautifulSoup(html, "html.parser")
+
+    # 抓取包含歌曲資料的超大表格
+    tables = soup.find_all("table")
+
+    # 尋找行數最多的表格（通常是資料表本身）
+    target_table = None
+    max_rows = 0
+    for table in tables:
+        rows = table.find_all("tr")
+        if len(rows) > max_rows:
+            max_rows = len(rows)
+            target_table = table
+
+    if not target_table or max_rows < 5:
+        print(f"找不到 {category} 包含資料的表格！")
+        return songs
+
+    rows = target_table.find_all("tr")
+
+    # 第一、二列通常是 Header，我們嘗試解析後續資料列
+    for row in rows[2:]:
+        cols = row.find_all(["td", "th"])
+        # Namco 表格通常有 9 欄: [日期, 收錄標記, 曲名, BPM, 簡單, 普通, 困難, 鬼, 裡鬼(若有)]
+        if len(cols) < 5:
+            continue
 
+        texts = [c.get_text(strip=True) for c in cols]
+
+        # 使用更強健的解析
+        title_cell_strings = (
+            list(cols[2].stripped_strings) if len(cols) > 2 else []
+        )
+        title = (
+            str(title_cell_strings[0]) if len(title_cell_strings) > 0 else ""
+        )
+        subtitle = (
+            " ".join([str(s) for s in title_cell_strings[1:]])
+            if len(title_cell_strings) > 1
+            else ""
+        )
+
+        # 忽略表頭或標題行，並過濾掉限定曲
+        if not title or title in ["曲名", category] or "【限定】" in title:
+            continue
 
-def scrape_taiko_wiki():
-    categories = config.TAIKO_CATEGORIES
-    base_url = config.TAIKO_WIKI_BASE_URL
-    headers = config.HTTP_HEADERS
+        # 解析 BPM，如實保留例如 "9.38?-150"
+        bpm = texts[3].strip() if len(texts) > 3 else "0"
+
+        # 解析鬼級難度
+        oni_star = 0
+        detail_url = ""
+        if len(cols) > 7:
+            oni_cell = cols[7]
+            oni_text = oni_cell.get_text(strip=True)
+            match_oni = re.search(r"(?:★[×x]?)?(\d+)", oni_text)
+            if match_oni:
+                oni_star = int(match_oni.group(1))
+
+            oni_link = oni_cell.find("a")
+            if oni_link:
+                href = oni_link.get("href")
+                if href:
+                    detail_url = urllib.parse.urljoin(url, str(href))
+
+        # 預設資料結構 - 表鬼
+        song = {
+            "id": prefix + counter,
+            "title": title,
+            "subtitle": subtitle,
+            "genre": category,  # 動態對應當前分類
+            "difficulty": {"oni": oni_star},
+            "bpm": bpm,
+            "detail_url": detail_url,
+            "features": [],
+            "description": f"這是由系統自動爬取自 wikiwiki.jp 的 {category} 資料。",
+        }
+        songs.append(song)
+        counter += 1
+
+        # 檢查裏譜面 (Ura) - 通常在 index 8
+        ura_oni_star = 0
+        ura_detail_url = ""
+        if len(cols) > 8:
+            ura_cell = cols[8]
+            ura_text = ura_cell.get_text(strip=True)
+
+            # 有些儲存格只有一個 "-"，過濾掉長度過短且沒有數字的狀況
+            if "★" in ura_text or any(c.isdigit() for c in ura_text):
+                match_ura = re.search(r"(?:★[×x]?)?(\d+)", ura_text)
+                if match_ura:
+                    ura_oni_star = int(match_ura.group(1))
+
+                    ura_link = ura_cell.find("a")
+                    if ura_link:
+                        ura_href = ura_link.get("href")
+                        if ura_href:
+                            ura_detail_url = urllib.parse.urljoin(
+                                url, str(ura_href)
+                            )
+
+                    # 如果有裏譜面，新增一首獨立的條目
+                    ura_song = {
+                        "id": prefix + counter,
+                        "title": title + " (Inner Oni)",
+                        "subtitle": subtitle,
+                        "genre": category,
+                        "difficulty": {"oni": ura_oni_star},
+                        "bpm": bpm,
+                        "detail_url": ura_detail_url,
+                        "features": ["Inner Oni"],
+                        "description": f"這是由系統自動爬取自 wikiwiki.jp 的 {category} (Inner Oni) 資料。",
+                    }
+                    songs.append(ura_song)
+                    counter += 1
 
-    songs = []
+    return songs
 
-    category_prefixes = config.CATEGORY_PREFIXES
 
-    # 用字典記錄每個類別目前的計數器
-    category_counters = {k: 1 for k in categories}
+async def scrape_category(
+    client: httpx.AsyncClient,
+    scheduler: PolitenessScheduler,
+    executor: Optional[ProcessPoolExecutor],
+    category: str,
+    base_url: str,
+) -> List[Dict]:
+    url = base_url + urllib.parse.quote(category)
+    print(f"正在請求與解析 wikiwiki.jp 歌曲列表 ({category})...")
+    html = await fetch_page(client, scheduler, url)
+    loop = asyncio.get_running_loop()
+    songs = await loop.run_in_executor(executor, parse_category_page, html, category, url)
+    print(f"成功從 {category} 爬取資料！共 {len(songs)} 首曲目。")
+    return songs
 
-    for category in categories:
-        encoded_category = urllib.parse.quote(category)
-        url = base_url + encoded_category
-        print(f"正在請求與解析 wikiwiki.jp 歌曲列表 ({category})...")
 
-        try:
-            response = requests.get(url, headers=headers, timeout=config.HTTP_TIMEOUT)
-            response.raise_for_status()
-
-            # 加上隨機延遲保護伺服器
-            delay = random.uniform(config.HTTP_DELAY_MIN, config.HTTP_DELAY_MAX)
-            print(f"等待 {delay:.2f} 秒再進行後續動作...")
-            time.sleep(delay)
-
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            # 抓取包含歌曲資料的超大表格
-            tables = soup.find_all("table")
-
-            # 尋找行數最多的表格（通常是資料表本身）
-            target_table = None
-            max_rows = 0
-            for table in tables:
-                rows = table.find_all("tr")
-                if len(rows) > max_rows:
-                    max_rows = len(rows)
-                    target_table = table
-
-            if not target_table or max_rows < 5:
-                print(f"找不到 {category} 包含資料的表格！")
-                continue
-
-            rows = target_table.find_all("tr")
-
-            # 第一、二列通常是 Header，我們嘗試解析後續資料列
-            for row in rows[2:]:
-                cols = row.find_all(["td", "th"])
-                # Namco 表格通常有 9 欄: [日期, 收錄標記, 曲名, BPM, 簡單, 普通, 困難, 鬼, 裡鬼(若有)]
-                if len(cols) < 5:
-                    continue
-
-                texts = [c.get_text(strip=True) for c in cols]
-
-                # 使用更強健的解析
-                title_cell_strings = (
-                    list(cols[2].stripped_strings) if len(cols) > 2 else []
-                )
-                title = (
-                    str(title_cell_strings[0]) if len(title_cell_strings) > 0 else ""
-                )
-                subtitle = (
-                    " ".join([str(s) for s in title_cell_strings[1:]])
-                    if len(title_cell_strings) > 1
-                    else ""
-                )
-
-                # 忽略表頭或標題行，並過濾掉限定曲
-                if not title or title in ["曲名", category] or "【限定】" in title:
-                    continue
-
-                # 解析 BPM，如實保留例如 "9.38?-150"
-                bpm = texts[3].strip() if len(texts) > 3 else "0"
-
-                # 解析鬼級難度
-                oni_star = 0
-                detail_url = ""
-                if len(cols) > 7:
-                    oni_cell = cols[7]
-                    oni_text = oni_cell.get_text(strip=True)
-                    match_oni = re.search(r"(?:★[×x]?)?(\d+)", oni_text)
-                    if match_oni:
-                        oni_star = int(match_oni.group(1))
-
-                    oni_link = oni_cell.find("a")
-                    if oni_link:
-                        href = oni_link.get("href")
-                        if href:
-                            detail_url = urllib.parse.urljoin(url, str(href))
-
-                # 預設資料結構 - 表鬼
-                song = {
-                    "id": category_prefixes[category] + category_counters[category],
-                    "title": title,
-                    "subtitle": subtitle,
-                    "genre": category,  # 動態對應當前分類
-                    "difficulty": {"oni": oni_star},
-                    "bpm": bpm,
-                    "detail_url": detail_url,
-                    "features": [],
-                    "description": f"這是由系統自動爬取自 wikiwiki.jp 的 {category} 資料。",
-                }
-                songs.append(song)
-                category_counters[category] += 1
-
-                # 檢查裏譜面 (Ura) - 通常在 index 8
-                ura_oni_star = 0
-                ura_detail_url = ""
-                if len(cols) > 8:
-                    ura_cell = cols[8]
-                    ura_text = ura_cell.get_text(strip=True)
-
-                    # 有些儲存格只有一個 "-"，過濾掉長度過短且沒有數字的狀況
-                    if "★" in ura_text or any(c.isdigit() for c in ura_text):
-                        match_ura = re.search(r"(?:★[×x]?)?(\d+)", ura_text)
-                        if match_ura:
-                            ura_oni_star = int(match_ura.group(1))
-
-                            ura_link = ura_cell.find("a")
-                            if ura_link:
-                                ura_href = ura_link.get("href")
-                                if ura_href:
-                                    ura_detail_url = urllib.parse.urljoin(
-                                        url, str(ura_href)
-                                    )
-
-                            # 如果有裏譜面，新增一首獨立的條目
-                            ura_song = {
-                                "id": category_prefixes[category]
-                                + category_counters[category],
-                                "title": title + " (Inner Oni)",
-                                "subtitle": subtitle,
-                                "genre": category,
-                                "difficulty": {"oni": ura_oni_star},
-                                "bpm": bpm,
-                                "detail_url": ura_detail_url,
-                                "features": ["Inner Oni"],
-                                "description": f"這是由系統自動爬取自 wikiwiki.jp 的 {category} (Inner Oni) 資料。",
-                            }
-                            songs.append(ura_song)
-                            category_counters[category] += 1
-
-            print(f"成功從 {category} 爬取資料！累計 {len(songs)} 首曲目。")
-
-        except Exception as e:
-            print(f"爬取 {category} 分類時發生錯誤: {e}")
+async def scrape_categories(
+    categories: Optional[List[str]] = None,
+    base_url: Optional[str] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+    parse_workers: Optional[int] = None,
+) -> List[Dict]:
+    """並行爬取各類別頁面，依類別順序回傳歌曲；單一類別失敗時略過該類別。"""
+    parse_workers = config.SCRAPER_PARSE_WORKERS if parse_workers is None else parse_workers
+    categories = categories or config.TAIKO_CATEGORIES
+    base_url = base_url or config.TAIKO_WIKI_BASE_URL
+    scheduler = scheduler or PolitenessScheduler(
+        config.SCRAPER_MAX_IN_FLIGHT_PER_HOST, config.SCRAPER_MIN_DELAY_SECONDS, config.SCRAPER_JITTER_SECONDS
+    )
+    limits = httpx.Limits(max_connections=max(1, scheduler.max_in_flight))
+
+    # parse_workers 為 0 時在事件迴圈的預設執行緒池解析
+    with ProcessPoolExecutor(parse_workers) if parse_workers > 0 else nullcontext() as executor:
+        async with httpx.AsyncClient(
+            headers=config.HTTP_HEADERS, timeout=config.HTTP_TIMEOUT, limits=limits, follow_redirects=True
+        ) as client:
+            results = await asyncio.gather(
+                *(scrape_category(client, scheduler, executor, category, base_url) for category in categories),
+                return_exceptions=True,
+            )
+
+    songs = []
+    for category, result in zip(categories, results):
+        if isinstance(result, Exception):
+            print(f"爬取 {category} 分類時發生錯誤: {result}")
             continue
+        songs.extend(result)
 
     print(f"總共成功爬取到 {len(songs)} 首基礎曲目資料！")
     return songs
 
 
+def scrape_taiko_wiki(**kwargs) -> List[Dict]:
+    return asyncio.run(scrape_categories(**kwargs))
+
+
 def merge_and_save(new_songs, db_path=None):
     if db_path is None:
         db_path = config.SONGS_DB_PATH
@@ -214,6 +342,12 @@ def merge_and_save(new_songs, db_path=None):
 
 
 if __name__ == "__main__":
-    scraped = scrape_taiko_wiki()
+    parser = argparse.ArgumentParser(description="爬取 wikiwiki.jp 的歌曲列表並合併到 songs.json")
+    parser.add_argument("--base-url", default=config.TAIKO_WIKI_BASE_URL, help="類別頁面的網址前綴")
+    parser.add_argument("--output", default=config.SONGS_DB_PATH, help="合併寫入的 songs.json")
+    args = parser.parse_args()
+
+    setup_logging()
+    scraped = scrape_taiko_wiki(base_url=args.base_url)
     if scraped:
-        merge_and_save(scraped)
+        merge_and_save(scraped, args.output)
@@ -10,6 +10,7 @@ lib/
   ├── services/      # 業務邏輯服務
   │   ├── user_service.py
   │   └── chat_service.py
+  ├── middleware/    # ASGI 中間件（安全標頭、請求體積限制、回應壓縮）
   └── utils/         # 工具函數
 
 api/                 # API 路由
@@ -23,28 +24,42 @@ api/                 # API 路由
       └── route.py
 """
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, Request
 from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 import uvicorn
 import os
+import sys
 import json
 import logging
 from uuid import uuid4
 
 import config
-from lib.dependencies import init_resources, cleanup_resources
+from lib.dependencies import init_resources, cleanup_resources, get_client, get_all_songs, resource_watcher
+from lib.admission import admission_controller
+from lib.health import readiness_prober
+from lib.services.quota_service import quota_service
+from lib.llm_gateway import llm_gateway
+from lib.metrics import RATE_LIMIT_REJECTIONS_TOTAL, render_metrics
 from lib.exceptions import TaikoAdvisorException
 from lib.rate_limiter import limiter
+from lib.middleware import (
+    CompressionMiddleware,
+    LimitRequestSizeMiddleware,
+    RateLimitMiddleware,
+    SecurityHeadersMiddleware,
+    TracingMiddleware,
+)
+from lib.logging_setup import setup_logging, shutdown_logging
+from lib.static_assets import ASSET_URL_PREFIX, IMMUTABLE_CACHE_CONTROL, StaticAsset, StaticSite, etag_matches
 from api.login.route import router as login_router
 from api.profile.route import router as profile_router
 from api.sessions.route import router as sessions_router
 from api.chat.route import router as chat_router
+from api.admin.route import require_admin, router as admin_router
 
 logger = logging.getLogger(__name__)
 
@@ -52,22 +67,37 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """應用程式生命週期管理"""
+    setup_logging()
     # 啟動時初始化資源
     logger.info("啟動 Taiko AI Advisor...")
+    if config.VALIDATE_CONFIG:
+        try:
+            config.validate_config()
+        except ValueError as e:
+            # 記錄配置錯誤但允許應用繼續啟動
+            logger.error(str(e))
     init_resources(
         gemini_key=config.GEMINI_API_KEY or "",
         chroma_path=config.CHROMA_DB_PATH,
         collection_name=config.CHROMA_COLLECTION_NAME,
         songs_path=config.SONGS_DB_PATH,
     )
+    static_site.load()
+    readiness_prober.start()
+    quota_service.start()
+    resource_watcher.start()
     logger.info("資源初始化完成")
     
     yield
     
     # 應用關閉時的資源清理
     logger.info("清理資源...")
+    await readiness_prober.stop()
+    await quota_service.stop()
+    await resource_watcher.stop()
     cleanup_resources()
     logger.info("Taiko AI Advisor 已關閉")
+    shutdown_logging()
 
 # 初始化 FastAPI 應用
 app = FastAPI(
@@ -90,7 +120,8 @@ app = FastAPI(
         {"name": "auth", "description": "認證相關端點"},
         {"name": "profile", "description": "用戶個人資料管理"},
         {"name": "sessions", "description": "對話歷史管理"},
-        {"name": "chat", "description": "AI 聊天與推薦"}
+        {"name": "chat", "description": "AI 聊天與推薦"},
+        {"name": "admin", "description": "管理端點（需 ADMIN_TOKEN）"}
     ]
 )
 
@@ -101,6 +132,9 @@ app.state.limiter = limiter
 async def rate_limit_handler(request: Request, exc: Exception) -> Response:
     """處理速率限制異常"""
     error_id = str(uuid4())[:8].upper()
+    # 以路由樣板作為標籤，避免路徑參數造成標籤數量無限增長。
+    route_path = getattr(request.scope.get("route"), "path", request.url.path)
+    RATE_LIMIT_REJECTIONS_TOTAL.labels(route_path).inc()
     logger.warning(f"[{error_id}] Rate limit exceeded for {request.client.host if request.client else 'unknown'} (path: {request.url.path})")
     return Response(
         content=json.dumps({
@@ -117,12 +151,14 @@ async def rate_limit_handler(request: Request, exc: Exception) -> Response:
 async def taiko_exception_handler(request: Request, exc: TaikoAdvisorException):
     """處理自定義異常"""
     logger.warning(f"[{exc.error_id}] {exc.__class__.__name__}: {exc.message} (path: {request.url.path})")
+    retry_after = getattr(exc, "retry_after", None)
     return JSONResponse(
         status_code=exc.status_code,
         content={
             "error": exc.message,
             "error_id": exc.error_id
-        }
+        },
+        headers={"Retry-After": str(retry_after)} if retry_after else None,
     )
 
 @app.exception_handler(Exception)
@@ -139,70 +175,22 @@ async def general_exception_handler(request: Request, exc: Exception):
     )
 
 
-# 安全中間件
-class LimitRequestSizeMiddleware(BaseHTTPMiddleware):
-    """限制請求體積大小"""
-    async def dispatch(self, request: Request, call_next):
-        if request.method in ["POST", "PUT", "PATCH"]:
-            content_length = request.headers.get("content-length")
-            if content_length:
-                try:
-                    content_length_value = int(content_length)
-                except (ValueError, OverflowError):
-                    logger.warning(f"無效的 Content-Length 標頭: {content_length!r} (path: {request.url.path})")
-                    return JSONResponse(
-                        status_code=400,
-                        content={"error": "無效的 Content-Length 標頭"}
-                    )
-                # 先做標頭合理值檢查（0~10MB），再套用實際業務上限（config.MAX_REQUEST_SIZE）。
-                if not (0 <= content_length_value <= 10 * 1024 * 1024):
-                    logger.warning(f"Content-Length 超出合理範圍: {content_length_value} (path: {request.url.path})")
-                    return JSONResponse(
-                        status_code=400,
-                        content={"error": "Content-Length 必須在 0 到 10MB 之間"}
-                    )
-                if content_length_value > config.MAX_REQUEST_SIZE:
-                    logger.warning(f"請求體積過大: {content_length_value} bytes (path: {request.url.path})")
-                    return JSONResponse(
-                        status_code=413,
-                        content={"error": "請求體積過大，上限為 1MB"}
-                    )
-        return await call_next(request)
-
-app.add_middleware(LimitRequestSizeMiddleware)
-app.add_middleware(SlowAPIMiddleware)
-
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    """添加安全 HTTP Headers。
-    
-    安全說明：
-    - 外部腳本（CDN）：允許加載
-    - 內聯腳本：使用 nonce 機制保護
-    - 內聯樣式：使用 'unsafe-inline'（可考慮未來改用 nonce）
-    """
-    # 為此請求生成唯一的 CSP nonce
-    nonce = str(uuid4())[:12]
-    request.state.csp_nonce = nonce
-    
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    
-    # 使用 nonce 保護內聯腳本，CDN 來源由 config 統一管理。
-    response.headers["Content-Security-Policy"] = (
-        "default-src 'self'; "
-        f"script-src 'self' 'nonce-{nonce}' {config.CDN_MARKED_JS} {config.CDN_DOMPURIFY_JS}; "
-        "style-src 'self' 'unsafe-inline'; "
-        "img-src 'self' data: https:; "
-        "font-src 'self' https:; "
-        "connect-src 'self' https://cdn.jsdelivr.net https://generativelanguage.googleapis.com; "
-        "base-uri 'self'; "
-        "form-action 'self'"
+# 回應壓縮（最內層，串流回應逐塊 flush）
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+        gzip_level=config.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=config.COMPRESSION_BROTLI_QUALITY,
     )
-    return response
+
+# 安全中間件（原生 ASGI；加入順序與先前的 BaseHTTPMiddleware 堆疊相同）
+app.add_middleware(LimitRequestSizeMiddleware, max_size=config.MAX_REQUEST_SIZE)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(SecurityHeadersMiddleware)
+
+# 請求追蹤（request id、Server-Timing、結構化日誌上下文）
+app.add_middleware(TracingMiddleware)
 
 
 # CORS 中間件
@@ -234,6 +222,9 @@ if not DEBUG:
 os.makedirs(config.STATIC_DIR, exist_ok=True)
 app.mount("/static", StaticFiles(directory=config.STATIC_DIR), name="static")
 
+# 前端範本與雜湊命名資源（DEBUG 時依 mtime 自動重新載入）
+static_site = StaticSite(config.STATIC_DIR, auto_reload=DEBUG)
+
 
 # 註冊 API 路由
 # /api/login
@@ -248,52 +239,99 @@ app.include_router(sessions_router, prefix="/api/sessions", tags=["sessions"])
 # /api/chat 和 /api/logout
 app.include_router(chat_router, prefix="/api", tags=["chat"])
 
+# /api/admin（未設定 ADMIN_TOKEN 時回傳 404）
+app.include_router(admin_router, prefix="/api/admin", tags=["admin"])
+
 
 # 主頁路由
 @app.get("/", response_class=HTMLResponse)
 async def serve_index(request: Request):
     """
     提供前端 HTML。
-    此端點會讀取並回傳靜態目錄中的 index.html 檔案，
-    並將其中的 {CSP_NONCE} 佔位符替換為 request.state.csp_nonce 以注入 CSP nonce。
+    範本於啟動時載入並以 {CSP_NONCE} 預先切割，渲染時填入 request.state.csp_nonce。
+    範本不含 nonce 時回傳預先壓縮的版本與該版本的 ETag 並支援 304；含 nonce 時每次內容不同，禁止快取。
     """
-    try:
-        index_path = os.path.join(config.STATIC_DIR, "index.html")
-        with open(index_path, "r", encoding="utf-8") as f:
-            html_content = f.read()
-            html_content = html_content.replace("{CSP_NONCE}", request.state.csp_nonce)
-        
-        return html_content
-    except FileNotFoundError:
-        return "<h1>找不到 index.html 檔案</h1>"
+    index = static_site.index
+    if index is None:
+        return HTMLResponse(
+            static_site.render(request.state.csp_nonce),
+            headers={"Cache-Control": "no-store"},
+        )
+    return _serve_static(index, request, "no-cache")
+
+
+def _serve_static(asset: StaticAsset, request: Request, cache_control: str) -> Response:
+    """依 Accept-Encoding 選擇版本，以該版本的 ETag 處理 If-None-Match。"""
+    encoding, body = asset.select(request.headers.get("accept-encoding"))
+    etag = asset.etags[encoding]
+    headers = {"Cache-Control": cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
+
+
+@app.get(ASSET_URL_PREFIX + "{asset_name}")
+@limiter.exempt
+async def serve_asset(asset_name: str, request: Request):
+    """提供雜湊命名的靜態資源，依 Accept-Encoding 回傳預先壓縮的版本。"""
+    asset = static_site.asset(ASSET_URL_PREFIX + asset_name)
+    if asset is None:
+        return JSONResponse(status_code=404, content={"error": "找不到資源"})
+    return _serve_static(asset, request, IMMUTABLE_CACHE_CONTROL)
+
+
+@app.get("/livez")
+@limiter.exempt
+async def liveness_check():
+    """存活檢查：常數時間，不做任何 I/O。"""
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+@limiter.exempt
+async def readiness_check():
+    """就緒檢查：回傳背景探測器的快取結果，尚未就緒時回傳 503。"""
+    result = readiness_prober.snapshot()
+    status_code = 200 if result["status"] in ("ready", "degraded") else 503
+    return JSONResponse(status_code=status_code, content=result)
+
+
+@app.get("/metrics")
+async def metrics(authorization: str = Header(None)):
+    """Prometheus 指標（文字格式，Authorization: Bearer <ADMIN_TOKEN>；未設定 ADMIN_TOKEN 時回傳 404）"""
+    require_admin(authorization)
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
 
 
 @app.get("/health")
 async def health_check():
-    """健康檢查端點"""
-    from lib.dependencies import get_client, get_collection, get_all_songs
-    import sys
-    
-    client = get_client()
-    collection = get_collection()
+    """健康檢查端點（舊版格式，內容取自就緒探測的快取結果）"""
+    probe = readiness_prober.snapshot()
+    probe_checks = probe["checks"]
     all_songs = get_all_songs()
     
     # 檢查核心依賴
     checks = {
-        "gemini": client is not None,
-        "chromadb": collection is not None,
+        "gemini": get_client() is not None,
+        "chromadb": probe_checks.get("chromadb", {}).get("ok", False),
         "songs_loaded": len(all_songs) > 0,
-        "user_db_writable": os.access(config.USERS_DB_PATH, os.W_OK) if os.path.exists(config.USERS_DB_PATH) else True
+        "user_db_writable": probe_checks.get("user_store", {}).get("ok", False),
     }
     
-    all_healthy = all(checks.values())
+    all_healthy = probe["status"] == "ready" and all(checks.values())
     
     return {
         "status": "healthy" if all_healthy else "degraded",
         "version": "2.0",
         "python_version": f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
         "checks": checks,
-        "songs_count": len(all_songs)
+        "songs_count": len(all_songs),
+        "readiness": probe,
+        "llm_admission": admission_controller.snapshot(),
+        "llm_models": llm_gateway.snapshot(),
     }
 
 
@@ -7,6 +7,8 @@ const toastContainer = document.getElementById('toast-container');
 
 let accessCode = localStorage.getItem('access_code');
 let chatContext = [];
+// 伺服器端對話 ID（由 /api/chat 的 X-Session-Id 回應標頭取得）
+let sessionId = null;
 let currentSessions = [];
 
 function showToast(message, type = 'info', duration = 3200) {
@@ -245,6 +247,7 @@ function renderSessions() {
 
 function startNewChat() {
     chatContext = [];
+    sessionId = null;
     chatHistory.innerHTML = `
         <div class="message-wrapper bot-message">
             <div class="message-bubble">
@@ -256,6 +259,8 @@ function startNewChat() {
 
 function loadChat(session) {
     chatContext = session.messages || [];
+    // 伺服器會以已儲存對話的內容接續，不需再送出整段歷史
+    sessionId = session.id;
     chatHistory.innerHTML = '';
     chatContext.forEach(msg => {
         appendMessage(msg.role, msg.content, false);
@@ -288,7 +293,8 @@ async function saveCurrentSession() {
         showErrorMessage('對話內容太空，不需要儲存喔！');
         return;
     }
-    if (currentSessions.length >= 3) {
+    const alreadySaved = currentSessions.some(s => s.id === sessionId);
+    if (!alreadySaved && currentSessions.length >= 3) {
         showErrorMessage('儲存空間已滿 (最多3筆)，請先刪除舊的對話。');
         return;
     }
@@ -307,7 +313,7 @@ async function saveCurrentSession() {
                 'Content-Type': 'application/json',
                 'Authorization': `Bearer ${accessCode}`
             },
-            body: JSON.stringify({ title, messages: chatContext })
+            body: JSON.stringify(sessionId ? { title, session_id: sessionId } : { title, messages: chatContext })
         });
 
         if (res.ok) {
@@ -386,15 +392,27 @@ async function sendMessage() {
         statusIndicator.style.backgroundColor = '#ff9e64'; // 黃色 Loading 狀態
         statusIndicator.style.boxShadow = '0 0 10px #ff9e64';
 
-        const response = await fetch('/api/chat', {
+        const postChat = (payload) => fetch('/api/chat', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'Authorization': `Bearer ${accessCode}`
             },
-            body: JSON.stringify({ message: message, history: historyToSend })
+            body: JSON.stringify(payload)
         });
 
+        // 有伺服器端對話時只送出新訊息；對話已失效 (404) 才退回送出完整歷史
+        let response = sessionId
+            ? await postChat({ message: message, session_id: sessionId })
+            : await postChat({ message: message, history: historyToSend });
+        if (response.status === 404 && sessionId) {
+            sessionId = null;
+            response = await postChat({ message: message, history: historyToSend });
+        }
+        if (response.headers.get('X-Session-Id')) {
+            sessionId = response.headers.get('X-Session-Id');
+        }
+
         hide(typingIndicator);
 
         if (response.status === 401) {
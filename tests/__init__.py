@@ -8,5 +8,26 @@ Taiko AI Advisor 單元測試模塊
 - test_services.py: 業務邏輯服務測試
 - test_api.py: API 端點測試
 - test_validators.py: 輸入驗證測試
+- test_answer_cache.py: 答案快取測試
+- test_streaming.py: 上游串流中止測試
+- test_admission.py: LLM 准入控制測試
+- test_llm_gateway.py: LLM 閘道（模型級聯、斷路器）測試
+- test_middleware.py: ASGI 中間件（安全標頭、請求體積限制、回應壓縮）測試
+- test_static_assets.py: 前端範本與靜態資源快取測試
+- test_health.py: 存活與就緒檢查測試
+- test_metrics.py: Prometheus 指標測試
+- test_tracing.py: 請求追蹤與結構化日誌測試
+- test_logging_setup.py: 非阻塞日誌佇列與輪替測試
+- test_rate_limit.py: 速率限制儲存後端與鍵函式測試
+- test_quota.py: token 用量配額測試
+- test_prefork.py: pre-fork 啟動器與共用資料測試
+- test_import_time.py: 匯入時間與匯入副作用測試
+- test_warmup.py: 啟動預熱測試
+- test_resource_reload.py: 資源熱重新載入測試
+- test_chroma_versions.py: ChromaDB 版本化集合測試
+- test_embedding_cache.py: 嵌入向量快取測試
+- test_songs.py: 歌曲資料模型測試
+- test_song_snapshot.py: 歌曲二進位快照測試
+- test_scraper.py: 爬蟲離線測試（儲存的 HTML 與本機替身伺服器）
 - conftest.py: pytest 配置和 fixtures
 """
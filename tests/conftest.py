@@ -7,6 +7,13 @@ import pytest
 import tempfile
 import os
 
+# 測試使用程序內的速率限制計數與暫存的配額檔案、對話目錄，不寫入 data/。
+_TEST_DATA_DIR = tempfile.mkdtemp(prefix="taiko-test-")
+os.environ.setdefault("RATE_LIMIT_STORAGE_URI", "memory://")
+os.environ.setdefault("QUOTA_STORAGE_PATH", os.path.join(_TEST_DATA_DIR, "quota.db"))
+os.environ.setdefault("CONVERSATIONS_DIR", os.path.join(_TEST_DATA_DIR, "conversations"))
+# 不載入（或下載）查詢編碼模型；需要時各測試自行替換 query_encoder.encode。
+os.environ.setdefault("QUERY_ENCODER_ENABLED", "false")
 
 
 @pytest.fixture
@@ -0,0 +1,121 @@
+"""
+LLM 准入控制單元測試
+
+測試 lib.admission 的併發上限、等待佇列、逾時與每個存取代碼的取代機制。
+"""
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from lib.admission import AdmissionController
+from lib.exceptions import ServiceUnavailableError
+
+
+class TestAdmissionController:
+    """AdmissionController 行為測試"""
+
+    def test_queued_request_admitted_after_release(self):
+        async def run():
+            controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1.0)
+            first = await controller.admit("user-a")
+            waiting = asyncio.ensure_future(controller.admit("user-b"))
+            await asyncio.sleep(0.05)
+            assert controller.snapshot()["queued"] == 1
+            first.release()
+            second = await waiting
+            assert second.wait_seconds >= 0.04
+            snapshot = controller.snapshot()
+            assert snapshot["active"] == 1
+            assert snapshot["queued"] == 0
+            second.release()
+            assert controller.snapshot()["active"] == 0
+
+        asyncio.run(run())
+
+    def test_full_queue_rejected_with_retry_after(self):
+        async def run():
+            controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1.0)
+            await controller.admit("user-a")
+            with pytest.raises(ServiceUnavailableError) as exc_info:
+                await controller.admit("user-b")
+            assert exc_info.value.status_code == 503
+            assert exc_info.value.retry_after >= 1
+            assert controller.snapshot()["rejected"] == 1
+
+        asyncio.run(run())
+
+    def test_queue_timeout_rejected(self):
+        async def run():
+            controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+            await controller.admit("user-a")
+            with pytest.raises(ServiceUnavailableError):
+                await controller.admit("user-b")
+            assert controller.snapshot()["queued"] == 0
+
+        asyncio.run(run())
+
+    def test_new_message_preempts_active_generation(self):
+        async def run():
+            controller = AdmissionController(max_concurrent=2, max_queue=4, queue_timeout=1.0)
+            first = await controller.admit("user-a")
+            second = await controller.admit("user-a")
+            assert first.cancelled.is_set()
+            assert not second.cancelled.is_set()
+            first.release()
+            second.release()
+            assert controller.snapshot()["active"] == 0
+            assert controller.snapshot()["preempted"] == 1
+
+        asyncio.run(run())
+
+    def test_new_message_preempts_queued_request(self):
+        async def run():
+            controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1.0)
+            holder = await controller.admit("user-a")
+            queued = asyncio.ensure_future(controller.admit("user-b"))
+            await asyncio.sleep(0.01)
+            replacement = asyncio.ensure_future(controller.admit("user-b"))
+            with pytest.raises(ServiceUnavailableError):
+                await queued
+            holder.release()
+            ticket = await replacement
+            ticket.release()
+            assert controller.snapshot()["active"] == 0
+
+        asyncio.run(run())
+
+
+class TestChatAdmission:
+    """聊天端點准入測試"""
+
+    def test_chat_returns_503_with_retry_after(self, monkeypatch):
+        from server import app
+        from api.chat import route as chat_route
+        from lib.rate_limiter import limiter
+
+        class FakeClient:
+            models = None
+
+        monkeypatch.setattr(chat_route, "validate_token", lambda code: True)
+        monkeypatch.setattr(chat_route, "get_user_profile", lambda code: None)
+        monkeypatch.setattr(chat_route.config, "ANSWER_CACHE_ENABLED", False)
+        monkeypatch.setattr(
+            chat_route,
+            "admission_controller",
+            AdmissionController(max_concurrent=0, max_queue=0, queue_timeout=0.1),
+        )
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+        limiter._storage.reset()
+        try:
+            response = TestClient(app).post(
+                "/api/chat",
+                json={"message": "hello", "history": []},
+                headers={"Authorization": "Bearer test-code"},
+            )
+        finally:
+            app.dependency_overrides.clear()
+            limiter._storage.reset()
+
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert "error_id" in response.json()
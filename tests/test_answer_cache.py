@@ -0,0 +1,131 @@
+"""
+答案快取單元測試
+
+測試 lib.services.answer_cache 的鍵值建立、淘汰、相似度比對與依資源快照版本失效。
+"""
+import asyncio
+import time
+from lib.services.answer_cache import (
+    SIMILARITY_CANDIDATES_PER_CONTEXT,
+    AnswerCache,
+    build_cache_key,
+    normalize_message,
+    replay_answer,
+)
+from lib.songs import Song
+
+
+SONGS = [Song(id=100001, title="A"), Song(id=100002, title="B")]
+PROFILE = {"name": "測試玩家", "level": "十段"}
+
+
+class TestCacheKey:
+    """快取鍵建立測試"""
+
+    def test_normalize_message_ignores_spacing_and_punctuation(self):
+        assert normalize_message("推薦  一首8星的歌？") == normalize_message("推薦 一首８星的歌")
+
+    def test_candidate_order_does_not_matter(self):
+        key_a = build_cache_key("推薦", PROFILE, SONGS)
+        key_b = build_cache_key("推薦", PROFILE, list(reversed(SONGS)))
+        assert key_a == key_b
+
+    def test_profile_changes_key(self):
+        key_a = build_cache_key("推薦", PROFILE, SONGS)
+        key_b = build_cache_key("推薦", {**PROFILE, "level": "名人"}, SONGS)
+        assert key_a != key_b
+
+
+class TestAnswerCache:
+    """AnswerCache 行為測試"""
+
+    def test_hit_and_miss_counts(self):
+        cache = AnswerCache(max_entries=10, ttl_seconds=60)
+        key = build_cache_key("推薦", PROFILE, SONGS)
+        assert cache.get(key) is None
+        cache.put(key, "答案", upstream_seconds=1.5)
+        assert cache.get(key) == "答案"
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["saved_upstream_seconds"] == 1.5
+
+    def test_ttl_expiry(self):
+        cache = AnswerCache(max_entries=10, ttl_seconds=0)
+        key = build_cache_key("推薦", PROFILE, SONGS)
+        cache.put(key, "答案", upstream_seconds=1.0)
+        time.sleep(0.01)
+        assert cache.get(key) is None
+
+    def test_lru_eviction(self):
+        cache = AnswerCache(max_entries=2, ttl_seconds=60)
+        keys = [build_cache_key(f"問題{i}", PROFILE, SONGS) for i in range(3)]
+        cache.put(keys[0], "0", 1.0)
+        cache.put(keys[1], "1", 1.0)
+        assert cache.get(keys[0]) == "0"
+        cache.put(keys[2], "2", 1.0)
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == "0"
+        assert cache.get(keys[2]) == "2"
+
+    def test_similarity_match_within_same_context(self):
+        vectors = {"推薦8星": [1.0, 0.0], "推薦八星": [0.99, 0.05], "閒聊": [0.0, 1.0]}
+        embed = lambda texts: [vectors[t] for t in texts]
+        cache = AnswerCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.95)
+
+        stored = cache.with_embedding(build_cache_key("推薦8星", PROFILE, SONGS), embed)
+        cache.put(stored, "答案", 1.0)
+
+        similar = cache.with_embedding(build_cache_key("推薦八星", PROFILE, SONGS), embed)
+        unrelated = cache.with_embedding(build_cache_key("閒聊", PROFILE, SONGS), embed)
+        other_context = cache.with_embedding(build_cache_key("推薦八星", PROFILE, SONGS[:1]), embed)
+        assert cache.get(similar) == "答案"
+        assert cache.get(unrelated) is None
+        assert cache.get(other_context) is None
+
+    def test_newer_snapshot_version_invalidates(self):
+        """出現較新的資源快照版本時清空快取，舊快照上的請求不寫入"""
+        cache = AnswerCache(max_entries=10, ttl_seconds=60)
+        old_key = build_cache_key("推薦", PROFILE, SONGS, data_version=1)
+        cache.put(old_key, "舊答案", 1.0)
+        assert cache.get(old_key) == "舊答案"
+
+        new_key = build_cache_key("推薦", PROFILE, SONGS, data_version=2)
+        assert new_key != old_key
+        assert cache.get(new_key) is None
+        assert cache.stats()["entries"] == 0
+
+        # 重新載入前開始的請求在之後才完成：不寫入舊版本的回覆。
+        cache.put(old_key, "舊答案", 1.0)
+        assert cache.stats()["entries"] == 0
+        cache.put(new_key, "新答案", 1.0)
+        assert cache.get(new_key) == "新答案"
+
+    def test_similarity_candidates_are_bounded(self):
+        """近似比對只檢查同一 context 最近的項目"""
+        embed = lambda texts: [[1.0, float(len(texts[0]))] for _ in texts]
+        cache = AnswerCache(max_entries=1000, ttl_seconds=60, similarity_threshold=0.5)
+        for i in range(SIMILARITY_CANDIDATES_PER_CONTEXT + 10):
+            cache.put(cache.with_embedding(build_cache_key(f"問題{i}", PROFILE, SONGS), embed), str(i), 1.0)
+        assert len(cache._similar_index[build_cache_key("", PROFILE, SONGS).context]) == SIMILARITY_CANDIDATES_PER_CONTEXT
+        assert cache.stats()["entries"] == SIMILARITY_CANDIDATES_PER_CONTEXT + 10
+
+    def test_unavailable_encoder_falls_back_to_exact_match(self):
+        """編碼器無法使用（回傳 None）時改用精確比對"""
+        cache = AnswerCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.9)
+        key = build_cache_key("推薦", PROFILE, SONGS)
+        assert cache.with_embedding(key, lambda texts: None).embedding is None
+        cache.put(key, "答案", 1.0)
+        assert cache.get(cache.with_embedding(key, lambda texts: None)) == "答案"
+
+
+class TestReplay:
+    """快取回放測試"""
+
+    def test_replay_yields_full_answer(self):
+        async def collect():
+            return [chunk async for chunk in replay_answer("太鼓之達人" * 10, chunk_chars=7, interval=0)]
+
+        chunks = asyncio.run(collect())
+        assert "".join(chunks) == "太鼓之達人" * 10
+        assert all(len(chunk) <= 7 for chunk in chunks)
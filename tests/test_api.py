@@ -238,8 +238,7 @@ class TestRateLimiting:
 
         monkeypatch.setattr(chat_route, "validate_token", lambda code: True)
         app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
-        app.dependency_overrides[chat_route.get_collection] = lambda: None
-        app.dependency_overrides[chat_route.get_all_songs] = lambda: []
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
 
         try:
             payload = {"message": "hello", "history": []}
@@ -310,3 +309,135 @@ class TestBearerOnlyAuth:
         assert response.status_code == 400
         data = response.json()
         assert "Authorization header" in data.get("error", "")
+
+
+class TestAnswerCacheRoute:
+    """聊天端點答案快取測試"""
+
+    @pytest.fixture(autouse=True)
+    def reset_state(self):
+        from lib.rate_limiter import limiter
+        from lib.services.answer_cache import answer_cache
+
+        limiter._storage.reset()
+        answer_cache.clear()
+        yield
+        limiter._storage.reset()
+        answer_cache.clear()
+        app.dependency_overrides.clear()
+
+    def test_repeated_question_is_replayed_from_cache(self, client: TestClient, monkeypatch):
+        from api.chat import route as chat_route
+
+        calls = []
+
+        class FakeChunk:
+            def __init__(self, text: str):
+                self.text = text
+
+        class FakeModels:
+            @staticmethod
+            def generate_content_stream(model, contents):
+                calls.append(contents)
+                return [FakeChunk("推薦"), FakeChunk("這首歌")]
+
+        class FakeClient:
+            models = FakeModels()
+
+        monkeypatch.setattr(chat_route, "validate_token", lambda code: True)
+        monkeypatch.setattr(chat_route, "get_user_profile", lambda code: None)
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+
+        headers = {"Authorization": "Bearer test-code"}
+        first = client.post("/api/chat", json={"message": "推薦歌曲", "history": []}, headers=headers)
+        second = client.post("/api/chat", json={"message": "推薦歌曲？", "history": []}, headers=headers)
+        assert first.text == second.text == "推薦這首歌"
+        assert len(calls) == 1
+
+        # 帶有對話歷史的請求不使用快取
+        third = client.post(
+            "/api/chat",
+            json={"message": "推薦歌曲", "history": [{"role": "user", "content": "你好"}]},
+            headers=headers,
+        )
+        assert third.text == "推薦這首歌"
+        assert len(calls) == 2
+
+
+class TestServerSideConversation:
+    """伺服器端對話狀態測試"""
+
+    @pytest.fixture(autouse=True)
+    def setup_state(self, temp_db_path, monkeypatch):
+        import time
+        import config
+        from lib.rate_limiter import limiter
+        from lib.services.user_service import save_users
+        from api.chat import route as chat_route
+
+        self.prompts = []
+        prompts = self.prompts
+
+        class FakeChunk:
+            def __init__(self, text: str):
+                self.text = text
+
+        class FakeModels:
+            @staticmethod
+            def generate_content_stream(model, contents):
+                prompts.append(contents)
+                return [FakeChunk(f"回覆{len(prompts)}")]
+
+        class FakeClient:
+            models = FakeModels()
+
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+        save_users({"conv-code": {"created_at": time.time(), "profile": None, "chat_sessions": []}})
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+        limiter._storage.reset()
+        yield
+        limiter._storage.reset()
+        app.dependency_overrides.clear()
+
+    def test_follow_up_sends_only_new_message(self, client: TestClient):
+        headers = {"Authorization": "Bearer conv-code"}
+        first = client.post("/api/chat", json={"message": "第一題"}, headers=headers)
+        assert first.text == "回覆1"
+        session_id = first.headers["X-Session-Id"]
+
+        second = client.post(
+            "/api/chat", json={"message": "第二題", "session_id": session_id}, headers=headers
+        )
+        assert second.text == "回覆2"
+        assert second.headers["X-Session-Id"] == session_id
+        assert "第一題" in self.prompts[1]
+        assert "回覆1" in self.prompts[1]
+
+        saved = client.post(
+            "/api/sessions", json={"title": "對話", "session_id": session_id}, headers=headers
+        )
+        assert saved.json()["session_id"] == session_id
+        sessions = client.get("/api/sessions", headers=headers).json()["sessions"]
+        assert [m["content"] for m in sessions[0]["messages"]] == ["第一題", "回覆1", "第二題", "回覆2"]
+
+    def test_unknown_session_returns_404(self, client: TestClient):
+        response = client.post(
+            "/api/chat",
+            json={"message": "你好", "session_id": "missing"},
+            headers={"Authorization": "Bearer conv-code"},
+        )
+        assert response.status_code == 404
+        assert self.prompts == []
+
+    def test_sessions_reject_invalid_session_id(self, client: TestClient):
+        """儲存與刪除對話同樣驗證對話 ID 格式"""
+        headers = {"Authorization": "Bearer conv-code"}
+        saved = client.post(
+            "/api/sessions", json={"title": "對話", "session_id": "../users"}, headers=headers
+        )
+        assert saved.status_code == 400
+        deleted = client.delete("/api/sessions/bad.id", headers=headers)
+        assert deleted.status_code == 400
@@ -0,0 +1,279 @@
+"""
+ChromaDB 版本化集合測試
+
+以暫存目錄中的 ChromaDB 與固定的假嵌入函式，測試 init_chroma 的建立、驗證、
+指標檔切換與舊版本刪除，以及伺服器端依指標檔開啟集合。
+"""
+import hashlib
+import json
+import os
+import time
+import chromadb
+import numpy as np
+import pytest
+import config
+import init_chroma
+from lib import dependencies
+from lib.chroma_versions import content_hash, read_pointer, resolve_collection_name, write_pointer
+from lib.songs import Song
+
+
+def fake_encode(documents):
+    """依文件內容產生固定的 16 維向量。"""
+    vectors = []
+    for document in documents:
+        digest = hashlib.sha256(document.encode("utf-8")).digest()
+        vectors.append([byte / 255 for byte in digest[:16]])
+    return vectors
+
+
+def constant_encode(documents):
+    return [[1.0] * 16 for _ in documents]
+
+
+def make_songs(count, offset=0):
+    return [Song(id=offset + i, title=f"曲 {offset + i}", genre="ポップス") for i in range(count)]
+
+
+@pytest.fixture
+def chroma(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_POINTER_PATH", str(tmp_path / "chroma" / "active_collection.json"))
+    monkeypatch.setattr(config, "CHROMA_VALIDATION_SAMPLE", 20)
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+
+def collection_names(client):
+    return sorted(getattr(c, "name", c) for c in client.list_collections())
+
+
+class TestPointer:
+    """版本雜湊與指標檔"""
+
+    def test_content_hash_tracks_content_and_model(self):
+        ids, documents, metadatas = init_chroma.build_documents(make_songs(3))
+        base = content_hash(ids, documents, metadatas, "model-a")
+        assert base == content_hash(ids, documents, metadatas, "model-a")
+        assert base != content_hash(ids, documents, metadatas, "model-b")
+        assert base != content_hash(ids[:2], documents[:2], metadatas[:2], "model-a")
+
+    def test_resolve_falls_back_without_pointer(self, tmp_path):
+        assert resolve_collection_name("taiko_songs", str(tmp_path / "missing.json")) == "taiko_songs"
+
+    def test_write_pointer_keeps_history(self, tmp_path):
+        path = str(tmp_path / "pointer.json")
+        write_pointer("taiko_songs_va", "a", 1, path)
+        write_pointer("taiko_songs_vb", "b", 2, path)
+        pointer = read_pointer(path)
+        assert pointer["collection"] == "taiko_songs_vb"
+        assert pointer["history"] == ["taiko_songs_vb", "taiko_songs_va"]
+        assert resolve_collection_name("taiko_songs", path) == "taiko_songs_vb"
+        assert os.listdir(tmp_path) == ["pointer.json"]
+
+    def test_corrupt_pointer_is_ignored(self, tmp_path):
+        path = tmp_path / "pointer.json"
+        path.write_text("{", encoding="utf-8")
+        assert resolve_collection_name("taiko_songs", str(path)) == "taiko_songs"
+
+
+class TestBuildVersionedCollection:
+    """init_chroma 的版本化建立流程"""
+
+    def test_builds_and_flips_pointer(self, chroma):
+        name = init_chroma.build_versioned_collection(chroma, make_songs(30), fake_encode)
+        assert name.startswith("taiko_songs_v")
+        assert read_pointer()["collection"] == name
+        assert chroma.get_collection(name).count() == 30
+
+    def test_unchanged_content_is_not_rebuilt(self, chroma, monkeypatch):
+        songs = make_songs(10)
+        first = init_chroma.build_versioned_collection(chroma, songs, fake_encode)
+        activated_at = read_pointer()["activated_at"]
+        assert init_chroma.build_versioned_collection(chroma, songs, fake_encode) == first
+        assert read_pointer()["activated_at"] == activated_at
+
+    def test_removed_songs_are_not_in_new_version(self, chroma):
+        init_chroma.build_versioned_collection(chroma, make_songs(10), fake_encode)
+        name = init_chroma.build_versioned_collection(chroma, make_songs(5), fake_encode)
+        ids = chroma.get_collection(name).get()["ids"]
+        assert sorted(ids, key=int) == [str(i) for i in range(5)]
+
+    def test_failed_validation_keeps_previous_version(self, chroma):
+        previous = init_chroma.build_versioned_collection(chroma, make_songs(30), fake_encode)
+        with pytest.raises(ValueError, match="召回率"):
+            init_chroma.build_versioned_collection(chroma, make_songs(30, offset=100), constant_encode)
+        assert read_pointer()["collection"] == previous
+        assert collection_names(chroma) == [previous]
+
+    def test_old_versions_are_garbage_collected(self, chroma, monkeypatch):
+        monkeypatch.setattr(config, "CHROMA_KEEP_VERSIONS", 2)
+        chroma.create_collection("taiko_songs")
+        names = [
+            init_chroma.build_versioned_collection(chroma, make_songs(5, offset=i * 10), fake_encode)
+            for i in range(3)
+        ]
+        # 保留使用中與前一個版本；未版本化的舊集合不受影響
+        assert collection_names(chroma) == sorted(["taiko_songs", names[1], names[2]])
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, documents):
+        self.calls.append(list(documents))
+        return fake_encode(documents)
+
+    @property
+    def encoded(self):
+        return sum(len(call) for call in self.calls)
+
+
+class TestIncrementalReindex:
+    """依 doc_hash 只重新計算新增與變更歌曲的向量"""
+
+    def test_only_new_and_changed_songs_are_encoded(self, chroma, capsys):
+        songs = make_songs(10)
+        init_chroma.build_versioned_collection(chroma, songs, fake_encode)
+        capsys.readouterr()
+
+        updated = [Song.from_dict(song.to_dict()) for song in songs[:9]] + [Song(id=100, title="新曲")]
+        updated[0].title = "改名"
+        updated[1].description = "新的描述"
+        encoder = CountingEncoder()
+        name = init_chroma.build_versioned_collection(chroma, updated, encoder)
+
+        assert encoder.encoded == 3
+        assert "新增 1 首、變更 2 首、刪除 1 首、未變更 7 首" in capsys.readouterr().out
+        collection = chroma.get_collection(name)
+        assert "9" not in collection.get()["ids"]
+        # 未變更的歌曲沿用原本的向量
+        stored = collection.get(ids=["5"], include=["embeddings"])["embeddings"][0]
+        ids, documents, _ = init_chroma.build_documents([songs[5]])
+        assert list(stored) == pytest.approx(fake_encode(documents)[0], abs=1e-6)
+
+    def test_model_change_reencodes_everything(self, chroma, monkeypatch):
+        init_chroma.build_versioned_collection(chroma, make_songs(6), fake_encode)
+        monkeypatch.setattr(config, "EMBEDDING_MODEL", "another-model")
+        encoder = CountingEncoder()
+        init_chroma.build_versioned_collection(chroma, make_songs(6), encoder)
+        assert encoder.encoded == 6
+
+    def test_legacy_collection_without_hashes_is_reencoded(self, chroma):
+        legacy = chroma.create_collection("taiko_songs")
+        legacy.upsert(ids=["0", "1"], embeddings=[[0.0] * 16, [1.0] * 16], metadatas=[{"json": "{}"}] * 2)
+        encoder = CountingEncoder()
+        init_chroma.build_versioned_collection(chroma, make_songs(2), encoder)
+        assert encoder.encoded == 2
+
+
+class TestServerResolvesPointer:
+    """伺服器依指標檔開啟集合"""
+
+    def test_open_collection_follows_pointer(self, chroma, tmp_path, monkeypatch):
+        name = init_chroma.build_versioned_collection(chroma, make_songs(5), fake_encode)
+        songs_path = tmp_path / "songs.json"
+        songs_path.write_text(json.dumps([song.to_dict() for song in make_songs(5)]), encoding="utf-8")
+        monkeypatch.setattr(config, "RESOURCE_RELOAD_TRIGGER_PATH", str(tmp_path / ".reload"))
+        try:
+            dependencies.init_resources(
+                "", str(tmp_path / "chroma"), "taiko_songs", str(songs_path), run_warmup=False
+            )
+            assert dependencies.get_collection().name == name
+        finally:
+            dependencies.cleanup_resources()
+
+    def test_watcher_switches_to_new_version(self, chroma, tmp_path, monkeypatch):
+        first = init_chroma.build_versioned_collection(chroma, make_songs(5), fake_encode)
+        songs_path = tmp_path / "songs.json"
+        songs_path.write_text(json.dumps([song.to_dict() for song in make_songs(5)]), encoding="utf-8")
+        monkeypatch.setattr(config, "RESOURCE_RELOAD_TRIGGER_PATH", str(tmp_path / ".reload"))
+        monkeypatch.setattr(dependencies.query_encoder, "encode", fake_encode)
+        watcher = dependencies.ResourceWatcher(interval=0)
+        try:
+            dependencies.init_resources(
+                "", str(tmp_path / "chroma"), "taiko_songs", str(songs_path), run_warmup=False
+            )
+            in_flight = dependencies.get_snapshot()
+            second = init_chroma.build_versioned_collection(chroma, make_songs(8), fake_encode)
+            watcher.check()
+            assert watcher.check() is True
+            assert dependencies.get_collection().name == second
+            # 切換前取得快照的請求仍查詢舊版本
+            assert in_flight.collection.name == first
+            assert in_flight.collection.count() == 5
+        finally:
+            dependencies.cleanup_resources()
+
+
+class FailingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def upsert(self, **kwargs):
+        raise RuntimeError("寫入失敗")
+
+
+class TestEncodePipeline:
+    """編碼與寫入的串流管線"""
+
+    def test_encodes_in_batches_and_writes_float32(self, chroma, monkeypatch):
+        monkeypatch.setattr(config, "CHROMA_BATCH_SIZE", 4)
+        encoder = CountingEncoder()
+        name = init_chroma.build_versioned_collection(chroma, make_songs(10), encoder)
+        assert [len(call) for call in encoder.calls] == [4, 4, 2]
+        assert chroma.get_collection(name).count() == 10
+
+    def test_batches_mix_reused_and_encoded_vectors(self, chroma, monkeypatch):
+        monkeypatch.setattr(config, "CHROMA_BATCH_SIZE", 3)
+        songs = make_songs(7)
+        init_chroma.build_versioned_collection(chroma, songs, fake_encode)
+        previous_collection, previous = init_chroma.load_previous_hashes(chroma, "taiko_songs")
+
+        updated = [Song.from_dict(song.to_dict()) for song in songs]
+        updated[4].title = "改名"
+        ids, documents, _ = init_chroma.build_documents(updated)
+        progress = init_chroma.IndexProgress(len(ids))
+        batches = list(
+            init_chroma.encode_batches(ids, documents, set(ids) - {"4"}, previous_collection, fake_encode, progress, 3)
+        )
+
+        assert [(start, end) for start, end, _ in batches] == [(0, 3), (3, 6), (6, 7)]
+        assert all(embeddings.dtype == np.float32 for _, _, embeddings in batches)
+        assert progress.encoded == 1
+        stacked = np.concatenate([embeddings for _, _, embeddings in batches])
+        assert stacked == pytest.approx(np.asarray(fake_encode(documents), dtype=np.float32), abs=1e-6)
+
+    def test_queue_bounds_batches_in_flight(self):
+        written = []
+        produced = []
+        lead = []
+
+        class SlowCollection:
+            def upsert(self, ids, **kwargs):
+                time.sleep(0.01)
+                written.append(ids)
+
+        def batches():
+            for start in range(0, 20, 2):
+                lead.append(len(produced) - len(written))
+                produced.append(start)
+                yield start, start + 2, np.zeros((2, 4), dtype=np.float32)
+
+        ids = [str(i) for i in range(20)]
+        progress = init_chroma.IndexProgress(len(ids))
+        init_chroma.write_batches(SlowCollection(), batches(), ids, ids, [{}] * 20, progress, 2)
+        assert len(written) == 10 and progress.written == 20
+        # 佇列中最多 2 批，加上寫入中與編碼中各 1 批
+        assert max(lead) <= 4
+
+    def test_write_failure_stops_pipeline_and_keeps_previous_version(self, chroma, monkeypatch):
+        previous = init_chroma.build_versioned_collection(chroma, make_songs(5), fake_encode)
+        create_collection = chroma.create_collection
+        monkeypatch.setattr(chroma, "create_collection", lambda **kwargs: FailingCollection(create_collection(**kwargs)))
+        with pytest.raises(RuntimeError):
+            init_chroma.build_versioned_collection(chroma, make_songs(8), fake_encode)
+        assert read_pointer()["collection"] == previous
+        assert collection_names(chroma) == [previous]
@@ -0,0 +1,187 @@
+"""
+嵌入向量快取測試
+
+測試 lib.embedding_cache 的讀寫、跨實例（模擬多程序）共用、模型隔離、
+背景 LRU 壓縮與中斷寫入的處理，以及查詢編碼器使用快取的行為。
+"""
+import os
+import threading
+import zlib
+import numpy as np
+import pytest
+from filelock import FileLock
+from lib.embedding_cache import RECORD_HEADER, EmbeddingCache
+from lib.embeddings import QueryEncoder
+
+DIM = 8
+
+
+def vector_for(text):
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    return rng.random(DIM, dtype=np.float32)
+
+
+class CountingModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.stack([vector_for(text) for text in texts])
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def record_size(dim=DIM):
+    return RECORD_HEADER.size + dim * 4
+
+
+def wait_for_compaction(cache):
+    if cache._compactor is not None:
+        cache._compactor.join(timeout=10)
+
+
+class TestEmbeddingCache:
+    """快取讀寫"""
+
+    def test_round_trip_and_miss(self, cache_dir):
+        cache = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        cache.put_many(["太鼓"], np.stack([vector_for("太鼓")]))
+        hit, miss = cache.get_many(["太鼓", "達人"])
+        assert hit.dtype == np.float32
+        np.testing.assert_array_equal(hit, vector_for("太鼓"))
+        assert miss is None
+
+    def test_encode_only_computes_misses(self, cache_dir):
+        cache = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        model = CountingModel()
+        first = cache.encode(["a", "b", "a"], model.encode)
+        assert first.shape == (3, DIM)
+        second = cache.encode(["a", "b", "c"], model.encode)
+        assert model.encoded == ["a", "b", "a", "c"]
+        np.testing.assert_array_equal(second[:2], first[:2])
+        # 同一批次中重複的文字只寫入一筆
+        assert cache.stats()["entries"] == 3
+
+    def test_persists_across_instances(self, cache_dir):
+        EmbeddingCache(cache_dir, "model-a", 1 << 20).put_many(["x"], np.stack([vector_for("x")]))
+        reopened = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        np.testing.assert_array_equal(reopened.get_many(["x"])[0], vector_for("x"))
+
+    def test_sees_records_appended_by_other_instance(self, cache_dir):
+        reader = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        writer = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        writer.put_many(["one"], np.stack([vector_for("one")]))
+        assert reader.get_many(["one"])[0] is not None
+        writer.put_many(["two"], np.stack([vector_for("two")]))
+        np.testing.assert_array_equal(reader.get_many(["two"])[0], vector_for("two"))
+
+    def test_model_change_misses(self, cache_dir):
+        EmbeddingCache(cache_dir, "model-a", 1 << 20).put_many(["x"], np.stack([vector_for("x")]))
+        assert EmbeddingCache(cache_dir, "model-b", 1 << 20).get_many(["x"]) == [None]
+
+    def test_truncated_tail_is_ignored_and_overwritten(self, cache_dir):
+        cache = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        cache.put_many(["ok"], np.stack([vector_for("ok")]))
+        with open(cache.path, "ab") as f:
+            f.write(b"\x00" * 10)
+
+        reopened = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        assert reopened.get_many(["ok"])[0] is not None
+        reopened.put_many(["next"], np.stack([vector_for("next")]))
+        assert os.path.getsize(cache.path) == 2 * record_size()
+        np.testing.assert_array_equal(
+            EmbeddingCache(cache_dir, "model-a", 1 << 20).get_many(["next"])[0], vector_for("next")
+        )
+
+
+class TestCompaction:
+    """超過上限時依最近使用順序淘汰"""
+
+    def test_keeps_recently_used_entries(self, cache_dir):
+        cache = EmbeddingCache(cache_dir, "model-a", 10 * record_size())
+        texts = [f"t{i}" for i in range(10)]
+        cache.put_many(texts, np.stack([vector_for(t) for t in texts]))
+        # 讀取最舊的一筆，使其成為最近使用
+        cache.get_many(["t0"])
+        cache.put_many(["new"], np.stack([vector_for("new")]))
+        wait_for_compaction(cache)
+
+        assert os.path.getsize(cache.path) <= 10 * record_size()
+        results = dict(zip(texts + ["new"], cache.get_many(texts + ["new"])))
+        assert results["t0"] is not None
+        assert results["new"] is not None
+        assert results["t1"] is None
+        np.testing.assert_array_equal(results["t9"], vector_for("t9"))
+
+    def test_other_instance_recovers_after_compaction(self, cache_dir):
+        limit = 4 * record_size()
+        other = EmbeddingCache(cache_dir, "model-a", limit)
+        compactor = EmbeddingCache(cache_dir, "model-a", limit)
+        texts = [f"t{i}" for i in range(4)]
+        other.put_many(texts, np.stack([vector_for(t) for t in texts]))
+        assert other.get_many(["t0"])[0] is not None
+
+        compactor.put_many(["x", "y"], np.stack([vector_for("x"), vector_for("y")]))
+        wait_for_compaction(compactor)
+        # 另一個實例的索引已過期：結果只會是正確的向量或未命中，不會讀到錯誤的資料
+        for text, vector in zip(texts + ["x", "y"], other.get_many(texts + ["x", "y"])):
+            if vector is not None:
+                np.testing.assert_array_equal(vector, vector_for(text))
+        np.testing.assert_array_equal(other.get_many(["y"])[0], vector_for("y"))
+
+
+    def test_compaction_does_not_block_reads_or_query_writes(self, cache_dir):
+        """壓縮在背景執行；持有檔案鎖期間讀取照常，wait=False 的寫入直接略過"""
+        cache = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+        cache.put_many(["a"], np.stack([vector_for("a")]))
+        other_process_lock = FileLock(os.path.join(cache_dir, "vectors.lock"))
+        with other_process_lock:
+            done = []
+            reader = threading.Thread(target=lambda: done.append(cache.get_many(["a"])[0]))
+            reader.start()
+            reader.join(timeout=5)
+            assert done and done[0] is not None
+            assert cache.put_many(["b"], np.stack([vector_for("b")]), wait=False) is False
+        assert cache.put_many(["b"], np.stack([vector_for("b")]), wait=False) is True
+
+    def test_compaction_runs_in_background(self, cache_dir):
+        """超過上限的寫入立即返回，壓縮由背景執行緒完成"""
+        cache = EmbeddingCache(cache_dir, "model-a", 4 * record_size())
+        texts = [f"t{i}" for i in range(6)]
+        started = threading.Event()
+        release = threading.Event()
+        original = cache.compact
+
+        def slow_compact():
+            started.set()
+            release.wait(5)
+            return original()
+
+        cache.compact = slow_compact
+        cache.put_many(texts, np.stack([vector_for(t) for t in texts]))
+        assert started.wait(5)
+        assert cache.get_many(["t5"])[0] is not None
+        release.set()
+        wait_for_compaction(cache)
+        assert os.path.getsize(cache.path) <= 4 * record_size()
+
+
+class TestQueryEncoderCache:
+    """查詢編碼器使用快取"""
+
+    def test_repeated_queries_skip_the_model(self, cache_dir):
+        encoder = QueryEncoder("model-a")
+        model = CountingModel()
+        encoder._model = model
+        encoder._cache = EmbeddingCache(cache_dir, "model-a", 1 << 20)
+
+        first = encoder.encode(["推薦 鬼 8星"])
+        second = encoder.encode(["推薦 鬼 8星"])
+        assert model.encoded == ["推薦 鬼 8星"]
+        assert first == second
+        assert isinstance(first[0][0], float)
+        encoder.unload()
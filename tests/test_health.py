@@ -0,0 +1,121 @@
+"""
+存活與就緒檢查測試
+
+測試 lib.health 的背景探測器與 /livez、/readyz 端點。
+"""
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from lib.health import ProbeCheck, ReadinessProber
+
+
+def ok():
+    return None
+
+
+def slow():
+    time.sleep(0.05)
+
+
+def broken():
+    raise RuntimeError("壞掉了")
+
+
+def make_prober(*checks):
+    return ReadinessProber(list(checks), interval=0.01, timeout=0.5)
+
+
+class TestReadinessProber:
+    """ReadinessProber 行為測試"""
+
+    def test_starts_in_starting_state(self):
+        assert make_prober(ProbeCheck("a", ok)).snapshot()["status"] == "starting"
+
+    def test_all_checks_ok_is_ready(self):
+        prober = make_prober(ProbeCheck("a", ok, slo_seconds=1.0), ProbeCheck("b", ok))
+        result = asyncio.run(prober.run_once())
+        assert result["status"] == "ready"
+        assert result["checks"]["a"]["within_slo"] is True
+        assert result["checks"]["a"]["latency_ms"] >= 0
+
+    def test_slo_exceeded_is_degraded(self):
+        prober = make_prober(ProbeCheck("slow", slow, slo_seconds=0.01))
+        result = asyncio.run(prober.run_once())
+        assert result["status"] == "degraded"
+        assert result["checks"]["slow"]["within_slo"] is False
+
+    def test_non_critical_failure_is_degraded(self):
+        prober = make_prober(ProbeCheck("a", ok), ProbeCheck("b", broken, critical=False))
+        result = asyncio.run(prober.run_once())
+        assert result["status"] == "degraded"
+        assert result["checks"]["b"]["error"] == "壞掉了"
+
+    def test_critical_failure_is_unavailable(self):
+        prober = make_prober(ProbeCheck("a", broken), ProbeCheck("b", slow, slo_seconds=0.01))
+        assert asyncio.run(prober.run_once())["status"] == "unavailable"
+
+    def test_timeout_counts_as_failure(self):
+        prober = ReadinessProber([ProbeCheck("slow", slow)], interval=1, timeout=0.01)
+        result = asyncio.run(prober.run_once())
+        assert result["status"] == "unavailable"
+        assert result["checks"]["slow"]["ok"] is False
+
+    def test_background_loop_refreshes_result(self):
+        calls = []
+        prober = make_prober(ProbeCheck("a", lambda: calls.append(1)))
+
+        async def run():
+            prober.start()
+            await asyncio.sleep(0.1)
+            await prober.stop()
+
+        asyncio.run(run())
+        assert len(calls) >= 2
+        assert prober.snapshot()["status"] == "ready"
+
+    def test_chroma_probe_uses_query_encoder(self, monkeypatch):
+        """Chroma 金絲雀與聊天檢索相同，以查詢編碼器的向量查詢"""
+        from lib import dependencies, health
+
+        calls = []
+
+        class FakeCollection:
+            def query(self, **kwargs):
+                calls.append(kwargs)
+                return {"ids": [["1"]]}
+
+        monkeypatch.setattr(health, "get_collection", lambda: FakeCollection())
+        monkeypatch.setattr(dependencies.query_encoder, "encode", lambda texts: [[0.1, 0.2]])
+        health._probe_chroma()
+        assert calls == [{"query_embeddings": [[0.1, 0.2]], "n_results": 1}]
+
+
+class TestHealthEndpoints:
+    """/livez 與 /readyz 端點測試"""
+
+    @pytest.fixture
+    def client(self):
+        from server import app
+        return TestClient(app)
+
+    def test_livez(self, client):
+        response = client.get("/livez")
+        assert response.status_code == 200
+        assert response.json() == {"status": "alive"}
+
+    def test_readyz_reflects_cached_probe(self, client, monkeypatch):
+        import server
+
+        calls = []
+        prober = make_prober(ProbeCheck("a", lambda: calls.append(1)))
+        monkeypatch.setattr(server, "readiness_prober", prober)
+
+        assert client.get("/readyz").status_code == 503
+        asyncio.run(prober.run_once())
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        # 請求本身不會觸發探測
+        client.get("/readyz")
+        assert len(calls) == 1
@@ -0,0 +1,121 @@
+"""
+匯入時間與匯入副作用測試
+
+每個測試都在新的子程序中執行，避免受到測試程序中已匯入模組的影響。
+匯入時間上限可透過環境變數 IMPORT_TIME_BUDGET_MS 調整（預設 1500ms）。
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+HEAVY_MODULES = ["chromadb", "google.genai", "sentence_transformers", "torch"]
+
+
+def run_python(*args, cwd=PROJECT_ROOT, **env_overrides):
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT, RATE_LIMIT_STORAGE_URI="memory://", **env_overrides)
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+
+class TestImportSideEffects:
+    """匯入不應有副作用，也不應載入大型 SDK"""
+
+    def test_server_import_skips_heavy_sdks(self):
+        """import server 不會匯入 chromadb、google.genai 等大型套件"""
+        result = run_python(
+            "-c",
+            "import json, sys, server; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))",
+        )
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+    def test_config_import_has_no_side_effects(self, tmp_path):
+        """import config 不建立目錄、不讀取 .env、不輸出訊息、不設定 logging"""
+        (tmp_path / ".env").write_text("TAIKO_ENV_PROBE=1\n", encoding="utf-8")
+        result = run_python(
+            "-c",
+            "import logging, os, config; print(len(logging.getLogger().handlers), os.getenv('TAIKO_ENV_PROBE'))",
+            cwd=str(tmp_path),
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "0 None"
+        assert result.stderr == ""
+        assert os.listdir(tmp_path) == [".env"]
+
+    def test_settings_read_env_file_on_first_access(self, tmp_path):
+        """第一次存取設定時才讀入 .env，已設定的環境變數優先，之後回傳同一個設定物件"""
+        (tmp_path / ".env").write_text("SERVER_PORT=9123\nSERVER_HOST=10.0.0.1\n", encoding="utf-8")
+        result = run_python(
+            "-c",
+            "import os, config; before = os.getenv('SERVER_PORT'); "
+            "print(before, config.SERVER_PORT, config.SERVER_HOST, config.get_settings() is config.get_settings())",
+            cwd=str(tmp_path),
+            SERVER_HOST="127.0.0.1",
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "None 9123 127.0.0.1 True"
+
+    def test_server_import_reads_env_file(self, tmp_path):
+        """以 uvicorn server:app 啟動（只匯入 server）時也會讀入 .env，匯入時建立的物件取得其中的值"""
+        (tmp_path / ".env").write_text("LLM_HEDGE_DELAY_SECONDS=7.5\n", encoding="utf-8")
+        result = run_python(
+            "-c",
+            "import server; from lib.llm_gateway import llm_gateway; print(llm_gateway.hedge_delay)",
+            cwd=str(tmp_path),
+            VALIDATE_CONFIG="false",
+            LOG_DIR=str(tmp_path / "logs"),
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "7.5"
+
+    def test_generate_tags_import_has_no_side_effects(self):
+        """import generate_tags 不設定 logging，未設定 API 金鑰也不會結束程序"""
+        result = run_python(
+            "-c",
+            "import logging, os; os.environ.pop('GEMINI_API_KEY', None); "
+            "import generate_tags; print(len(logging.getLogger().handlers), generate_tags.client)",
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "0 None"
+
+    def test_sdks_imported_on_first_use(self, tmp_path):
+        """Gemini 客戶端在第一次 get_client() 時才匯入 SDK 並建立"""
+        script = (
+            "import sys\n"
+            "from lib import dependencies\n"
+            f"dependencies.init_resources('test-key', {str(tmp_path / 'chroma')!r}, 'songs', {str(tmp_path / 'songs.json')!r})\n"
+            "before = 'google.genai' in sys.modules\n"
+            "client = dependencies.get_client()\n"
+            "print(before, 'google.genai' in sys.modules, client is not None)\n"
+        )
+        result = run_python("-c", script)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "False True True"
+
+    def test_init_resources_does_not_load_encoder(self, tmp_path):
+        """init_resources 不匯入 sentence-transformers / torch，模型留待預熱或第一次編碼載入"""
+        script = (
+            "import json, sys\n"
+            "from lib import dependencies\n"
+            f"dependencies.init_resources('', {str(tmp_path / 'chroma')!r}, 'songs', {str(tmp_path / 'songs.json')!r}, run_warmup=False)\n"
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n"
+        )
+        result = run_python("-c", script, QUERY_ENCODER_ENABLED="true")
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+
+class TestImportTimeBudget:
+    """import server 的累計匯入時間"""
+
+    def test_server_import_within_budget(self):
+        result = run_python("-X", "importtime", "-c", "import server")
+        assert result.returncode == 0, result.stderr
+        match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| server$", result.stderr, re.MULTILINE)
+        assert match, result.stderr[-2000:]
+        cumulative_ms = int(match.group(1)) / 1000
+        assert cumulative_ms < IMPORT_TIME_BUDGET_MS, f"import server 耗時 {cumulative_ms:.0f}ms"
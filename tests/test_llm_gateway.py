@@ -0,0 +1,253 @@
+"""
+LLM 閘道測試
+
+以本機模擬的 Gemini 串流伺服器驅動真正的 genai 客戶端，
+驗證模型級聯、對沖重試與斷路器行為。
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from google import genai
+from google.genai import types
+from lib.llm_gateway import LLMGateway, LLMUnavailableError
+
+
+class FakeGeminiServer:
+    """模擬 streamGenerateContent（SSE）的本機伺服器，可依模型設定延遲或錯誤。"""
+
+    def __init__(self):
+        self.behaviors = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("content-length", 0)))
+                model = self.path.split("/models/", 1)[1].split(":", 1)[0]
+                server.requests.append(model)
+                behavior = server.behaviors.get(model, {})
+                time.sleep(behavior.get("delay", 0))
+                if behavior.get("status", 200) != 200:
+                    payload = json.dumps({"error": {"code": behavior["status"], "message": "boom", "status": "INTERNAL"}})
+                    self.send_response(behavior["status"])
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload.encode())
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i, text in enumerate(behavior.get("chunks", [f"{model} 回覆"])):
+                    event = {
+                        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                        "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": i + 1},
+                    }
+                    self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode())
+                    self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self._thread.start()
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def fake_server():
+    server = FakeGeminiServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(fake_server):
+    return genai.Client(api_key="test-key", http_options=types.HttpOptions(base_url=fake_server.base_url))
+
+
+def make_gateway(**overrides):
+    options = dict(
+        models=["primary", "fallback"],
+        ttft_slo=1.0,
+        first_byte_timeout=2.0,
+        hedge_delay=0,
+        failure_threshold=2,
+        cooldown_seconds=30,
+        window_seconds=300,
+        min_samples=3,
+    )
+    options.update(overrides)
+    return LLMGateway(**options)
+
+
+async def read_all(stream):
+    parts = []
+    try:
+        while True:
+            chunk = await stream.next_chunk()
+            if chunk is None:
+                return "".join(parts)
+            parts.append(chunk.text)
+    finally:
+        stream.close()
+
+
+class TestModelCascade:
+    """模型級聯測試"""
+
+    def test_primary_model_used_when_healthy(self, fake_server, client):
+        fake_server.behaviors["primary"] = {"chunks": ["你好", "，玩家"]}
+        gateway = make_gateway()
+
+        async def run():
+            stream = await gateway.open_stream(client, "hi")
+            return stream.model, await read_all(stream)
+
+        model, text = asyncio.run(run())
+        assert model == "primary"
+        assert text == "你好，玩家"
+        assert fake_server.requests == ["primary"]
+
+    def test_error_before_first_byte_falls_back(self, fake_server, client):
+        fake_server.behaviors["primary"] = {"status": 500}
+        gateway = make_gateway()
+
+        async def run():
+            stream = await gateway.open_stream(client, "hi")
+            return stream.model, await read_all(stream)
+
+        model, text = asyncio.run(run())
+        assert model == "fallback"
+        assert text == "fallback 回覆"
+        assert gateway.health["primary"].consecutive_failures == 1
+
+    def test_slow_primary_routes_to_fallback(self, fake_server, client):
+        gateway = make_gateway()
+        for _ in range(3):
+            gateway.health["primary"].record_first_byte(5.0)
+        assert gateway.route() == ["fallback", "primary"]
+
+        async def run():
+            stream = await gateway.open_stream(client, "hi")
+            return stream.model
+
+        assert asyncio.run(run()) == "fallback"
+        assert fake_server.requests == ["fallback"]
+
+
+class TestHedging:
+    """首個位元組前的對沖重試測試"""
+
+    def test_hedged_request_wins_when_primary_is_slow(self, fake_server, client):
+        fake_server.behaviors["primary"] = {"delay": 1.0}
+        gateway = make_gateway(hedge_delay=0.1)
+
+        async def run():
+            started = time.perf_counter()
+            stream = await gateway.open_stream(client, "hi")
+            elapsed = time.perf_counter() - started
+            return stream.model, await read_all(stream), elapsed
+
+        model, text, elapsed = asyncio.run(run())
+        assert model == "fallback"
+        assert text == "fallback 回覆"
+        assert elapsed < 0.8
+        assert fake_server.requests[:2] == ["primary", "fallback"]
+
+    def test_hedge_loser_counts_toward_p95(self, fake_server, client):
+        """落敗的主要模型以已等待時間作為 TTFT 下界，p95 不會只剩勝出的快速樣本"""
+        fake_server.behaviors["primary"] = {"delay": 1.0}
+        gateway = make_gateway(hedge_delay=0.1, min_samples=1)
+
+        async def run():
+            stream = await gateway.open_stream(client, "hi")
+            await read_all(stream)
+
+        asyncio.run(run())
+        primary = gateway.health["primary"]
+        assert primary.ttft_p95(1) >= 0.1
+        assert primary.consecutive_failures == 0
+        assert primary.error_rate() == 0.0
+
+
+class TestCircuitBreaker:
+    """斷路器測試"""
+
+    def test_circuit_opens_after_consecutive_failures(self, fake_server, client):
+        fake_server.behaviors["primary"] = {"status": 500}
+        gateway = make_gateway()
+
+        async def run():
+            for _ in range(2):
+                stream = await gateway.open_stream(client, "hi")
+                await read_all(stream)
+
+        asyncio.run(run())
+        assert gateway.health["primary"].state() == "open"
+        assert gateway.route() == ["fallback"]
+
+        fake_server.requests.clear()
+
+        async def run_again():
+            stream = await gateway.open_stream(client, "hi")
+            await read_all(stream)
+            return stream.model
+
+        assert asyncio.run(run_again()) == "fallback"
+        assert fake_server.requests == ["fallback"]
+
+    def test_fails_fast_when_all_circuits_open(self, fake_server, client):
+        gateway = make_gateway(cooldown_seconds=12)
+        for model in ("primary", "fallback"):
+            gateway.health[model].record_failure()
+            gateway.health[model].record_failure()
+
+        async def run():
+            await gateway.open_stream(client, "hi")
+
+        started = time.perf_counter()
+        with pytest.raises(LLMUnavailableError) as exc_info:
+            asyncio.run(run())
+        assert time.perf_counter() - started < 0.1
+        assert exc_info.value.retry_after == 12
+        assert fake_server.requests == []
+
+    def test_half_open_probe_closes_circuit(self, fake_server, client):
+        gateway = make_gateway(models=["primary"], cooldown_seconds=0.05)
+        gateway.health["primary"].record_failure()
+        gateway.health["primary"].record_failure()
+        time.sleep(0.06)
+        assert gateway.health["primary"].state() == "half_open"
+
+        async def run():
+            stream = await gateway.open_stream(client, "hi")
+            await read_all(stream)
+
+        asyncio.run(run())
+        assert gateway.health["primary"].state() == "closed"
+
+    def test_all_models_failing_raises_unavailable(self, fake_server, client):
+        fake_server.behaviors["primary"] = {"status": 500}
+        fake_server.behaviors["fallback"] = {"status": 500}
+        gateway = make_gateway()
+
+        async def run():
+            await gateway.open_stream(client, "hi")
+
+        with pytest.raises(LLMUnavailableError):
+            asyncio.run(run())
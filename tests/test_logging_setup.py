@@ -0,0 +1,192 @@
+"""
+日誌初始化測試
+
+涵蓋背景執行緒寫入、佇列滿時丟棄計數與檔案輪替。
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from lib import logging_setup
+from lib.logging_setup import DroppingQueueHandler, logging_stats, setup_logging, shutdown_logging
+from lib.metrics import LOG_RECORDS_DROPPED_TOTAL
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+class _BlockingHandler(logging.Handler):
+    """在 unblock 之前阻塞 emit，用來模擬緩慢的磁碟。"""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.unblock.wait(5)
+        self.records.append(record)
+
+
+class TestDroppingQueueHandler:
+    """佇列已滿時的行為"""
+
+    def test_full_queue_drops_and_counts(self):
+        """佇列塞滿後丟棄紀錄而不阻塞，並累計丟棄數"""
+        handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+        logger = logging.getLogger("test.dropping")
+        logger.propagate = False
+        logger.addHandler(handler)
+        before = LOG_RECORDS_DROPPED_TOTAL._value.get()
+        try:
+            started = time.perf_counter()
+            for i in range(5):
+                logger.warning("訊息 %d", i)
+            elapsed = time.perf_counter() - started
+        finally:
+            logger.removeHandler(handler)
+            logger.propagate = True
+
+        assert handler.queue.qsize() == 2
+        assert handler.dropped == 3
+        assert LOG_RECORDS_DROPPED_TOTAL._value.get() - before == 3
+        assert elapsed < 0.5
+
+    def test_slow_handler_does_not_block_caller(self, tmp_path, restore_root_logger):
+        """輸出端阻塞時，呼叫 logger 的執行緒仍立即返回"""
+        blocking = _BlockingHandler()
+        with patch.object(logging_setup, "_build_file_handler", return_value=blocking):
+            setup_logging(log_dir=str(tmp_path), level="INFO", json_format=False, queue_size=100)
+        logger = logging.getLogger("test.slow")
+        try:
+            started = time.perf_counter()
+            for i in range(20):
+                logger.info("訊息 %d", i)
+            elapsed = time.perf_counter() - started
+            assert elapsed < 0.5
+        finally:
+            blocking.unblock.set()
+        shutdown_logging()
+        assert len(blocking.records) == 20
+
+
+class TestSetupLogging:
+    """setup_logging 的輸出與輪替"""
+
+    def test_writes_json_with_request_context(self, tmp_path, restore_root_logger):
+        """紀錄經由背景執行緒寫入檔案，並帶有請求上下文欄位"""
+        setup_logging(log_dir=str(tmp_path), level="INFO", json_format=True)
+        logging.getLogger("test.json").info("哈囉", extra={"stage": "unit"})
+        shutdown_logging()
+
+        with open(tmp_path / "taiko_advisor.log", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        record = next(line for line in lines if line["logger"] == "test.json")
+        assert record["message"] == "哈囉"
+        assert record["stage"] == "unit"
+        assert "request_id" not in record or record["request_id"] is None
+
+    def test_size_rotation(self, tmp_path, restore_root_logger):
+        """超過 LOG_MAX_BYTES 時輪替並保留 LOG_BACKUP_COUNT 個備份"""
+        with patch("config.LOG_ROTATION", "size"), patch("config.LOG_MAX_BYTES", 512), patch(
+            "config.LOG_BACKUP_COUNT", 2
+        ):
+            setup_logging(log_dir=str(tmp_path), level="INFO", json_format=False)
+        logger = logging.getLogger("test.rotate")
+        for i in range(100):
+            logger.info("輪替測試 %03d %s", i, "x" * 40)
+        shutdown_logging()
+
+        names = sorted(os.listdir(tmp_path))
+        assert names == ["taiko_advisor.log", "taiko_advisor.log.1", "taiko_advisor.log.2"]
+        assert os.path.getsize(tmp_path / "taiko_advisor.log") <= 512
+
+    def test_time_rotation_handler(self, tmp_path, restore_root_logger):
+        """LOG_ROTATION=time 時使用依時間輪替的檔案處理器"""
+        with patch("config.LOG_ROTATION", "time"), patch("config.LOG_ROTATE_WHEN", "midnight"):
+            setup_logging(log_dir=str(tmp_path), level="INFO", json_format=False)
+        file_handlers = [
+            h for h in logging_setup._listener.handlers if isinstance(h, logging.FileHandler)
+        ]
+        assert isinstance(file_handlers[0], logging.handlers.TimedRotatingFileHandler)
+
+    def test_setup_is_idempotent(self, tmp_path, restore_root_logger):
+        """重複呼叫不會在根 logger 上累積多個佇列處理器"""
+        setup_logging(log_dir=str(tmp_path), json_format=False)
+        setup_logging(log_dir=str(tmp_path), json_format=False)
+        root = logging.getLogger()
+        assert sum(isinstance(h, DroppingQueueHandler) for h in root.handlers) == 1
+        assert logging_stats()["dropped"] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 os.fork")
+class TestLogChannel:
+    """pre-fork：worker 的紀錄由主程序統一寫入"""
+
+    @staticmethod
+    def _fork_worker(channel, count):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                logging_setup.attach_log_channel(channel, "worker")
+                setup_logging(json_format=True)
+                logger = logging.getLogger("test.worker")
+                for i in range(count):
+                    logger.info("worker 訊息 %03d %s", i, "x" * 40)
+                shutdown_logging()
+                code = 0
+            finally:
+                os._exit(code)
+        return pid
+
+    def test_workers_forward_to_master(self, tmp_path, restore_root_logger):
+        """worker 不開啟日誌檔；紀錄連同 worker pid 由主程序寫入，輪替時不遺失"""
+        channel = logging_setup.LogChannel()
+        try:
+            with patch("config.LOG_ROTATION", "size"), patch("config.LOG_MAX_BYTES", 4096), patch(
+                "config.LOG_BACKUP_COUNT", 50
+            ):
+                logging_setup.attach_log_channel(channel, "master")
+                setup_logging(log_dir=str(tmp_path), level="INFO", json_format=True)
+                pids = [self._fork_worker(channel, 100) for _ in range(2)]
+                for pid in pids:
+                    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+                shutdown_logging()
+        finally:
+            logging_setup.attach_log_channel(None)
+            channel.close()
+
+        records = []
+        for name in os.listdir(tmp_path):
+            with open(tmp_path / name, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        worker_records = [r for r in records if r["logger"] == "test.worker"]
+        assert len(os.listdir(tmp_path)) > 1
+        assert {r["worker_pid"] for r in worker_records} == set(pids)
+        for pid in pids:
+            messages = sorted(r["message"] for r in worker_records if r["worker_pid"] == pid)
+            assert messages == [f"worker 訊息 {i:03d} {'x' * 40}" for i in range(100)]
+
+    def test_worker_has_no_file_handler(self, tmp_path, restore_root_logger):
+        channel = logging_setup.LogChannel()
+        try:
+            logging_setup.attach_log_channel(channel, "worker")
+            setup_logging(log_dir=str(tmp_path), json_format=False)
+            handlers = logging_setup._listener.handlers
+            assert [type(h) for h in handlers] == [logging_setup.LogForwardingHandler]
+            shutdown_logging()
+        finally:
+            logging_setup.attach_log_channel(None)
+            channel.close()
@@ -0,0 +1,126 @@
+"""
+Prometheus 指標測試
+
+驗證 /metrics 端點、聊天各階段的指標紀錄與多程序彙總。
+"""
+import os
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from lib.metrics import REGISTRY, render_metrics
+
+
+def sample(name: str, labels: dict = None) -> float:
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+class TestMetricsEndpoint:
+    """/metrics 端點測試"""
+
+    def test_metrics_exposed_in_prometheus_format(self, monkeypatch):
+        import config
+        from server import app
+
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "s3cret")
+        response = TestClient(app).get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "taiko_chroma_query_seconds_bucket" in response.text
+        assert "taiko_streams_cancelled_total" in response.text
+
+    def test_metrics_require_admin_token(self, monkeypatch):
+        import config
+        from server import app
+
+        client = TestClient(app)
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "")
+        assert client.get("/metrics").status_code == 404
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "s3cret")
+        assert client.get("/metrics").status_code == 400
+        assert client.get("/metrics", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+
+class TestStageMetrics:
+    """各階段指標紀錄測試"""
+
+    def test_candidate_fallback_counted(self):
+        from lib.services.chat_service import get_candidate_songs
+
+        before = sample("taiko_candidate_fallback_total")
+        get_candidate_songs("hello", None, [{"title": "a"}, {"title": "b"}])
+        assert sample("taiko_candidate_fallback_total") == before + 1
+
+    def test_user_store_lock_wait_recorded(self, temp_db_path, monkeypatch):
+        import config
+        from lib.services.user_service import load_users, save_users
+
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        before = sample("taiko_user_store_lock_wait_seconds_count", {"operation": "load"})
+        save_users({})
+        load_users()
+        assert sample("taiko_user_store_lock_wait_seconds_count", {"operation": "load"}) == before + 1
+        assert sample("taiko_user_store_seconds_count", {"operation": "save"}) >= 1
+
+    def test_chat_request_records_stage_metrics(self, monkeypatch):
+        from server import app
+        from api.chat import route as chat_route
+        from lib.rate_limiter import limiter
+
+        class FakeChunk:
+            def __init__(self, text: str):
+                self.text = text
+
+        class FakeModels:
+            @staticmethod
+            def generate_content_stream(model, contents):
+                return [FakeChunk("推薦"), FakeChunk("這首歌")]
+
+        class FakeClient:
+            models = FakeModels()
+
+        monkeypatch.setattr(chat_route, "validate_token", lambda code: True)
+        monkeypatch.setattr(chat_route, "get_user_profile", lambda code: None)
+        monkeypatch.setattr(chat_route.config, "ANSWER_CACHE_ENABLED", False)
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+        limiter._storage.reset()
+
+        prompts_before = sample("taiko_prompt_size_bytes_count")
+        streams_before = sample("taiko_stream_duration_seconds_count", {"outcome": "completed"})
+        chunks_before = sample("taiko_stream_chunks_sum")
+        try:
+            response = TestClient(app).post(
+                "/api/chat", json={"message": "hello"}, headers={"Authorization": "Bearer test-code"}
+            )
+        finally:
+            app.dependency_overrides.clear()
+            limiter._storage.reset()
+
+        assert response.text == "推薦這首歌"
+        assert sample("taiko_prompt_size_bytes_count") == prompts_before + 1
+        assert sample("taiko_prompt_build_seconds_count") >= 1
+        assert sample("taiko_stream_duration_seconds_count", {"outcome": "completed"}) == streams_before + 1
+        assert sample("taiko_stream_chunks_sum") == chunks_before + 2
+        assert any(
+            metric.name == "taiko_llm_ttft_seconds" and metric.samples
+            for metric in REGISTRY.collect()
+        )
+
+
+class TestMultiprocess:
+    """多程序模式測試"""
+
+    def test_values_aggregated_across_processes(self, tmp_path):
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), VALIDATE_CONFIG="false")
+        script = "from lib.metrics import CANDIDATE_FALLBACK_TOTAL; CANDIDATE_FALLBACK_TOTAL.inc(3)"
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+        render = (
+            "from lib.metrics import render_metrics; "
+            "print(render_metrics()[0].decode())"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", render], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        assert "taiko_candidate_fallback_total 6.0" in output
@@ -0,0 +1,252 @@
+"""
+ASGI 中間件測試
+
+驗證安全標頭注入、請求體積限制（包含沒有 Content-Length 的 chunked 請求）
+與串流安全的回應壓縮。
+"""
+import asyncio
+import gzip
+import json
+import time
+import zlib
+import brotli
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from lib.middleware import CompressionMiddleware, LimitRequestSizeMiddleware, SecurityHeadersMiddleware
+
+
+def build_app(max_size: int = 16) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        body = await request.body()
+        return {"size": len(body), "nonce": request.state.csp_nonce}
+
+    @app.get("/stream")
+    async def stream():
+        async def generate():
+            for i in range(3):
+                yield f"{i}"
+        return StreamingResponse(generate(), media_type="text/plain")
+
+    app.add_middleware(LimitRequestSizeMiddleware, max_size=max_size)
+    app.add_middleware(SecurityHeadersMiddleware)
+    return app
+
+
+def call(app, method: str, path: str, chunks=(), headers=()):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), *headers],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+    }
+    pending = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ] or [{"type": "http.request", "body": b"", "more_body": False}]
+    messages = []
+
+    async def receive():
+        if pending:
+            return pending.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = next(m for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return start["status"], dict((k.decode(), v.decode()) for k, v in start["headers"]), body
+
+
+class TestRequestSizeLimit:
+    """請求體積限制測試"""
+
+    def test_chunked_body_over_limit_rejected(self):
+        status, _, body = call(build_app(), "POST", "/echo", chunks=[b"x" * 10, b"x" * 10])
+        assert status == 413
+        assert "error" in json.loads(body)
+
+    def test_chunked_body_within_limit_accepted(self):
+        status, _, body = call(build_app(), "POST", "/echo", chunks=[b"x" * 8, b"x" * 8])
+        assert status == 200
+        assert json.loads(body)["size"] == 16
+
+    def test_content_length_over_limit_rejected(self):
+        status, _, _ = call(
+            build_app(), "POST", "/echo", chunks=[b"x"], headers=[(b"content-length", b"100")]
+        )
+        assert status == 413
+
+    def test_invalid_content_length_rejected(self):
+        status, _, _ = call(
+            build_app(), "POST", "/echo", chunks=[b"x"], headers=[(b"content-length", b"abc")]
+        )
+        assert status == 400
+
+
+class TestSecurityHeaders:
+    """安全標頭中間件測試"""
+
+    def test_nonce_in_state_matches_csp(self):
+        status, headers, body = call(build_app(), "POST", "/echo", chunks=[b"{}"])
+        assert status == 200
+        nonce = json.loads(body)["nonce"]
+        assert f"'nonce-{nonce}'" in headers["content-security-policy"]
+        assert headers["x-frame-options"] == "DENY"
+
+    def test_streaming_response_gets_headers(self):
+        status, headers, body = call(build_app(), "GET", "/stream")
+        assert status == 200
+        assert body == b"012"
+        assert headers["x-content-type-options"] == "nosniff"
+
+    def test_rejected_request_gets_headers(self):
+        status, headers, _ = call(build_app(), "POST", "/echo", chunks=[b"x" * 20, b"x"])
+        assert status == 413
+        assert "content-security-policy" in headers
+
+
+def build_compressed_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/big")
+    async def big():
+        return {"songs": ["太鼓の達人"] * 200}
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/chat")
+    async def chat():
+        async def generate():
+            yield "第一段"
+            for i in range(3):
+                await asyncio.sleep(0.1)
+                yield f"第{i + 2}段"
+        return StreamingResponse(generate(), media_type="text/plain")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+    return app
+
+
+def first_chunk_latency(app, accept_encoding: bytes):
+    """回傳首個非空區塊的延遲、回應標頭與所有 body 區塊。"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/chat",
+        "raw_path": b"/chat",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), (b"accept-encoding", accept_encoding)],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+    }
+    started = time.perf_counter()
+    first_at = None
+    headers = {}
+    chunks = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal first_at, headers
+        if message["type"] == "http.response.start":
+            headers = dict((k.decode(), v.decode()) for k, v in message["headers"])
+        elif message.get("body"):
+            if first_at is None:
+                first_at = time.perf_counter() - started
+            chunks.append(message["body"])
+
+    asyncio.run(app(scope, receive, send))
+    return first_at, headers, chunks
+
+
+class TestCompression:
+    """回應壓縮中間件測試"""
+
+    def test_large_json_is_compressed(self):
+        status, headers, body = call(
+            build_compressed_app(), "GET", "/big", headers=[(b"accept-encoding", b"gzip")]
+        )
+        assert status == 200
+        assert headers["content-encoding"] == "gzip"
+        assert headers["content-length"] == str(len(body))
+        assert json.loads(gzip.decompress(body))["songs"][0] == "太鼓の達人"
+
+    def test_small_json_is_not_compressed(self):
+        status, headers, body = call(
+            build_compressed_app(), "GET", "/small", headers=[(b"accept-encoding", b"gzip")]
+        )
+        assert "content-encoding" not in headers
+        assert json.loads(body) == {"ok": True}
+
+    def test_each_stream_chunk_is_decodable_immediately(self):
+        _, headers, chunks = first_chunk_latency(build_compressed_app(), b"gzip")
+        assert headers["content-encoding"] == "gzip"
+        decoder = zlib.decompressobj(31)
+        # 每個區塊送出時即可解壓出對應的文字，不需等待串流結束。
+        assert decoder.decompress(chunks[0]).decode() == "第一段"
+        assert decoder.decompress(chunks[1]).decode() == "第2段"
+
+    def test_brotli_stream_chunks_are_flushed(self):
+        _, headers, chunks = first_chunk_latency(build_compressed_app(), b"br, gzip")
+        assert headers["content-encoding"] == "br"
+        decoder = brotli.Decompressor()
+        assert decoder.process(chunks[0]).decode() == "第一段"
+
+    def test_first_byte_latency_unchanged(self):
+        plain_latency, _, _ = first_chunk_latency(build_compressed_app(), b"identity")
+        gzip_latency, _, _ = first_chunk_latency(build_compressed_app(), b"gzip")
+        # 後續區塊間隔 0.1 秒；若串流被緩衝，首個位元組至少會延遲 0.3 秒。
+        assert gzip_latency < 0.05
+        assert gzip_latency - plain_latency < 0.02
+
+    def test_precompressed_response_passes_through(self):
+        from fastapi.responses import Response
+
+        app = FastAPI()
+
+        @app.get("/asset")
+        async def asset():
+            return Response(
+                gzip.compress(b"x" * 2000), media_type="text/plain", headers={"Content-Encoding": "gzip"}
+            )
+
+        app.add_middleware(CompressionMiddleware, minimum_size=500)
+        _, headers, body = call(app, "GET", "/asset", headers=[(b"accept-encoding", b"br, gzip")])
+        assert headers["content-encoding"] == "gzip"
+        assert gzip.decompress(body) == b"x" * 2000
+
+    def test_compressed_response_gets_weak_etag(self):
+        from fastapi.responses import Response
+
+        app = FastAPI()
+
+        @app.get("/page")
+        async def page():
+            return Response("太鼓" * 1000, media_type="text/html", headers={"ETag": '"abc123"'})
+
+        app.add_middleware(CompressionMiddleware, minimum_size=500)
+        _, headers, _ = call(app, "GET", "/page", headers=[(b"accept-encoding", b"gzip")])
+        assert headers["content-encoding"] == "gzip"
+        assert headers["etag"] == 'W/"abc123"'
+        _, headers, _ = call(app, "GET", "/page", headers=[(b"accept-encoding", b"identity")])
+        assert headers["etag"] == '"abc123"'
@@ -0,0 +1,263 @@
+"""
+pre-fork 啟動器與共用資料測試
+
+啟動器測試以子程序實際執行 launcher.py（僅限支援 fork 的平台）。
+"""
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+import pytest
+from unittest.mock import MagicMock
+from lib import dependencies
+from lib.exceptions import ResourceReloadError
+from lib.prefork import PreforkServer
+from lib.services.chat_service import get_candidate_songs
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 os.fork")
+
+
+@pytest.fixture
+def songs_file(tmp_path):
+    path = tmp_path / "songs.json"
+    path.write_text(json.dumps([{"id": 1, "title": "紅蓮華"}, {"id": "2", "title": "夏祭り"}], ensure_ascii=False))
+    return str(path)
+
+
+class TestSharedData:
+    """主程序預載的唯讀資料"""
+
+    def test_load_shared_data_builds_id_index(self, songs_file, monkeypatch):
+        """歌曲以字串 ID 建立索引，init_resources 不會重新載入"""
+        monkeypatch.setattr(dependencies.config, "QUERY_ENCODER_ENABLED", False)
+        try:
+            dependencies.load_shared_data(songs_file)
+            assert dependencies.get_song_by_id("1").title == "紅蓮華"
+            assert dependencies.get_song_by_id("2").title == "夏祭り"
+            assert dependencies.get_song_by_id("3") is None
+        finally:
+            dependencies.cleanup_resources()
+        assert dependencies.get_song_by_id("1") is None
+
+    def test_candidates_use_query_encoder_and_id_index(self, songs_file, monkeypatch):
+        """有查詢編碼模型時以向量查詢，並以 ID 索引取得歌曲"""
+        from lib.embeddings import query_encoder
+
+        monkeypatch.setattr(dependencies.config, "QUERY_ENCODER_ENABLED", False)
+        dependencies.load_shared_data(songs_file)
+        monkeypatch.setattr(query_encoder, "encode", lambda texts: [[0.1, 0.2]])
+        collection = MagicMock()
+        collection.query.return_value = {"ids": [["2", "9"]], "metadatas": [[{}, {"json": '{"title": "舊資料"}'}]]}
+        try:
+            songs = get_candidate_songs("祭典", collection, [])
+        finally:
+            dependencies.cleanup_resources()
+
+        assert collection.query.call_args.kwargs["query_embeddings"] == [[0.1, 0.2]]
+        assert [song.title for song in songs] == ["夏祭り", "舊資料"]
+
+    def test_strict_reload_keeps_current_data(self, songs_file, tmp_path):
+        """主程序重新載入失敗時拋出例外並保留目前的歌曲"""
+        try:
+            dependencies.load_shared_data(songs_file)
+            with pytest.raises(ResourceReloadError):
+                dependencies.load_shared_data(str(tmp_path / "missing.json"), strict=True)
+            assert dependencies.get_song_by_id("1").title == "紅蓮華"
+        finally:
+            dependencies.cleanup_resources()
+
+    def test_delegated_reload_disables_worker_watcher(self):
+        watcher = dependencies.ResourceWatcher(0.01)
+        dependencies.delegate_reload_to_master()
+        try:
+            watcher.start()
+            assert watcher._task is None
+        finally:
+            dependencies.cleanup_resources()
+        assert not dependencies.reload_delegated()
+
+
+class TestMasterReload:
+    """主程序監看共用資料的來源檔案"""
+
+    @staticmethod
+    def make_server(state, reload):
+        server = PreforkServer(
+            load_app=lambda: None,
+            preload=lambda: None,
+            reload=reload,
+            sources=lambda: state["sources"],
+            watch_interval=0.001,
+        )
+        server._children = {101: (0, 0.0)}
+        server._spawn_missing = lambda: state["spawned"].append(server._generation)
+        server._retire = lambda pid: state["retired"].append(pid)
+        server._prepare_shared_state(server.preload)
+        return server
+
+    def check(self, server):
+        time.sleep(0.002)
+        server._check_sources()
+
+    def test_reloads_after_change_settles(self):
+        state = {"sources": "v1", "spawned": [], "retired": []}
+        reloads = []
+        server = self.make_server(state, lambda: reloads.append(state["sources"]))
+        self.check(server)
+        assert reloads == []
+
+        state["sources"] = "v2"
+        self.check(server)
+        # 第一次看到變更時等待下一次檢查，確認寫入已完成
+        assert reloads == []
+        self.check(server)
+        assert reloads == ["v2"]
+        assert state == {"sources": "v2", "spawned": [1], "retired": [101]}
+        self.check(server)
+        assert reloads == ["v2"]
+
+    def test_failed_reload_keeps_workers(self):
+        state = {"sources": "v1", "spawned": [], "retired": []}
+        attempts = []
+
+        def failing_reload():
+            attempts.append(1)
+            raise ResourceReloadError("歌曲資料為空")
+
+        server = self.make_server(state, failing_reload)
+        state["sources"] = "broken"
+        for _ in range(4):
+            self.check(server)
+        assert attempts == [1]
+        assert server._generation == 0
+        assert state["retired"] == []
+
+
+class TestLauncher:
+    """launcher.py 的 worker 管理"""
+
+    @pytest.fixture
+    def launch(self, songs_file, tmp_path):
+        processes = []
+
+        def start(*args, **env_overrides):
+            env = dict(
+                os.environ,
+                VALIDATE_CONFIG="false",
+                SONGS_DB_PATH=songs_file,
+                USERS_DB_PATH=str(tmp_path / "users.json"),
+                CHROMA_DB_PATH=str(tmp_path / "chroma"),
+                LOG_DIR=str(tmp_path / "logs"),
+                LOG_FORMAT="text",
+                RATE_LIMIT_STORAGE_URI="memory://",
+                QUERY_ENCODER_ENABLED="false",
+                READINESS_PROBE_INTERVAL_SECONDS="60",
+                **env_overrides,
+            )
+            process = subprocess.Popen(
+                [sys.executable, "launcher.py", "--port", "0", *args],
+                cwd=PROJECT_ROOT,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            processes.append(process)
+            port = self._wait_for_port(tmp_path / "logs" / "taiko_advisor.log")
+            return process, port
+
+        yield start
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    @staticmethod
+    def _wait_for_port(log_path, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if log_path.exists():
+                match = re.search(r"監聽 [\d.]+:(\d+)", log_path.read_text(encoding="utf-8"))
+                if match:
+                    return int(match.group(1))
+            time.sleep(0.1)
+        raise AssertionError("啟動器未在期限內開始監聽")
+
+    @staticmethod
+    def _worker_pids(process, count, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with open(f"/proc/{process.pid}/task/{process.pid}/children") as f:
+                pids = {int(pid) for pid in f.read().split()}
+            if len(pids) == count:
+                return pids
+            time.sleep(0.1)
+        raise AssertionError("worker 數量不符")
+
+    @staticmethod
+    def _get(port, path="/livez", timeout=30):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+                    return response.status
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="以 /proc 查詢子程序")
+    def test_recycle_reload_and_shutdown(self, launch):
+        """worker 達到請求上限後被替換、SIGHUP 換上新一代 worker、SIGTERM 正常結束"""
+        process, port = launch("--workers", "2", "--max-requests", "3", "--max-requests-jitter", "0")
+        first = self._worker_pids(process, 2)
+
+        for _ in range(20):
+            assert self._get(port) == 200
+        time.sleep(1)
+        recycled = self._worker_pids(process, 2)
+        assert recycled != first
+
+        process.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            current = self._worker_pids(process, 2)
+            if not current & recycled:
+                break
+            time.sleep(0.2)
+        assert not current & recycled
+        assert self._get(port) == 200
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=60) == 0
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="以 /proc 查詢子程序")
+    def test_master_reloads_on_file_change(self, launch, songs_file, tmp_path):
+        """songs.json 變更時由主程序重新載入並替換 worker；worker 的日誌由主程序寫入同一個檔案"""
+        process, port = launch("--workers", "2", RESOURCE_WATCH_INTERVAL_SECONDS="0.2")
+        first = self._worker_pids(process, 2)
+        assert self._get(port) == 200
+
+        with open(songs_file, "w", encoding="utf-8") as f:
+            json.dump([{"id": 1, "title": "紅蓮華"}, {"id": 3, "title": "新曲"}], f, ensure_ascii=False)
+        deadline = time.monotonic() + 30
+        current = first
+        while time.monotonic() < deadline and current & first:
+            time.sleep(0.2)
+            current = self._worker_pids(process, 2)
+        assert not current & first
+        assert self._get(port) == 200
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=60) == 0
+        log_dir = tmp_path / "logs"
+        assert os.listdir(log_dir) == ["taiko_advisor.log"]
+        log = (log_dir / "taiko_advisor.log").read_text(encoding="utf-8")
+        assert "重新載入共用資料並替換 worker (檔案變更)" in log
+        # 每個 worker 的 lifespan 都會記錄啟動訊息
+        assert log.count("啟動 Taiko AI Advisor...") >= 4
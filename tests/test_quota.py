@@ -0,0 +1,238 @@
+"""
+token 用量配額測試
+
+涵蓋 token bucket 的補充與欠額、預扣與結算、多個 worker 共用餘額、
+用量寫回用戶資料，以及聊天端點的配額標頭與 429 回應。
+"""
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from filelock import FileLock, Timeout
+import config
+from lib.services import user_service
+from lib.services.quota_service import QuotaExceededError, QuotaService, TokenBucket
+from lib.services.user_service import get_user, save_users
+
+
+@pytest.fixture
+def user_store(temp_db_path, monkeypatch):
+    monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+    save_users({"quota-code": {"created_at": time.time(), "profile": None, "chat_sessions": []}})
+    return temp_db_path
+
+
+@pytest.fixture
+def quota_path(tmp_path):
+    return str(tmp_path / "quota.db")
+
+
+def make_service(quota_path, **overrides):
+    options = {"per_minute": 1000, "per_day": 10000, "flush_interval": 30, "path": quota_path, **overrides}
+    return QuotaService(**options)
+
+
+class TestTokenBucket:
+    """token bucket"""
+
+    def test_refill_is_capped(self):
+        """依時間補充，且不超過容量"""
+        bucket = TokenBucket(60, 60, tokens=0, updated_at=100.0)
+        bucket.refill(110.0)
+        assert bucket.tokens == pytest.approx(10)
+        bucket.refill(1000.0)
+        assert bucket.tokens == 60
+
+    def test_seconds_until(self):
+        """計算補充到指定額度所需的秒數"""
+        bucket = TokenBucket(60, 60, tokens=-30, updated_at=0.0)
+        assert bucket.seconds_until(10) == pytest.approx(40)
+
+
+class TestQuotaService:
+    """預扣、結算與寫回"""
+
+    def test_light_user_can_burst(self, user_store, quota_path):
+        """容量內的請求可以連續送出"""
+        service = make_service(quota_path)
+        for _ in range(4):
+            remaining = service.reserve("quota-code", 200)
+        assert remaining == {"minute": 200, "day": 9200}
+
+    def test_exhausted_minute_bucket_raises(self, user_store, quota_path):
+        """每分鐘額度不足時拋出 QuotaExceededError 並附帶重試秒數"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 900)
+        with pytest.raises(QuotaExceededError) as exc_info:
+            service.reserve("quota-code", 500)
+        assert exc_info.value.status_code == 429
+        assert 1 <= exc_info.value.retry_after <= 60
+
+    def test_output_tokens_create_debt(self, user_store, quota_path):
+        """輸出 token 在結算時補扣，可使餘額為負並阻擋下一次請求"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 100)
+        service.settle("quota-code", 100, prompt_tokens=150, output_tokens=1000)
+        assert service.remaining("quota-code")["minute"] == 0
+        with pytest.raises(QuotaExceededError):
+            service.reserve("quota-code", 10)
+
+    def test_refund(self, user_store, quota_path):
+        """上游未開始生成時退回預扣量"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 300)
+        service.refund("quota-code", 300)
+        assert service.remaining("quota-code") == {"minute": 1000, "day": 10000}
+
+    def test_oversized_prompt_allowed_with_full_bucket(self, user_store, quota_path):
+        """超過容量的單一請求在餘額全滿時仍可送出"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 1500)
+        with pytest.raises(QuotaExceededError):
+            service.reserve("quota-code", 1500)
+
+    def test_flush_persists_usage(self, user_store, quota_path):
+        """用量統計寫回用戶資料；餘額保存在配額檔案中，重新啟動後仍有效"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 400)
+        service.settle("quota-code", 400, prompt_tokens=None, output_tokens=100)
+        assert service.flush() == 1
+        assert service.flush() == 0
+
+        quota = get_user("quota-code")["quota"]
+        assert quota["usage"]["requests"] == 1
+        assert quota["usage"]["input_tokens"] == 400
+        assert quota["usage"]["output_tokens"] == 100
+
+        restarted = make_service(quota_path)
+        assert restarted.remaining("quota-code")["day"] == pytest.approx(9500, abs=2)
+
+    def test_workers_share_buckets(self, user_store, quota_path):
+        """多個 worker 共用同一份餘額，不會各自擁有完整額度"""
+        worker_a = make_service(quota_path)
+        worker_b = make_service(quota_path)
+        worker_a.reserve("quota-code", 600)
+        with pytest.raises(QuotaExceededError):
+            worker_b.reserve("quota-code", 600)
+        assert worker_b.remaining("quota-code")["minute"] == pytest.approx(400, abs=2)
+
+    def test_flush_merges_workers(self, user_store, quota_path):
+        """兩個 worker 的用量統計在寫回時彙總"""
+        worker_a = make_service(quota_path)
+        worker_b = make_service(quota_path)
+        worker_a.reserve("quota-code", 300)
+        worker_b.reserve("quota-code", 500)
+        worker_a.flush()
+        worker_b.flush()
+
+        assert get_user("quota-code")["quota"]["usage"]["input_tokens"] == 800
+        assert get_user("quota-code")["quota"]["usage"]["requests"] == 2
+
+    def test_flush_holds_lock_across_update(self, user_store, quota_path, monkeypatch):
+        """寫回時從讀取到寫入都持有檔案鎖，其他程序無法在中間寫入"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 100)
+        original_write = user_service._write_users_file
+        lock_held = []
+
+        def checked_write(users):
+            try:
+                with FileLock(user_store + ".lock", timeout=0):
+                    lock_held.append(False)
+            except Timeout:
+                lock_held.append(True)
+            original_write(users)
+
+        monkeypatch.setattr(user_service, "_write_users_file", checked_write)
+        assert service.flush() == 1
+        assert lock_held == [True]
+
+    def test_flush_drops_deleted_users(self, user_store, quota_path):
+        """已刪除的用戶不會被寫回，配額狀態也一併清除"""
+        service = make_service(quota_path)
+        service.reserve("quota-code", 100)
+        save_users({})
+        assert service.flush() == 0
+        assert get_user("quota-code") is None
+        assert service.remaining("quota-code") == {"minute": 1000, "day": 10000}
+
+    def test_forget_on_logout(self, user_store, quota_path, monkeypatch):
+        """登出時刪除配額狀態與尚未寫回的用量"""
+        from lib.auth import token_manager
+        service = make_service(quota_path)
+        monkeypatch.setattr("lib.services.quota_service.quota_service", service)
+        service.reserve("quota-code", 100)
+        assert token_manager.logout_user("quota-code")
+        assert service.remaining("quota-code") == {"minute": 1000, "day": 10000}
+        assert service.flush() == 0
+
+    def test_full_buckets_are_purged(self, user_store, quota_path):
+        """已補滿的 bucket 會被刪除，配額檔案不會無限成長"""
+        service = make_service(quota_path, per_minute=1000, per_day=10000)
+        service.reserve("quota-code", 100)
+        service.refund("quota-code", 100)
+        service._next_purge = 0.0
+        service.reserve("other-code", 10)
+        rows = service._connection().execute("SELECT COUNT(*) FROM quota_buckets").fetchone()[0]
+        assert rows == 1
+
+
+class TestChatQuota:
+    """聊天端點的配額處理"""
+
+    @pytest.fixture(autouse=True)
+    def setup_chat(self, user_store, tmp_path, monkeypatch):
+        from server import app
+        from lib.rate_limiter import limiter
+        from api.chat import route as chat_route
+
+        class FakeUsage:
+            prompt_token_count = 50
+            candidates_token_count = 20
+
+        class FakeChunk:
+            text = "回覆"
+            usage_metadata = FakeUsage()
+
+        class FakeModels:
+            @staticmethod
+            def generate_content_stream(model, contents):
+                return [FakeChunk()]
+
+        class FakeClient:
+            models = FakeModels()
+
+        self.service = make_service(str(tmp_path / "quota.db"))
+        monkeypatch.setattr(chat_route, "quota_service", self.service)
+        monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+        limiter._storage.reset()
+        self.client = TestClient(app)
+        yield
+        limiter._storage.reset()
+        app.dependency_overrides.clear()
+
+    def test_headers_and_settlement(self):
+        """回應帶有剩餘額度標頭，串流結束後以上游回報的 token 數結算"""
+        with patch("api.chat.route.estimate_tokens", return_value=40):
+            response = self.client.post(
+                "/api/chat", json={"message": "推薦歌曲"}, headers={"Authorization": "Bearer quota-code"}
+            )
+        assert response.status_code == 200
+        assert response.headers["X-Quota-Remaining-Minute"] == "960"
+        assert response.headers["X-Quota-Remaining-Day"] == "9960"
+        # 預扣 40，上游回報輸入 50、輸出 20，共扣 70（結算在執行緒池中背景完成）。
+        deadline = time.monotonic() + 2
+        while self.service.remaining("quota-code")["day"] > 9931 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert self.service.remaining("quota-code")["day"] == pytest.approx(9930, abs=1)
+
+    def test_exhausted_quota_returns_429(self):
+        """額度不足時回傳 429 與 Retry-After，且不呼叫上游"""
+        self.service.reserve("quota-code", 1000)
+        response = self.client.post(
+            "/api/chat", json={"message": "推薦歌曲"}, headers={"Authorization": "Bearer quota-code"}
+        )
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,194 @@
+"""
+速率限制測試
+
+涵蓋 SQLite 共用儲存後端（含跨程序計數）、依存取代碼計數的鍵函式，
+以及在執行緒池中檢查限制的中間件。
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+from starlette.requests import Request
+from lib.rate_limit_storage import SQLiteStorage
+from lib.rate_limiter import rate_limit_key
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def storage_uri(tmp_path):
+    return f"sqlite://{tmp_path}/rate_limits.db"
+
+
+def make_request(authorization=None, client_host="198.51.100.1"):
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": (client_host, 1234)})
+
+
+class TestSQLiteStorage:
+    """SQLite 儲存後端"""
+
+    def test_registered_scheme(self, storage_uri):
+        """sqlite:// URI 會建立 SQLiteStorage"""
+        assert isinstance(storage_from_string(storage_uri), SQLiteStorage)
+
+    def test_counter_operations(self, storage_uri):
+        """incr / decr / get / clear / reset 的基本行為"""
+        storage = SQLiteStorage(storage_uri)
+        assert storage.incr("k", 60) == 1
+        assert storage.incr("k", 60, amount=2) == 3
+        assert storage.decr("k") == 2
+        assert storage.get("k") == 2
+        assert storage.get_expiry("k") > 0
+        storage.clear("k")
+        assert storage.get("k") == 0
+        storage.incr("a", 60)
+        storage.incr("b", 60)
+        assert storage.reset() == 2
+        assert storage.check()
+
+    def test_expired_counter_restarts(self, storage_uri):
+        """過期的計數視為不存在，下一次遞增重新從 1 開始"""
+        storage = SQLiteStorage(storage_uri)
+        storage.incr("k", 0.01, amount=5)
+        time.sleep(0.02)
+        assert storage.get("k") == 0
+        assert storage.incr("k", 60) == 1
+
+    def test_sliding_window_limit(self, storage_uri):
+        """sliding-window-counter 策略在額度用完後拒絕"""
+        limiter = SlidingWindowCounterRateLimiter(SQLiteStorage(storage_uri))
+        limit = parse("3/minute")
+        assert [limiter.hit(limit, "user") for _ in range(4)] == [True, True, True, False]
+        assert limiter.hit(limit, "other")
+        assert limiter.get_window_stats(limit, "user").remaining == 0
+
+    def test_fixed_window_limit(self, storage_uri):
+        """fixed-window 策略同樣可用"""
+        limiter = FixedWindowRateLimiter(SQLiteStorage(storage_uri))
+        limit = parse("2/minute")
+        assert [limiter.hit(limit, "user") for _ in range(3)] == [True, True, False]
+
+    def test_shared_between_instances(self, storage_uri):
+        """兩個 worker（各自的連線）共用同一份計數"""
+        limit = parse("4/minute")
+        worker_a = SlidingWindowCounterRateLimiter(SQLiteStorage(storage_uri))
+        worker_b = SlidingWindowCounterRateLimiter(SQLiteStorage(storage_uri))
+        results = [worker.hit(limit, "user") for worker in (worker_a, worker_b) * 3]
+        assert results.count(True) == 4
+
+    def test_shared_across_processes(self, storage_uri):
+        """多個程序同時打同一個鍵時，總放行數等於額度"""
+        script = (
+            "import sys, lib.rate_limit_storage\n"
+            "from limits import parse\n"
+            "from limits.storage import storage_from_string\n"
+            "from limits.strategies import SlidingWindowCounterRateLimiter\n"
+            "limiter = SlidingWindowCounterRateLimiter(storage_from_string(sys.argv[1]))\n"
+            "print(sum(limiter.hit(parse('25/minute'), 'shared') for _ in range(20)))\n"
+        )
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-c", script, storage_uri], cwd=PROJECT_ROOT, stdout=subprocess.PIPE, text=True
+            )
+            for _ in range(3)
+        ]
+        allowed = [int(p.communicate(timeout=60)[0]) for p in processes]
+        assert sum(allowed) == 25
+
+
+class TestRateLimitKey:
+    """鍵函式"""
+
+    def test_unauthenticated_uses_ip(self):
+        """沒有 Authorization 時以遠端 IP 計數"""
+        assert rate_limit_key(make_request()) == "ip:198.51.100.1"
+
+    def test_bearer_code_uses_hash(self):
+        """Bearer 存取代碼以雜湊值計數，同一 IP 的不同用戶各自獨立，鍵中不出現代碼本身"""
+        key_a = rate_limit_key(make_request("Bearer code-a"))
+        key_b = rate_limit_key(make_request("Bearer code-b"))
+        assert key_a.startswith("user:") and key_b.startswith("user:")
+        assert key_a != key_b
+        assert "code-a" not in key_a
+
+    def test_key_depends_only_on_request(self):
+        """驗證結果不影響鍵，每個 worker 對同一個請求算出相同的鍵"""
+        from lib.auth import validate_token
+
+        before = rate_limit_key(make_request("Bearer code-c", client_host="203.0.113.9"))
+        with patch("lib.auth.token_manager._validate_token", return_value=False):
+            validate_token("code-c")
+        assert rate_limit_key(make_request("Bearer code-c")) == before
+
+
+class TestRateLimitMiddleware:
+    """在執行緒池中檢查限制的中間件"""
+
+    @pytest.fixture
+    def app(self, monkeypatch):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from slowapi import Limiter
+        from slowapi.wrappers import LimitGroup
+        from slowapi.util import get_remote_address
+        from lib import rate_limiter
+        from lib.middleware import RateLimitMiddleware
+
+        test_limiter = Limiter(key_func=rate_limit_key, default_limits=["3/minute"], storage_uri="memory://")
+        test_limiter._application_limits = [
+            LimitGroup("5/minute", get_remote_address, "per-ip", False, None, None, None, 1, False)
+        ]
+        monkeypatch.setattr(rate_limiter, "limiter", test_limiter)
+        app = FastAPI()
+        app.state.limiter = test_limiter
+        app.add_middleware(RateLimitMiddleware)
+        self.check_threads = []
+        original_check = test_limiter._check_request_limit
+
+        def recording_check(*args, **kwargs):
+            self.check_threads.append(threading.get_ident())
+            return original_check(*args, **kwargs)
+
+        monkeypatch.setattr(test_limiter, "_check_request_limit", recording_check)
+
+        @app.get("/ping")
+        async def ping(request: Request):
+            self.loop_thread = threading.get_ident()
+            return {"ok": True}
+
+        @app.get("/limited")
+        @test_limiter.limit("1/minute")
+        async def limited(request: Request):
+            return {"ok": True}
+
+        return TestClient(app)
+
+    def test_checks_run_off_event_loop(self, app):
+        """限制檢查在執行緒池中執行，不在事件迴圈的執行緒上"""
+        assert app.get("/ping").status_code == 200
+        assert self.check_threads and self.loop_thread not in self.check_threads
+
+    def test_default_limit_per_code(self, app):
+        """預設限制以存取代碼計數，用完一個代碼不影響另一個"""
+        statuses = [app.get("/ping", headers={"Authorization": "Bearer a"}).status_code for _ in range(4)]
+        assert statuses == [200, 200, 200, 429]
+        assert app.get("/ping", headers={"Authorization": "Bearer b"}).status_code == 200
+
+    def test_per_ip_ceiling_stops_rotating_codes(self, app):
+        """輪換代碼也無法超過每個 IP 的總量上限"""
+        statuses = [
+            app.get("/ping", headers={"Authorization": f"Bearer forged-{i}"}).status_code for i in range(6)
+        ]
+        assert statuses == [200] * 5 + [429]
+
+    def test_route_limit_checked_once(self, app):
+        """@limiter.limit 的路由由中間件檢查，裝飾器不再重複計數"""
+        assert app.get("/limited").status_code == 200
+        assert app.get("/limited").status_code == 429
@@ -0,0 +1,170 @@
+"""
+資源熱重新載入測試
+
+測試 lib.dependencies 的資源快照替換、檔案監看器與 /api/admin 管理端點。
+"""
+import json
+import pytest
+from fastapi.testclient import TestClient
+import config
+from lib import dependencies
+from lib.dependencies import ResourceWatcher, get_snapshot, reload_resources
+from lib.exceptions import ResourceReloadError
+from lib.services.chat_service import get_candidate_songs
+
+
+class FakeCollection:
+    def __init__(self, name, ids):
+        self.name = name
+        self.ids = ids
+
+    def count(self):
+        return len(self.ids)
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10):
+        ids = self.ids[:n_results]
+        return {"ids": [ids], "metadatas": [[{"json": "{}"} for _ in ids]]}
+
+
+@pytest.fixture
+def resources(tmp_path, monkeypatch):
+    songs_path = tmp_path / "songs.json"
+    songs_path.write_text(json.dumps([{"id": 1, "title": "紅蓮華"}]), encoding="utf-8")
+    collections = {"current": FakeCollection("taiko_songs", ["1"])}
+    monkeypatch.setattr(config, "RESOURCE_RELOAD_TRIGGER_PATH", str(tmp_path / ".reload"))
+    monkeypatch.setattr(dependencies, "_open_collection", lambda path, name: collections["current"])
+    dependencies.init_resources("", str(tmp_path / "chroma"), "taiko_songs", str(songs_path), run_warmup=False)
+    yield songs_path, collections
+    dependencies.cleanup_resources()
+
+
+def write_songs(path, songs):
+    path.write_text(json.dumps(songs), encoding="utf-8")
+
+
+class TestSnapshotSwap:
+    """快照建立與替換"""
+
+    def test_reload_swaps_snapshot(self, resources):
+        songs_path, collections = resources
+        before = get_snapshot()
+        write_songs(songs_path, [{"id": 1, "title": "紅蓮華"}, {"id": 2, "title": "夏祭り"}])
+        collections["current"] = FakeCollection("taiko_songs", ["1", "2"])
+
+        after = reload_resources()
+        assert after.version == before.version + 1
+        assert get_snapshot() is after
+        assert dependencies.get_song_by_id("2").title == "夏祭り"
+        assert after.collection is collections["current"]
+        # 先前取得的快照維持原狀
+        assert len(before.songs) == 1
+        assert "2" not in before.songs_by_id
+
+    def test_failed_reload_keeps_current_snapshot(self, resources):
+        songs_path, collections = resources
+        current = get_snapshot()
+        songs_path.write_text("{壞掉的 JSON", encoding="utf-8")
+        with pytest.raises(ResourceReloadError):
+            reload_resources()
+        assert get_snapshot() is current
+
+    def test_empty_collection_is_rejected(self, resources):
+        songs_path, collections = resources
+        current = get_snapshot()
+        collections["current"] = FakeCollection("taiko_songs", [])
+        with pytest.raises(ResourceReloadError):
+            reload_resources()
+        assert get_snapshot() is current
+
+    def test_candidates_use_request_snapshot_index(self, resources):
+        snapshot = get_snapshot()
+        songs_by_id = {"1": {"id": 1, "title": "舊版"}}
+        songs = get_candidate_songs("推薦", snapshot.collection, None, songs_by_id)
+        assert songs == [{"id": 1, "title": "舊版"}]
+
+
+class TestResourceWatcher:
+    """檔案監看器"""
+
+    def test_reloads_after_change_is_stable(self, resources):
+        songs_path, _ = resources
+        watcher = ResourceWatcher(interval=0)
+        assert watcher.check() is False
+        version = get_snapshot().version
+
+        write_songs(songs_path, [{"id": 1}, {"id": 2}, {"id": 3}])
+        # 第一次看到變更時先等待，確認寫入已完成
+        assert watcher.check() is False
+        assert watcher.check() is True
+        assert get_snapshot().version == version + 1
+        assert len(get_snapshot().songs) == 3
+        assert watcher.check() is False
+
+    def test_trigger_file_causes_reload(self, resources):
+        watcher = ResourceWatcher(interval=0)
+        version = get_snapshot().version
+        dependencies.touch_reload_trigger()
+        watcher.check()
+        assert watcher.check() is True
+        assert get_snapshot().version == version + 1
+
+    def test_failed_version_is_not_retried(self, resources, monkeypatch):
+        songs_path, _ = resources
+        watcher = ResourceWatcher(interval=0)
+        calls = []
+        original = dependencies.reload_resources
+
+        def counting_reload(reason):
+            calls.append(reason)
+            return original(reason)
+
+        monkeypatch.setattr(dependencies, "reload_resources", counting_reload)
+        songs_path.write_text("[", encoding="utf-8")
+        for _ in range(4):
+            assert watcher.check() is False
+        assert len(calls) == 1
+
+
+class TestAdminEndpoints:
+    """/api/admin 管理端點"""
+
+    @pytest.fixture
+    def client(self, resources):
+        from server import app
+        from lib.rate_limiter import limiter
+        limiter.reset()
+        return TestClient(app)
+
+    def test_disabled_without_admin_token(self, client, monkeypatch):
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "")
+        assert client.post("/api/admin/reload", headers={"Authorization": "Bearer x"}).status_code == 404
+
+    def test_rejects_wrong_token(self, client, monkeypatch):
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "s3cret")
+        assert client.post("/api/admin/reload", headers={"Authorization": "Bearer nope"}).status_code == 401
+        assert client.post("/api/admin/reload").status_code == 400
+
+    def test_reload_swaps_and_touches_trigger(self, client, resources, monkeypatch):
+        import os
+
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "s3cret")
+        headers = {"Authorization": "Bearer s3cret"}
+        version = client.get("/api/admin/resources", headers=headers).json()["version"]
+
+        response = client.post("/api/admin/reload", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["version"] == version + 1
+        assert response.json()["collection"] == "taiko_songs"
+        assert os.path.exists(config.RESOURCE_RELOAD_TRIGGER_PATH)
+        # 本 worker 已載入觸發檔更新後的版本，監看器不會重複載入
+        watcher = ResourceWatcher(interval=0)
+        assert watcher.check() is False
+        assert watcher.check() is False
+
+    def test_failed_reload_returns_error(self, client, resources, monkeypatch):
+        songs_path, _ = resources
+        monkeypatch.setattr(config, "ADMIN_TOKEN", "s3cret")
+        songs_path.write_text("[]", encoding="utf-8")
+        response = client.post("/api/admin/reload", headers={"Authorization": "Bearer s3cret"})
+        assert response.status_code == 500
+        assert "歌曲資料為空" in response.json()["error"]
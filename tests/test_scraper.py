@@ -0,0 +1,195 @@
+"""
+爬蟲離線測試
+
+以 tests/fixtures/scraper/ 中儲存的類別頁面 HTML，由本機的 HTTP 替身伺服器提供，
+測試 scraper 的表格解析、並行抓取、暫時性錯誤重試與每個主機的禮貌排程；不連線到 wikiwiki.jp。
+"""
+import asyncio
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import scraper
+from scraper import HostPoliteness, PolitenessScheduler, parse_category_page, scrape_categories
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "scraper")
+
+
+def read_fixture(category):
+    with open(os.path.join(FIXTURES_DIR, f"{category}.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+class StandInWiki:
+    """提供儲存 HTML 的替身伺服器；failures 指定各類別前幾次請求回傳的錯誤狀態碼。"""
+
+    def __init__(self):
+        self.requests = []
+        self.failures = {}
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                category = urllib.parse.unquote(self.path.rsplit("/", 1)[-1])
+                stand_in.requests.append((category, time.monotonic()))
+                pending = stand_in.failures.get(category)
+                if pending:
+                    self.send_response(pending.pop(0))
+                    self.end_headers()
+                    return
+                path = os.path.join(FIXTURES_DIR, f"{category}.html")
+                if not os.path.exists(path):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                with open(path, "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/wiki/"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def count(self, category):
+        return sum(1 for name, _ in self.requests if name == category)
+
+
+@pytest.fixture
+def wiki(monkeypatch):
+    monkeypatch.setattr(scraper.config, "SCRAPER_RETRY_BACKOFF_SECONDS", 0.01)
+    stand_in = StandInWiki()
+    stand_in.thread.start()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+
+def scrape(wiki, categories, parse_workers=0, **scheduler):
+    options = {"max_in_flight": 2, "min_delay": 0, "jitter": 0, **scheduler}
+    return asyncio.run(
+        scrape_categories(
+            categories,
+            wiki.base_url,
+            PolitenessScheduler(**options),
+            parse_workers=parse_workers,
+        )
+    )
+
+
+class TestParseCategoryPage:
+    """類別頁面表格解析"""
+
+    def test_parses_rows_and_inner_oni(self):
+        url = "https://wikiwiki.jp/taiko-fumen/作品/新AC/ポップス"
+        songs = parse_category_page(read_fixture("ポップス"), "ポップス", url)
+
+        assert [song["title"] for song in songs] == ["紅蓮華", "夏祭り", "夏祭り (Inner Oni)", "ドラマツルギー"]
+        assert [song["id"] for song in songs] == [100001, 100002, 100003, 100004]
+        assert songs[0]["subtitle"] == "「鬼滅の刃」より"
+        assert songs[0]["difficulty"] == {"oni": 8}
+        assert songs[0]["detail_url"] == urllib.parse.urljoin(url, "../紅蓮華(おに)")
+        assert songs[1]["bpm"] == "9.38?-150"
+        assert songs[2]["difficulty"] == {"oni": 9}
+        assert songs[2]["features"] == ["Inner Oni"]
+
+    def test_page_without_table(self):
+        assert parse_category_page("<html><body>維護中</body></html>", "アニメ", "http://x/") == []
+
+
+class TestScrapeCategories:
+    """並行抓取與重試"""
+
+    def test_scrapes_categories_in_order(self, wiki):
+        songs = scrape(wiki, ["ポップス", "アニメ"], parse_workers=1)
+        genres = [song["genre"] for song in songs]
+        assert genres == ["ポップス"] * 4 + ["アニメ"] * 4
+        assert songs[4]["id"] == 300001
+
+    def test_retries_transient_errors(self, wiki):
+        wiki.failures["アニメ"] = [503, 429]
+        songs = scrape(wiki, ["アニメ"])
+        assert wiki.count("アニメ") == 3
+        assert len(songs) == 4
+
+    def test_failed_category_is_skipped(self, wiki, capsys):
+        songs = scrape(wiki, ["ポップス", "キッズ"])
+        # 404 不是暫時性錯誤，不重試
+        assert wiki.count("キッズ") == 1
+        assert {song["genre"] for song in songs} == {"ポップス"}
+        assert "爬取 キッズ 分類時發生錯誤" in capsys.readouterr().out
+
+    def test_gives_up_after_max_retries(self, wiki):
+        wiki.failures["アニメ"] = [500, 500, 500]
+        client_scheduler = PolitenessScheduler(1, 0, 0)
+
+        async def run():
+            async with scraper.httpx.AsyncClient() as client:
+                await scraper.fetch_page(client, client_scheduler, wiki.base_url + "アニメ", max_retries=1, backoff=0)
+
+        with pytest.raises(scraper.FetchError):
+            asyncio.run(run())
+        assert wiki.count("アニメ") == 2
+
+    def test_requests_to_same_host_are_spaced(self, wiki):
+        scrape(wiki, ["ポップス", "アニメ", "キッズ"], min_delay=0.05)
+        starts = sorted(started for _, started in wiki.requests)
+        assert all(later - earlier >= 0.04 for earlier, later in zip(starts, starts[1:]))
+
+
+class TestHostPoliteness:
+    """每個主機的禮貌排程"""
+
+    def test_limits_requests_in_flight(self):
+        politeness = HostPoliteness(max_in_flight=2, min_delay=0, jitter=0)
+        active = []
+        peak = []
+
+        async def request():
+            async with politeness.slot():
+                active.append(1)
+                peak.append(len(active))
+                await asyncio.sleep(0.01)
+                active.pop()
+
+        async def run():
+            await asyncio.gather(*(request() for _ in range(6)))
+
+        asyncio.run(run())
+        assert max(peak) == 2
+
+    def test_jitter_extends_spacing(self, monkeypatch):
+        monkeypatch.setattr(scraper.random, "uniform", lambda low, high: high)
+        politeness = HostPoliteness(max_in_flight=3, min_delay=0.02, jitter=0.03)
+        starts = []
+
+        async def request():
+            async with politeness.slot():
+                starts.append(time.monotonic())
+
+        async def run():
+            await asyncio.gather(*(request() for _ in range(3)))
+
+        asyncio.run(run())
+        assert all(later - earlier >= 0.045 for earlier, later in zip(starts, starts[1:]))
+
+    def test_hosts_are_scheduled_independently(self):
+        scheduler = PolitenessScheduler(1, 10, 0)
+
+        async def run():
+            async with scheduler.slot("http://a.example/1"):
+                pass
+            started = time.monotonic()
+            async with scheduler.slot("http://b.example/1"):
+                pass
+            return time.monotonic() - started
+
+        assert asyncio.run(run()) < 1
@@ -6,9 +6,13 @@
 注意：這些測試使用了實際的用戶數據庫文件，需要小心處理並發測試。
 在實際的生產環境中，應該使用 mock 或 monkeypatch 來避免文件系統交互。
 """
+import os
+from unittest.mock import patch
+import pytest
 from lib.services.user_service import (
     load_users, get_user_profile, update_user_profile,
-    user_exists, get_user_sessions, create_user, delete_user, save_users, delete_session
+    user_exists, get_user_sessions, create_user, delete_user, save_users, delete_session,
+    get_conversation, append_conversation_turns,
 )
 from lib.auth.token_manager import validate_token
 import config
@@ -120,3 +124,91 @@ class TestUserServiceEdgeCases:
         remaining_sessions = get_user_sessions("session_user")
         assert len(remaining_sessions) == 1
         assert remaining_sessions[0].get("title") == "missing-id"
+
+
+class TestConversationState:
+    """伺服器端對話狀態測試"""
+
+    @pytest.fixture(autouse=True)
+    def conversations_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "CONVERSATIONS_DIR", str(tmp_path / "conversations"))
+        return tmp_path / "conversations"
+
+    def test_append_creates_and_extends_conversation(self, temp_db_path, monkeypatch):
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+
+        assert get_conversation("conv_user", "c1") is None
+        append_conversation_turns("conv_user", "c1", [{"role": "user", "content": "一"}])
+        append_conversation_turns("conv_user", "c1", [{"role": "model", "content": "二"}])
+        assert [m["content"] for m in get_conversation("conv_user", "c1")] == ["一", "二"]
+
+    def test_conversation_messages_and_count_are_bounded(self, temp_db_path, monkeypatch):
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        monkeypatch.setattr(config, "CONVERSATION_MAX_MESSAGES", 3)
+        monkeypatch.setattr(config, "MAX_CONVERSATIONS_PER_USER", 2)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+
+        for i in range(5):
+            append_conversation_turns("conv_user", "c1", [{"role": "user", "content": str(i)}])
+        assert [m["content"] for m in get_conversation("conv_user", "c1")] == ["2", "3", "4"]
+
+        append_conversation_turns("conv_user", "c2", [{"role": "user", "content": "x"}])
+        append_conversation_turns("conv_user", "c3", [{"role": "user", "content": "y"}])
+        assert get_conversation("conv_user", "c1") is None
+        assert get_conversation("conv_user", "c3") is not None
+
+    def test_saved_session_seeds_conversation(self, temp_db_path, monkeypatch):
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        saved = {"id": "s1", "title": "t", "messages": [{"role": "user", "content": "舊"}]}
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": [saved]}})
+
+        assert get_conversation("conv_user", "s1") == saved["messages"]
+        append_conversation_turns("conv_user", "s1", [{"role": "user", "content": "新"}])
+        assert [m["content"] for m in get_conversation("conv_user", "s1")] == ["舊", "新"]
+
+    def test_append_does_not_rewrite_user_store(self, temp_db_path, monkeypatch, conversations_dir):
+        """每輪只附加到該對話的檔案，不重寫 users.json"""
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+        before = os.stat(temp_db_path).st_mtime_ns
+
+        with patch("lib.services.user_service.save_users") as save:
+            append_conversation_turns("conv_user", "c1", [{"role": "user", "content": "一"}])
+            append_conversation_turns("conv_user", "c1", [{"role": "model", "content": "二"}])
+        save.assert_not_called()
+        assert os.stat(temp_db_path).st_mtime_ns == before
+        files = list(conversations_dir.glob("*/c1.jsonl"))
+        assert len(files) == 1
+        assert len(files[0].read_text(encoding="utf-8").splitlines()) == 2
+
+    def test_log_is_compacted(self, temp_db_path, monkeypatch, conversations_dir):
+        """行數超過上限兩倍時壓縮為最近的訊息"""
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        monkeypatch.setattr(config, "CONVERSATION_MAX_MESSAGES", 3)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+
+        for i in range(7):
+            append_conversation_turns("conv_user", "c1", [{"role": "user", "content": str(i)}])
+        path = next(conversations_dir.glob("*/c1.jsonl"))
+        assert len(path.read_text(encoding="utf-8").splitlines()) == 3
+        assert [m["content"] for m in get_conversation("conv_user", "c1")] == ["4", "5", "6"]
+
+    def test_invalid_session_id_rejected(self, temp_db_path, monkeypatch, conversations_dir):
+        """不符合格式的對話 ID 不會用作檔名"""
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+
+        assert append_conversation_turns("conv_user", "../escape", [{"role": "user", "content": "x"}]) is False
+        assert get_conversation("conv_user", "../escape") is None
+        assert not conversations_dir.exists()
+
+    def test_delete_user_removes_conversations(self, temp_db_path, monkeypatch, conversations_dir):
+        monkeypatch.setattr(config, "USERS_DB_PATH", temp_db_path)
+        save_users({"conv_user": {"created_at": 1700000000, "profile": None, "chat_sessions": []}})
+        append_conversation_turns("conv_user", "c1", [{"role": "user", "content": "x"}])
+
+        assert delete_user("conv_user") is True
+        assert get_conversation("conv_user", "c1") is None
+        assert list(conversations_dir.glob("*/c1.jsonl")) == []
+
@@ -0,0 +1,99 @@
+"""
+歌曲快照測試
+
+測試 lib.song_snapshot 的編譯與 mmap 載入、攻略內文的延遲解碼，
+以及快照過期或損壞時改讀 songs.json。
+"""
+import json
+import os
+import pytest
+import config
+from lib import dependencies
+from lib.song_snapshot import SongSnapshot, build_snapshot, load_songs, snapshot_path
+from lib.songs import Song
+
+SONGS = [
+    {
+        "id": 100001,
+        "title": "紅蓮華",
+        "subtitle": "LiSA",
+        "genre": "アニメ",
+        "difficulty": {"oni": 8},
+        "bpm": "9.38?-150",
+        "detail_url": "https://example.com/1",
+        "features": ["變速", "連打"],
+        "description": "描述",
+        "max_combo": 0,
+        "strategy_text": "前半的連打要保留體力。" * 20,
+    },
+    {"id": "2", "title": "夏祭り", "genre": "ポップス", "bpm": 180, "difficulty": {"oni": 6, "ura": 9}, "source": "wiki"},
+    {"id": 3, "title": "空白攻略", "bpm": 172.5, "difficulty": {"oni": "10+"}, "features": ["變速"], "strategy_text": ""},
+]
+
+
+@pytest.fixture
+def songs_path(tmp_path):
+    path = tmp_path / "songs.json"
+    path.write_text(json.dumps(SONGS, ensure_ascii=False, indent=2), encoding="utf-8")
+    return str(path)
+
+
+def as_dicts(songs):
+    return [song.to_dict() for song in songs]
+
+
+class TestBuildAndLoad:
+    """快照編譯與載入"""
+
+    def test_round_trip_matches_songs_json(self, songs_path):
+        path = build_snapshot(songs_path)
+        assert path == snapshot_path(songs_path)
+        songs = SongSnapshot(path).songs()
+        assert as_dicts(songs) == [Song.from_dict(song).to_dict() for song in SONGS]
+        assert (songs[0].bpm_min, songs[0].bpm_max) == (9.38, 150.0)
+        assert songs[1].id == "2" and songs[2].bpm == 172.5
+        assert songs[0].genre is Song.from_dict({"genre": "アニメ"}).genre
+
+    def test_strategy_text_is_decoded_on_access(self, songs_path):
+        songs = SongSnapshot(build_snapshot(songs_path)).songs()
+        assert callable(songs[0]._strategy_text)
+        assert songs[0].strategy_text == SONGS[0]["strategy_text"]
+        assert songs[1].strategy_text is None
+        assert songs[2].strategy_text == ""
+
+    def test_load_songs_prefers_snapshot(self, songs_path, monkeypatch):
+        build_snapshot(songs_path)
+        monkeypatch.setattr("lib.song_snapshot.read_songs", lambda path: pytest.fail("不應讀取 songs.json"))
+        assert len(load_songs(songs_path)) == 3
+
+    def test_copied_songs_json_keeps_snapshot_fresh(self, songs_path):
+        snapshot = SongSnapshot(build_snapshot(songs_path))
+        stat = os.stat(songs_path)
+        os.utime(songs_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000))
+        assert snapshot.matches(songs_path)
+
+
+class TestFallback:
+    """快照無法使用時改讀 songs.json"""
+
+    def test_stale_snapshot_falls_back(self, songs_path):
+        build_snapshot(songs_path)
+        with open(songs_path, "w", encoding="utf-8") as f:
+            json.dump(SONGS + [{"id": 4, "title": "新曲"}], f, ensure_ascii=False)
+        assert [song.title for song in load_songs(songs_path)][-1] == "新曲"
+
+    def test_corrupt_snapshot_falls_back(self, songs_path):
+        with open(snapshot_path(songs_path), "wb") as f:
+            f.write(b"TKSS\x01")
+        assert len(load_songs(songs_path)) == 3
+
+    def test_disabled_reads_songs_json(self, songs_path, monkeypatch):
+        build_snapshot(songs_path)
+        monkeypatch.setattr(config, "SONGS_SNAPSHOT_ENABLED", False)
+        songs = load_songs(songs_path)
+        assert isinstance(songs[0]._strategy_text, str)
+
+    def test_rebuilding_snapshot_triggers_reload(self, songs_path):
+        before = dependencies.source_signature(songs_path)
+        build_snapshot(songs_path)
+        assert dependencies.source_signature(songs_path) != before
@@ -0,0 +1,98 @@
+"""
+歌曲資料模型測試
+
+測試 lib.songs 的 BPM 解析、與 songs.json 格式的互相轉換，以及攻略內文的延遲載入。
+"""
+import json
+import pytest
+from lib.services.chat_service import build_songs_context
+from lib.songs import Song, parse_bpm, read_songs, write_songs
+
+
+class TestParseBpm:
+    """BPM 字串解析"""
+
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("150", (150.0, 150.0)),
+            ("150-200", (150.0, 200.0)),
+            ("9.38?-150", (9.38, 150.0)),
+            (180, (180.0, 180.0)),
+            ("?", (None, None)),
+            (None, (None, None)),
+        ],
+    )
+    def test_parse(self, value, expected):
+        assert parse_bpm(value) == expected
+
+
+class TestSong:
+    """Song 與 songs.json 格式的轉換"""
+
+    def test_from_dict_parses_numeric_fields(self, sample_song_data):
+        song = Song.from_dict(sample_song_data)
+        assert (song.bpm_min, song.bpm_max) == (150.0, 200.0)
+        assert song.oni == 8
+        assert song.features == ("高BPM", "變速")
+        assert song.key == "100001"
+        assert not hasattr(song, "__dict__")
+
+    def test_round_trip_keeps_unknown_fields(self, sample_song_data):
+        data = {**sample_song_data, "difficulty": {"oni": 8, "hard": 6}, "strategy_text": "攻略", "source": "wiki"}
+        assert Song.from_dict(data).to_dict() == data
+
+    def test_unparsable_numbers_round_trip(self, sample_song_data):
+        """無法解析的星數與連段數以 0 / None 參與計算，寫回時保留原始值"""
+        data = {**sample_song_data, "difficulty": {"oni": "10+", "hard": 6}, "max_combo": "?"}
+        song = Song.from_dict(data)
+        assert song.oni == 0
+        assert song.max_combo is None
+        assert song.to_dict() == data
+
+    def test_assigned_numbers_replace_raw_values(self, sample_song_data):
+        """重新指定 oni / max_combo 後寫回新值，不再寫回原始值"""
+        data = {**sample_song_data, "difficulty": {"oni": "10+", "hard": 6}, "max_combo": "?"}
+        song = Song.from_dict(data)
+        song.max_combo = 1234
+        song.oni = 9
+        written = song.to_dict()
+        assert written["max_combo"] == 1234
+        assert written["difficulty"] == {"oni": 9, "hard": 6}
+        assert Song.from_dict(written).to_dict() == written
+
+    def test_assigned_features_are_interned(self):
+        song = Song(id=1, title="曲")
+        song.features = ["".join(["變", "速"])]
+        assert song.features == ("變速",)
+        assert song.features[0] is Song.from_dict({"features": ["變速"]}).features[0]
+
+    def test_genre_and_features_are_interned(self):
+        first = Song.from_dict({"genre": "".join(["ポップ", "ス"]), "features": ["".join(["變", "速"])]})
+        second = Song.from_dict({"genre": "ポップス", "features": ["變速"]})
+        assert first.genre is second.genre
+        assert first.features[0] is second.features[0]
+
+    def test_strategy_text_loader_is_called_on_access(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            return "長篇攻略"
+
+        song = Song(id=1, title="曲", strategy_text=load)
+        assert calls == []
+        assert song.strategy_text == "長篇攻略"
+        assert song.to_dict()["strategy_text"] == "長篇攻略"
+        assert len(calls) == 2
+
+    def test_read_and_write_songs(self, tmp_path, sample_song_data):
+        path = tmp_path / "songs.json"
+        path.write_text(json.dumps([sample_song_data]), encoding="utf-8")
+        songs = read_songs(str(path))
+        write_songs(songs, str(path))
+        assert json.loads(path.read_text(encoding="utf-8")) == [sample_song_data]
+
+    def test_songs_context_renders_songs_json_format(self, sample_song_data):
+        context = build_songs_context([Song.from_dict(sample_song_data)])
+        assert json.loads(context) == [sample_song_data]
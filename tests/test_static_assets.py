@@ -0,0 +1,126 @@
+"""
+前端靜態資源測試
+
+測試 lib.static_assets 的範本切割、雜湊網址、預先壓縮與 mtime 重新載入。
+"""
+import gzip
+import os
+import re
+import time
+import pytest
+from fastapi.testclient import TestClient
+from lib.static_assets import StaticSite, etag_matches, parse_accept_encoding
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "index.html").write_text(
+        '<link href="/static/style.css"><script nonce="{CSP_NONCE}" src="/static/app.js"></script>',
+        encoding="utf-8",
+    )
+    (tmp_path / "app.js").write_text("console.log('taiko');" * 50, encoding="utf-8")
+    (tmp_path / "style.css").write_text("body { color: red; }", encoding="utf-8")
+    return tmp_path
+
+
+class TestStaticSite:
+    """StaticSite 行為測試"""
+
+    def test_render_fills_nonce_and_hashed_urls(self, static_dir):
+        site = StaticSite(str(static_dir))
+        html = site.render("abc123")
+        assert 'nonce="abc123"' in html
+        assert re.search(r'src="/assets/app\.[0-9a-f]{12}\.js"', html)
+        assert "/static/" not in html
+        # 含 nonce 的範本不提供驗證器
+        assert site.index is None
+
+    def test_asset_variants_selected_by_accept_encoding(self, static_dir):
+        site = StaticSite(str(static_dir))
+        url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', site.render("n")).group(0)
+        asset = site.asset(url)
+        encoding, body = asset.select("gzip, deflate")
+        assert encoding == "gzip"
+        assert gzip.decompress(body) == asset.variants["identity"]
+        assert asset.select("br;q=0, gzip;q=0")[0] == "identity"
+        assert asset.select(None)[0] == "identity"
+
+    def test_each_variant_has_its_own_etag(self, static_dir):
+        site = StaticSite(str(static_dir))
+        url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', site.render("n")).group(0)
+        etags = site.asset(url).etags
+        assert set(etags) == set(site.asset(url).variants)
+        assert len(set(etags.values())) == len(etags)
+        assert etags["gzip"] == etags["identity"][:-1] + '-gzip"'
+
+    def test_etag_matches_uses_weak_comparison(self):
+        assert etag_matches('W/"abc", "def"', '"abc"')
+        assert etag_matches("*", '"abc"')
+        assert not etag_matches('"abc-gzip"', '"abc"')
+        assert not etag_matches(None, '"abc"')
+
+    def test_auto_reload_on_mtime_change(self, static_dir):
+        site = StaticSite(str(static_dir), auto_reload=True)
+        first_url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', site.render("n")).group(0)
+        app_js = static_dir / "app.js"
+        app_js.write_text("console.log('changed');", encoding="utf-8")
+        os.utime(app_js, (time.time() + 5, time.time() + 5))
+        second_url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', site.render("n")).group(0)
+        assert first_url != second_url
+        assert site.asset(first_url) is None
+
+    def test_without_auto_reload_template_is_cached(self, static_dir):
+        site = StaticSite(str(static_dir))
+        site.render("n")
+        (static_dir / "index.html").write_text("changed", encoding="utf-8")
+        assert "changed" not in site.render("n")
+
+    def test_parse_accept_encoding(self):
+        assert parse_accept_encoding("br;q=0.5, gzip") == {"br": 0.5, "gzip": 1.0}
+
+
+class TestStaticRoutes:
+    """主頁與資源端點測試"""
+
+    @pytest.fixture
+    def client(self):
+        from server import app
+        return TestClient(app)
+
+    def test_index_supports_etag(self, client):
+        response = client.get("/")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert response.headers["Cache-Control"] == "no-cache"
+        cached = client.get("/", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+
+    def test_index_etag_differs_per_encoding(self, client):
+        plain = client.get("/", headers={"Accept-Encoding": "identity"})
+        compressed = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in plain.headers
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert plain.headers["ETag"] != compressed.headers["ETag"]
+        # 以未壓縮版本的 ETag 詢問壓縮版本，不應回傳 304
+        stale = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+        assert stale.status_code == 200
+        assert stale.text == plain.text
+
+    def test_asset_304_matches_selected_variant(self, client):
+        url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', client.get("/").text).group(0)
+        gzip_etag = client.get(url, headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+        assert client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag}).status_code == 304
+        assert client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": gzip_etag}).status_code == 200
+
+    def test_hashed_asset_is_immutable_and_precompressed(self, client):
+        html = client.get("/").text
+        url = re.search(r'/assets/app\.[0-9a-f]{12}\.js', html).group(0)
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert "immutable" in response.headers["Cache-Control"]
+        assert "sendMessage" in response.text
+
+    def test_unknown_asset_returns_404(self, client):
+        assert client.get("/assets/app.000000000000.js").status_code == 404
@@ -0,0 +1,217 @@
+"""
+上游串流中止測試
+
+使用模擬的慢速上游驗證客戶端斷線時會立即中止 Gemini 串流。
+"""
+import asyncio
+import json
+import threading
+import time
+import pytest
+from lib.streaming import UpstreamPump, StreamStats, stream_upstream_text
+import lib.streaming as streaming
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeSlowUpstream:
+    """每個區塊之間延遲 delay 秒的模擬上游串流。"""
+
+    def __init__(self, chunks: int = 20, delay: float = 0.05):
+        self.chunks = chunks
+        self.delay = delay
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def __call__(self):
+        try:
+            for i in range(self.chunks):
+                time.sleep(self.delay)
+                self.produced += 1
+                yield FakeChunk(f"段落{i} ")
+        finally:
+            self.closed.set()
+
+
+def disconnect_after(seconds: float):
+    async def receive():
+        await asyncio.sleep(seconds)
+        return {"type": "http.disconnect"}
+    return receive
+
+
+def never_disconnect():
+    async def receive():
+        await asyncio.Event().wait()
+    return receive
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = StreamStats(expected_output_tokens=600)
+    monkeypatch.setattr(streaming, "stream_stats", stats)
+    return stats
+
+
+class TestDisconnectCancellation:
+    """客戶端斷線測試"""
+
+    def test_disconnect_aborts_upstream(self, fresh_stats):
+        upstream = FakeSlowUpstream(chunks=40, delay=0.05)
+        completed = []
+
+        async def consume():
+            pump = UpstreamPump(upstream)
+            stream = stream_upstream_text(
+                pump, disconnect_after(0.2), on_complete=lambda text, elapsed: completed.append(text)
+            )
+            return [chunk async for chunk in stream]
+
+        started = time.perf_counter()
+        received = asyncio.run(consume())
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 1.0
+        assert 0 < len(received) < upstream.chunks
+        assert upstream.closed.wait(timeout=1.0)
+        assert upstream.produced < upstream.chunks
+        assert completed == []
+        snapshot = fresh_stats.snapshot()
+        assert snapshot["cancelled_streams"] == 1
+        assert snapshot["tokens_saved"] > 0
+
+    def test_consumer_cancellation_aborts_upstream(self, fresh_stats):
+        upstream = FakeSlowUpstream(chunks=40, delay=0.05)
+
+        async def consume():
+            pump = UpstreamPump(upstream)
+            async for _ in stream_upstream_text(pump, never_disconnect()):
+                pass
+
+        async def run():
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        assert upstream.closed.wait(timeout=1.0)
+        assert upstream.produced < upstream.chunks
+        assert fresh_stats.snapshot()["cancelled_streams"] == 1
+
+    def test_cancel_event_aborts_upstream(self, fresh_stats):
+        upstream = FakeSlowUpstream(chunks=40, delay=0.05)
+
+        async def consume():
+            cancel_event = asyncio.Event()
+            asyncio.get_running_loop().call_later(0.2, cancel_event.set)
+            pump = UpstreamPump(upstream)
+            return [
+                chunk async for chunk in stream_upstream_text(
+                    pump, never_disconnect(), cancel_event=cancel_event
+                )
+            ]
+
+        received = asyncio.run(consume())
+        assert 0 < len(received) < upstream.chunks
+        assert upstream.closed.wait(timeout=1.0)
+        assert fresh_stats.snapshot()["cancelled_streams"] == 1
+
+    def test_completed_stream_calls_on_complete(self, fresh_stats):
+        upstream = FakeSlowUpstream(chunks=3, delay=0)
+        completed = []
+
+        async def consume():
+            pump = UpstreamPump(upstream)
+            stream = stream_upstream_text(
+                pump, never_disconnect(), on_complete=lambda text, elapsed: completed.append(text)
+            )
+            return [chunk async for chunk in stream]
+
+        received = asyncio.run(consume())
+        assert "".join(received) == "段落0 段落1 段落2 "
+        assert completed == ["段落0 段落1 段落2 "]
+        snapshot = fresh_stats.snapshot()
+        assert snapshot["completed_streams"] == 1
+        assert snapshot["cancelled_streams"] == 0
+
+
+class TestChatRouteDisconnect:
+    """透過 ASGI 介面驗證聊天端點在斷線時中止上游"""
+
+    def test_chat_endpoint_stops_upstream_on_disconnect(self, monkeypatch, fresh_stats):
+        from server import app
+        from api.chat import route as chat_route
+        from lib.rate_limiter import limiter
+
+        upstream = FakeSlowUpstream(chunks=40, delay=0.05)
+
+        class FakeModels:
+            @staticmethod
+            def generate_content_stream(model, contents):
+                return upstream()
+
+        class FakeClient:
+            models = FakeModels()
+
+        monkeypatch.setattr(chat_route, "validate_token", lambda code: True)
+        monkeypatch.setattr(chat_route, "get_user_profile", lambda code: None)
+        monkeypatch.setattr(chat_route.config, "ANSWER_CACHE_ENABLED", False)
+        app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+        app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+        limiter._storage.reset()
+
+        body = json.dumps({"message": "hello", "history": []}).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/chat",
+            "raw_path": b"/api/chat",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"authorization", b"Bearer test-code"),
+            ],
+            "client": ("127.0.0.1", 12345),
+            "server": ("localhost", 80),
+        }
+        body_chunks = []
+
+        async def run():
+            first_chunk = asyncio.Event()
+            request_sent = False
+
+            async def receive():
+                nonlocal request_sent
+                if not request_sent:
+                    request_sent = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                await first_chunk.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.body" and message.get("body"):
+                    body_chunks.append(message["body"])
+                    first_chunk.set()
+
+            await asyncio.wait_for(app(scope, receive, send), timeout=2.0)
+
+        try:
+            asyncio.run(run())
+        finally:
+            app.dependency_overrides.clear()
+            limiter._storage.reset()
+
+        assert 0 < len(body_chunks) < upstream.chunks
+        assert upstream.closed.wait(timeout=1.0)
+        assert fresh_stats.snapshot()["cancelled_streams"] == 1
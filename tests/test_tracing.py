@@ -0,0 +1,121 @@
+"""
+請求追蹤測試
+
+驗證 request id 與用戶上下文的傳遞、Server-Timing 標頭、串流結束日誌與 span 匯出。
+"""
+import json
+import logging
+import pytest
+from fastapi.testclient import TestClient
+import lib.tracing as tracing
+from lib.tracing import JsonFormatter, RequestContextFilter, SpanFileExporter, hash_user
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+@pytest.fixture
+def chat_app(monkeypatch):
+    from server import app
+    from api.chat import route as chat_route
+    from lib.rate_limiter import limiter
+
+    class FakeChunk:
+        def __init__(self, text: str):
+            self.text = text
+
+    class FakeModels:
+        @staticmethod
+        def generate_content_stream(model, contents):
+            logging.getLogger("tests.fake_gemini").info("上游開始串流")
+            return [FakeChunk("推薦"), FakeChunk("這首歌")]
+
+    class FakeClient:
+        models = FakeModels()
+
+    monkeypatch.setattr(chat_route, "validate_token", lambda code: tracing.bind_user(code) or True)
+    monkeypatch.setattr(chat_route, "get_user_profile", lambda code: None)
+    monkeypatch.setattr(chat_route.config, "ANSWER_CACHE_ENABLED", False)
+    app.dependency_overrides[chat_route.get_client] = lambda: FakeClient()
+    app.dependency_overrides[chat_route.get_snapshot] = lambda: chat_route.ResourceSnapshot()
+    limiter._storage.reset()
+    yield app
+    app.dependency_overrides.clear()
+    limiter._storage.reset()
+
+
+def post_chat(app, **headers):
+    return TestClient(app).post(
+        "/api/chat",
+        json={"message": "hello"},
+        headers={"Authorization": "Bearer trace-code", **headers},
+    )
+
+
+class TestRequestContext:
+    """請求上下文與標頭測試"""
+
+    def test_server_timing_on_plain_response(self):
+        from server import app
+
+        response = TestClient(app).get("/livez", headers={"X-Request-Id": "req-123"})
+        assert response.headers["X-Request-Id"] == "req-123"
+        assert "total;dur=" in response.headers["Server-Timing"]
+
+    def test_invalid_request_id_replaced(self):
+        from server import app
+
+        response = TestClient(app).get("/livez", headers={"X-Request-Id": "bad id\n"})
+        assert response.headers["X-Request-Id"] != "bad id\n"
+
+    def test_context_propagates_to_service_logs(self, chat_app, caplog):
+        caplog.handler.addFilter(RequestContextFilter())
+        with caplog.at_level(logging.INFO):
+            response = post_chat(chat_app, **{"X-Request-Id": "req-ctx"})
+        assert response.text == "推薦這首歌"
+        upstream_log = next(r for r in caplog.records if r.getMessage() == "上游開始串流")
+        assert upstream_log.request_id == "req-ctx"
+        assert upstream_log.user == hash_user("trace-code")
+        assert upstream_log.route == "/api/chat"
+
+    def test_stream_gets_pre_stream_timing_and_trailing_log(self, chat_app, caplog):
+        with caplog.at_level(logging.INFO, logger="lib.middleware.tracing"):
+            response = post_chat(chat_app)
+        timing = response.headers["Server-Timing"]
+        assert "retrieval;dur=" in timing
+        assert "prompt;dur=" in timing
+        trailing = next(r for r in caplog.records if r.getMessage() == "請求完成")
+        assert trailing.streamed is True
+        assert "stream" in trailing.stages
+        assert trailing.status == 200
+
+
+class TestJsonFormatter:
+    """JSON 日誌格式測試"""
+
+    def test_formats_extra_fields(self):
+        record = logging.LogRecord("taiko", logging.INFO, __file__, 1, "你好 %s", ("玩家",), None)
+        record.request_id = "abc"
+        record.stages = {"prompt": 1.5}
+        payload = json.loads(JsonFormatter().format(record))
+        assert payload["message"] == "你好 玩家"
+        assert payload["request_id"] == "abc"
+        assert payload["stages"] == {"prompt": 1.5}
+        assert payload["level"] == "INFO"
+
+
+class TestSpanExport:
+    """OTLP/JSON span 匯出測試"""
+
+    def test_spans_written_with_incoming_trace_id(self, chat_app, tmp_path, monkeypatch):
+        path = tmp_path / "spans.jsonl"
+        monkeypatch.setattr(tracing, "span_exporter", SpanFileExporter(str(path)))
+        post_chat(chat_app, traceparent=f"00-{TRACE_ID}-00f067aa0ba902b7-01")
+
+        line = json.loads(path.read_text(encoding="utf-8").splitlines()[-1])
+        spans = line["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root = spans[0]
+        assert root["traceId"] == TRACE_ID
+        assert root["parentSpanId"] == "00f067aa0ba902b7"
+        names = {span["name"] for span in spans[1:]}
+        assert {"retrieval", "prompt", "llm_ttft", "stream"} <= names
+        assert all(span["parentSpanId"] == root["spanId"] for span in spans[1:])
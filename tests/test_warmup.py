@@ -0,0 +1,166 @@
+"""
+啟動預熱測試
+
+測試 lib.warmup 的各預熱步驟、耗時紀錄，以及就緒探測器等待預熱完成的行為。
+"""
+import asyncio
+import json
+import threading
+import pytest
+from lib import warmup as warmup_module
+from lib.health import ProbeCheck, ReadinessProber
+from lib.songs import Song
+from lib.warmup import Warmup, pretouch_directory
+
+SONG = {"id": 1, "title": "テストソング", "difficulty": {"oni": 8}}
+
+
+class FakeCollection:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10):
+        self.queries.append(query_texts or query_embeddings)
+        return {"ids": [["1"]], "metadatas": [[{"json": json.dumps(SONG)}]]}
+
+
+@pytest.fixture
+def fake_resources(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(warmup_module, "get_collection", lambda: collection)
+    monkeypatch.setattr(warmup_module, "get_client", lambda: object())
+    monkeypatch.setattr(warmup_module, "get_all_songs", lambda: [Song.from_dict(SONG)])
+    return collection
+
+
+class TestPretouch:
+    """索引檔預讀"""
+
+    def test_counts_files_and_bytes(self, tmp_path):
+        (tmp_path / "segment").mkdir()
+        (tmp_path / "segment" / "data_level0.bin").write_bytes(b"x" * 10000)
+        (tmp_path / "chroma.sqlite3").write_bytes(b"y" * 100)
+        (tmp_path / "empty.bin").write_bytes(b"")
+        assert pretouch_directory(str(tmp_path)) == (3, 10100)
+
+    def test_missing_directory(self, tmp_path):
+        assert pretouch_directory(str(tmp_path / "missing")) == (0, 0)
+
+
+class TestWarmup:
+    """預熱步驟與耗時紀錄"""
+
+    def test_runs_all_steps_in_foreground(self, tmp_path, fake_resources):
+        (tmp_path / "index.bin").write_bytes(b"x" * 4096)
+        warmup = Warmup(["推薦 鬼 8星", "新手歌曲"])
+        warmup.start(str(tmp_path), background=False)
+
+        snapshot = warmup.snapshot()
+        assert snapshot["status"] == "done"
+        assert list(snapshot["steps"]) == ["index_files", "chroma", "encoder_load", "encoder", "retrieval", "prompt", "gemini"]
+        assert all(step["ok"] for step in snapshot["steps"].values())
+        assert all(step["duration_ms"] >= 0 for step in snapshot["steps"].values())
+        assert snapshot["duration_ms"] >= 0
+        # 每筆金絲雀查詢都走過檢索
+        assert len(fake_resources.queries) == 2
+
+    def test_failed_step_does_not_stop_others(self, tmp_path, monkeypatch, fake_resources):
+        monkeypatch.setattr(warmup_module, "get_collection", lambda: None)
+        monkeypatch.setattr(warmup_module, "get_client", lambda: None)
+        warmup = Warmup(["推薦"])
+        warmup.start(str(tmp_path / "missing"), background=False)
+
+        steps = warmup.snapshot()["steps"]
+        assert steps["chroma"]["ok"] is False
+        assert steps["gemini"]["ok"] is False
+        assert "略過" in steps["retrieval"]["detail"]
+        # 沒有檢索結果時以歌曲資料構建 prompt
+        assert steps["prompt"]["ok"] is True
+        assert warmup.snapshot()["status"] == "done"
+
+    def test_init_resources_runs_warmup(self, tmp_path, monkeypatch, fake_resources):
+        from lib import dependencies
+
+        songs_path = tmp_path / "songs.json"
+        songs_path.write_text(json.dumps([SONG]), encoding="utf-8")
+        warmup = Warmup(["推薦"])
+        monkeypatch.setattr(warmup_module, "warmup", warmup)
+        try:
+            dependencies.init_resources(
+                "", str(tmp_path), "songs", str(songs_path), run_warmup=True, warmup_in_background=False
+            )
+        finally:
+            dependencies.cleanup_resources()
+        assert warmup.snapshot()["status"] == "done"
+
+
+    def test_encoder_loads_in_background_warmup(self, tmp_path, monkeypatch, fake_resources):
+        """init_resources 不等待模型載入，模型在預熱執行緒中載入"""
+        from lib import dependencies
+        from lib.embeddings import query_encoder
+
+        unblock = threading.Event()
+        loaded_in = []
+
+        def slow_load():
+            loaded_in.append(threading.current_thread().name)
+            unblock.wait(5)
+            return False
+
+        monkeypatch.setattr(query_encoder, "load", slow_load)
+        songs_path = tmp_path / "songs.json"
+        songs_path.write_text(json.dumps([SONG]), encoding="utf-8")
+        warmup = Warmup(["推薦"])
+        monkeypatch.setattr(warmup_module, "warmup", warmup)
+        try:
+            dependencies.init_resources(
+                "", str(tmp_path), "songs", str(songs_path), run_warmup=True, warmup_in_background=True
+            )
+            assert warmup.running
+            unblock.set()
+            asyncio.run(asyncio.wait_for(warmup.wait(), timeout=5))
+        finally:
+            unblock.set()
+            dependencies.cleanup_resources()
+        assert loaded_in and set(loaded_in) == {"warmup"}
+        assert "未載入" in warmup.snapshot()["steps"]["encoder_load"]["detail"]
+
+
+class TestReadinessWaitsForWarmup:
+    """預熱完成前不回報就緒"""
+
+    def test_probe_starts_after_background_warmup(self, tmp_path, monkeypatch, fake_resources):
+        unblock = threading.Event()
+        original = Warmup._step_gemini
+
+        def blocking_step(self):
+            unblock.wait(5)
+            return original(self)
+
+        monkeypatch.setattr(Warmup, "_step_gemini", blocking_step)
+        warmup = Warmup(["推薦"])
+        prober = ReadinessProber([ProbeCheck("a", lambda: None)], interval=0.01, timeout=0.5, warmup=warmup)
+
+        async def run():
+            warmup.start(str(tmp_path), background=True)
+            prober.start()
+            await asyncio.sleep(0.1)
+            during = prober.snapshot()
+            unblock.set()
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if prober.snapshot()["status"] == "ready":
+                    break
+            await prober.stop()
+            return during, prober.snapshot()
+
+        during, after = asyncio.run(run())
+        assert during["status"] == "starting"
+        assert during["warmup"]["status"] == "running"
+        assert after["status"] == "ready"
+        assert after["warmup"]["status"] == "done"
+
+    def test_no_warmup_started_does_not_block(self):
+        warmup = Warmup(["推薦"])
+        asyncio.run(asyncio.wait_for(warmup.wait(), timeout=1))
+        assert warmup.snapshot()["status"] == "pending"